@@ -0,0 +1,55 @@
+# -*- coding: utf-8 -*-
+"""Compares the throughput of the fluent record formatters."""
+
+import logging
+import os
+import sys
+import timeit
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                '..', 'fluentlogger', 'lib'))
+
+from fluent import handler
+
+FMT = {
+    'sys_host': '%(hostname)s',
+    'sys_name': '%(name)s',
+    'sys_module': '%(module)s',
+    'where': '%(funcName)s:%(lineno)d',
+}
+
+MESSAGES = {
+    'string': ('user %s logged in', ('alice',)),
+    'dict': ({'event': 'login', 'user': 'alice'}, None),
+    'json': ('{"event": "login", "user": "alice"}', None),
+}
+
+
+def make_record(msg, args):
+    return logging.LogRecord('bench', logging.INFO, __file__, 42, msg, args,
+                             None, 'make_record')
+
+
+def bench(formatter, record, number):
+    return number / min(timeit.repeat(lambda: formatter.format(record),
+                                      repeat=3, number=number))
+
+
+def main(number=20000):
+    base = handler.FluentRecordFormatter(FMT)
+    fast = handler.FastFluentRecordFormatter(FMT)
+    print('%-8s %14s %14s %8s' % ('message', 'base rec/s', 'fast rec/s',
+                                  'speedup'))
+    for name in sorted(MESSAGES):
+        msg, args = MESSAGES[name]
+        record = make_record(msg, args)
+        assert base.format(make_record(msg, args)) == \
+            fast.format(make_record(msg, args)), name
+        base_rate = bench(base, record, number)
+        fast_rate = bench(fast, record, number)
+        print('%-8s %14.0f %14.0f %7.2fx' % (name, base_rate, fast_rate,
+                                              fast_rate / base_rate))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,289 @@
+# -*- coding: utf-8 -*-
+"""In-process stand-in for the NAOqi ``qi`` module.
+
+Put this directory first on ``sys.path`` to import `FluentLoggerService`
+without a robot. `Session` offers scriptable ALMemory,
+ALPreferenceManager and LogManager services; `LogFlood` feeds log
+messages at a given rate and category mix.
+
+The delays given to ``qi.async`` are multiplied by `time_scale`, so that
+soak runs see many metrics ticks.
+"""
+
+import itertools
+import random
+import socket
+import threading
+import time
+
+time_scale = 1.0
+
+_timers = []
+
+
+def _async(callback, *args, **kwargs):
+    """``qi.async(callback, *args, delay=usec)``."""
+    delay = kwargs.pop('delay', 0) / 1e6 * time_scale
+    timer = threading.Timer(delay, callback, args, kwargs)
+    timer.daemon = True
+    timer.start()
+    _timers.append(timer)
+    del _timers[:-64]
+    return timer
+
+# ``async`` is a keyword on Python 3.7+
+globals()['async'] = _async
+
+
+def cancel_timers():
+    for timer in _timers:
+        timer.cancel()
+    del _timers[:]
+
+
+class Signal(object):
+    def __init__(self):
+        self.links = {}
+        self._ids = itertools.count(1)
+        self.lock = threading.Lock()
+
+    def connect(self, callback):
+        with self.lock:
+            link = next(self._ids)
+            self.links[link] = callback
+        return link
+
+    def disconnect(self, link):
+        with self.lock:
+            return self.links.pop(link, None) is not None
+
+    def __call__(self, *args):
+        with self.lock:
+            callbacks = list(self.links.values())
+        for callback in callbacks:
+            callback(*args)
+
+
+class _Subscriber(object):
+    def __init__(self):
+        self.signal = Signal()
+
+
+class ALMemory(object):
+    """Key/value store with injectable latency and failures.
+
+    :param latency: seconds added to every read.
+    :param failure_rate: probability that a read raises RuntimeError.
+    :param failing: keys whose reads always raise RuntimeError.
+    """
+    def __init__(self, values=None, latency=0.0, failure_rate=0.0,
+                 failing=()):
+        self.values = {'DCM/Time': 0, 'DCM/Simulation': 0,
+                       'BatteryChargeChanged': 80,
+                       'BatteryPowerPluggedChanged': 1}
+        self.values.update(values or {})
+        self.latency = latency
+        self.failure_rate = failure_rate
+        self.failing = set(failing)
+        self.subscribers = {}
+        self.reads = 0
+        self.failures = 0
+
+    def getData(self, key):
+        self._access(key)
+        if key not in self.values:
+            # sensors the service reads without configuring them
+            return 40.0
+        return self.values[key]
+
+    def getListData(self, keys):
+        self._access(None)
+        for key in keys:
+            if key in self.failing:
+                self._fail(key)
+        return [self.values.get(key, 40.0) for key in keys]
+
+    def insertData(self, key, value):
+        self.values[key] = value
+
+    def raiseEvent(self, key, value):
+        self.values[key] = value
+        subscriber = self.subscribers.get(key)
+        if subscriber is not None:
+            subscriber.signal(value)
+
+    def subscriber(self, key):
+        return self.subscribers.setdefault(key, _Subscriber())
+
+    def _access(self, key):
+        self.reads += 1
+        if self.latency:
+            time.sleep(self.latency)
+        if key in self.failing or \
+                (self.failure_rate and random.random() < self.failure_rate):
+            self._fail(key)
+
+    def _fail(self, key):
+        self.failures += 1
+        raise RuntimeError('ALMemory::getData failed for %s' % key)
+
+
+class ALPreferenceManager(object):
+    def __init__(self, preferences=None):
+        # domain -> {name: value}
+        self.domains = {}
+        for domain, values in (preferences or {}).items():
+            self.domains[domain] = dict(values)
+
+    def getValue(self, domain, name):
+        return self.domains.get(domain, {}).get(name)
+
+    def setValue(self, domain, name, value):
+        self.domains.setdefault(domain, {})[name] = value
+
+    def getValueList(self, domain):
+        return [[name, value]
+                for name, value in self.domains.get(domain, {}).items()]
+
+
+class LogListener(object):
+    def __init__(self, manager):
+        self.manager = manager
+        self.onLogMessage = Signal()
+        self.level = 4
+        self.filters = {}
+
+    def setLevel(self, level):
+        self.level = level
+
+    def addFilter(self, category, level):
+        self.filters[category] = level
+
+    def clearFilters(self):
+        self.filters = {}
+
+    def accepts(self, msg):
+        level = self.level
+        for pattern, patternLevel in self.filters.items():
+            if pattern == msg['category'] or (
+                    pattern.endswith('*') and
+                    msg['category'].startswith(pattern[:-1])):
+                level = patternLevel
+        return msg['level'] <= level
+
+
+class LogManager(object):
+    def __init__(self):
+        self.listeners = []
+        self.published = 0
+
+    def createListener(self):
+        listener = LogListener(self)
+        self.listeners.append(listener)
+        return listener
+
+    def publish(self, msg):
+        self.published += 1
+        for listener in list(self.listeners):
+            if listener.accepts(msg):
+                listener.onLogMessage(msg)
+
+
+class Session(object):
+    def __init__(self, memory=None, preferences=None, log_manager=None):
+        self.services = {
+            'ALMemory': memory or ALMemory(),
+            'ALPreferenceManager': preferences or ALPreferenceManager(),
+            'LogManager': log_manager or LogManager(),
+        }
+
+    def service(self, name):
+        try:
+            return self.services[name]
+        except KeyError:
+            raise RuntimeError('Cannot find service \'%s\'' % name)
+
+    def registerService(self, name, obj):
+        self.services[name] = obj
+        return len(self.services)
+
+
+class Application(object):
+    def __init__(self, args=None, url=None):
+        self.session = Session()
+        self.stopped = threading.Event()
+
+    def start(self):
+        pass
+
+    def run(self):
+        while not self.stopped.wait(1):
+            pass
+
+    def stop(self):
+        self.stopped.set()
+
+
+# category -> (weight, level); levels follow qi: 1 fatal ... 6 debug
+DEFAULT_MIX = {'ALMemory': (30, 4), 'ALMotion': (20, 5),
+               'ALDialog': (20, 4), 'ALAudioDevice': (10, 3),
+               'myapp.behavior': (15, 6), 'qimessaging.session': (5, 2)}
+
+
+class LogFlood(object):
+    """Publishes log messages to a `LogManager` from a background thread.
+
+    :param rate: messages per second.
+    :param mix: category -> (weight, level).
+    :param templates: distinct message texts per category; small values
+      exercise the throttle and the compact encoder string tables.
+    """
+    def __init__(self, log_manager, rate=100, mix=None, templates=20):
+        self.log_manager = log_manager
+        self.rate = rate
+        self.templates = templates
+        mix = mix or DEFAULT_MIX
+        self.choices = []
+        for category, (weight, level) in sorted(mix.items()):
+            self.choices.extend([(category, level)] * weight)
+        self.sent = 0
+        self.running = False
+        self.thread = None
+        self.location = '%s:%d' % (socket.gethostname(), 4242)
+
+    def message(self, i):
+        category, level = self.choices[i % len(self.choices)]
+        now = int(time.time() * 1e9)
+        return {'source': '%s.cpp:run:%d' % (category, i % 50),
+                'level': level,
+                'category': category,
+                'location': self.location,
+                'message': 'step %d done after %d ms' % (
+                    i % self.templates, i % 997),
+                'id': i,
+                'date': now,
+                'systemDate': now}
+
+    def start(self):
+        self.running = True
+        self.thread = threading.Thread(target=self._run, name='LogFlood')
+        self.thread.daemon = True
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.running = False
+        if self.thread is not None:
+            self.thread.join(5)
+
+    def _run(self):
+        # publish in small bursts to keep the timing overhead low
+        burst = max(1, int(self.rate / 100))
+        started = time.time()
+        while self.running:
+            for _ in range(burst):
+                self.log_manager.publish(self.message(self.sent))
+                self.sent += 1
+            delay = started + float(self.sent) / self.rate - time.time()
+            if delay > 0:
+                time.sleep(delay)
@@ -0,0 +1,228 @@
+# -*- coding: utf-8 -*-
+"""A fake fluentd Forward protocol server for the benchmarks.
+
+It listens on TCP and/or a unix socket, decodes and counts the events,
+and can misbehave on purpose: add latency before acking, drop
+connections after a number of messages and withhold acks. Gzip
+compressed PackedForward messages are accepted.
+"""
+
+import errno
+import os
+import socket
+import sys
+import time
+import zlib
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                '..', 'fluentlogger', 'lib'))
+
+import msgpack_pure as msgpack
+
+from fluent.eventloop import EventLoop
+
+_AGAIN = (errno.EAGAIN, errno.EWOULDBLOCK, errno.EINTR)
+
+
+class _Connection(object):
+    def __init__(self, sock):
+        self.sock = sock
+        self.inbuf = b''
+        self.messages = 0
+        self.closed = False
+
+
+class FakeFluentd(object):
+    """Forward protocol sink driven by its own `EventLoop` thread.
+
+    :param port: TCP port to listen on, 0 for any, None for no TCP.
+    :param unix_path: unix socket path, or None.
+    :param ack_latency: seconds to wait before sending an ack.
+    :param drop_every: close a connection after this many messages.
+    :param withhold_acks: number of chunks to read without acking them.
+    :param stamp_field: record field holding the time.time() the event
+      was created, used to compute end-to-end latencies.
+    :param sequence_field: record field holding a unique number, used to
+      count duplicates.
+    """
+    def __init__(self, port=0, unix_path=None, ack_latency=0.0,
+                 drop_every=0, withhold_acks=0, stamp_field='sent_at',
+                 sequence_field='seq'):
+        self.port = port
+        self.unix_path = unix_path
+        self.ack_latency = ack_latency
+        self.drop_every = drop_every
+        self.withhold_acks = withhold_acks
+        self.stamp_field = stamp_field
+        self.sequence_field = sequence_field
+
+        self.loop = EventLoop()
+        self.listeners = []
+        self.connections = {}
+        self.reset()
+
+    def reset(self):
+        self.events = 0
+        self.messages = 0
+        self.bytes = 0
+        self.acks = 0
+        self.withheld = 0
+        self.accepted = 0
+        self.dropped = 0
+        self.latencies = []
+        self.tags = {}
+        self.sequences = set()
+
+    def start(self):
+        if self.port is not None:
+            listener = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+            listener.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+            listener.bind(('127.0.0.1', self.port))
+            self.port = listener.getsockname()[1]
+            self._listen(listener)
+        if self.unix_path is not None:
+            if os.path.exists(self.unix_path):
+                os.unlink(self.unix_path)
+            listener = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            listener.bind(self.unix_path)
+            self._listen(listener)
+        self.loop.start()
+        return self
+
+    def stop(self):
+        self.loop.call_soon_threadsafe(self._close_all)
+        time.sleep(0.05)
+        self.loop.stop()
+        if self.unix_path is not None and os.path.exists(self.unix_path):
+            os.unlink(self.unix_path)
+
+    def wait_for(self, events, timeout=30.0):
+        """Wait until `events` events were received, return the count."""
+        deadline = time.time() + timeout
+        while self.events < events and time.time() < deadline:
+            time.sleep(0.005)
+        return self.events
+
+    def _listen(self, listener):
+        listener.setblocking(False)
+        listener.listen(1024)
+        self.listeners.append(listener)
+        self.loop.add_reader(listener, lambda: self._accept(listener))
+
+    def _accept(self, listener):
+        while True:
+            try:
+                sock, _ = listener.accept()
+            except socket.error as e:
+                if e.args[0] in _AGAIN:
+                    return
+                raise
+            sock.setblocking(False)
+            conn = _Connection(sock)
+            self.connections[sock.fileno()] = conn
+            self.accepted += 1
+            self.loop.add_reader(sock, lambda conn=conn: self._read(conn))
+
+    def _read(self, conn):
+        try:
+            data = conn.sock.recv(262144)
+        except socket.error as e:
+            if e.args[0] in _AGAIN:
+                return
+            data = b''
+        if not data:
+            self._close(conn)
+            return
+        self.bytes += len(data)
+        buf = conn.inbuf + data
+        pos = 0
+        now = time.time()
+        while pos < len(buf):
+            try:
+                end = msgpack.skip(buf, pos)
+            except msgpack.OutOfData:
+                break
+            self._handle(conn, msgpack.unpackb(buf[pos:end]), now)
+            pos = end
+            if self.drop_every and conn.messages >= self.drop_every:
+                self.dropped += 1
+                self._close(conn)
+                return
+        conn.inbuf = buf[pos:]
+
+    def _handle(self, conn, message, now):
+        conn.messages += 1
+        self.messages += 1
+        tag = message[0]
+        option = None
+        if isinstance(message[1], (list, tuple)):
+            # Forward mode
+            entries = message[1]
+            if len(message) > 2:
+                option = message[2]
+        elif isinstance(message[1], (bytes, str)):
+            # PackedForward mode, possibly gzip compressed
+            packed = message[1]
+            if len(message) > 2:
+                option = message[2]
+            if option and option.get('compressed') == 'gzip':
+                packed = zlib.decompress(packed, 16 + zlib.MAX_WBITS)
+            entries = self._unpack_entries(packed)
+        else:
+            # Message mode
+            entries = [(message[1], message[2])]
+            if len(message) > 3:
+                option = message[3]
+        self.events += len(entries)
+        self.tags[tag] = self.tags.get(tag, 0) + len(entries)
+        for _, record in entries:
+            if not isinstance(record, dict):
+                continue
+            if self.stamp_field in record:
+                self.latencies.append(now - record[self.stamp_field])
+            if self.sequence_field in record:
+                self.sequences.add((tag, record[self.sequence_field]))
+        if option and 'chunk' in option:
+            if self.withheld < self.withhold_acks:
+                self.withheld += 1
+                return
+            ack = msgpack.packb({'ack': option['chunk']})
+            if self.ack_latency:
+                self.loop.call_later(self.ack_latency, self._ack, conn, ack)
+            else:
+                self._ack(conn, ack)
+
+    def _unpack_entries(self, packed):
+        entries = []
+        pos = 0
+        while pos < len(packed):
+            end = msgpack.skip(packed, pos)
+            entries.append(msgpack.unpackb(packed[pos:end]))
+            pos = end
+        return entries
+
+    def _ack(self, conn, ack):
+        if conn.closed:
+            return
+        try:
+            # acks are tiny, a full socket buffer is not expected here
+            conn.sock.send(ack)
+            self.acks += 1
+        except socket.error:
+            self._close(conn)
+
+    def _close(self, conn):
+        if conn.closed:
+            return
+        conn.closed = True
+        del self.connections[conn.sock.fileno()]
+        self.loop.remove_reader(conn.sock)
+        conn.sock.close()
+
+    def _close_all(self):
+        for conn in list(self.connections.values()):
+            self._close(conn)
+        for listener in self.listeners:
+            self.loop.remove_reader(listener)
+            listener.close()
+        self.listeners = []
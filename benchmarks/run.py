@@ -0,0 +1,525 @@
+# -*- coding: utf-8 -*-
+"""Runs the benchmark scenarios and checks them against thresholds.
+
+    python benchmarks/run.py [--scale 0.2] [--only sender] \\
+        [--output results.json] [--thresholds benchmarks/thresholds.json]
+
+Every scenario returns a dict of metrics. The results are printed as a
+table and optionally written as JSON; the run exits with status 1 when a
+metric crosses its ``min`` or ``max`` in the thresholds file.
+"""
+
+from __future__ import print_function
+
+import argparse
+import json
+import logging
+import os
+import platform
+import shutil
+import signal
+import socket
+import sys
+import tempfile
+import time
+import timeit
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(HERE, '..', 'fluentlogger', 'lib'))
+
+import msgpack_pure as msgpack
+
+from fluent import asynchandler
+from fluent import handler
+from fluent import sender
+from fluent.budget import MemoryBudget
+from fluent.eventloop import EventLoop
+from fluent.loopsender import LoopSender
+from fluent.procsender import ProcessSender
+from linux_metrics import cpu_stat, disk_stat, mem_stat, net_stat
+from linux_metrics.thermal_stat import ThermalStat
+
+from fakesink import FakeFluentd
+
+PROCFS = os.path.join(HERE, 'fixtures', 'procfs')
+SYSFS = os.path.join(HERE, 'fixtures', 'sysfs')
+
+RECORD = {'category': 'ALMemory', 'level': 4, 'source': 'almemory.cpp:42',
+          'message': 'subscriber registered', 'robot': 'pepper-bench'}
+
+SCENARIOS = []
+
+
+def scenario(function):
+    SCENARIOS.append(function)
+    return function
+
+
+def percentile(values, fraction):
+    if not values:
+        return 0.0
+    values = sorted(values)
+    return values[min(int(len(values) * fraction), len(values) - 1)]
+
+
+def latency_metrics(sink):
+    return {'p50_ms': percentile(sink.latencies, 0.50) * 1000,
+            'p99_ms': percentile(sink.latencies, 0.99) * 1000}
+
+
+def stamped(i):
+    record = dict(RECORD)
+    record['seq'] = i
+    record['sent_at'] = time.time()
+    return record
+
+
+def rate(number, function):
+    return number / min(timeit.repeat(function, repeat=3, number=number))
+
+
+# codec
+
+@scenario
+def codec(scale):
+    packed = msgpack.packb(RECORD)
+    number = int(20000 * scale) or 1
+    return {'pack_per_sec': rate(number, lambda: msgpack.packb(RECORD)),
+            'unpack_per_sec': rate(number, lambda: msgpack.unpackb(packed)),
+            'skip_per_sec': rate(number, lambda: msgpack.skip(packed))}
+
+
+# senders
+
+def run_sender(sink, emit, count, settle=None):
+    """Emit `count` events, also timing the emit calls themselves."""
+    calls = []
+    started = time.time()
+    for i in range(count):
+        before = time.time()
+        emit(i)
+        calls.append(time.time() - before)
+    if settle is not None:
+        settle()
+    received = sink.wait_for(count)
+    elapsed = time.time() - started
+    metrics = {'events_per_sec': received / elapsed,
+               'delivered_ratio': float(received) / count,
+               'emit_p50_us': percentile(calls, 0.50) * 1e6,
+               'emit_p99_us': percentile(calls, 0.99) * 1e6}
+    metrics.update(latency_metrics(sink))
+    return metrics
+
+
+@scenario
+def sender_blocking_tcp(scale):
+    sink = FakeFluentd().start()
+    try:
+        fluent_sender = sender.FluentSender('bench', host='127.0.0.1',
+                                            port=sink.port)
+        return run_sender(sink, lambda i: fluent_sender.emit('log',
+                                                             stamped(i)),
+                          int(5000 * scale) or 1)
+    finally:
+        sink.stop()
+
+
+@scenario
+def sender_blocking_unix(scale):
+    path = os.path.join(tempfile.mkdtemp(), 'fluentd.sock')
+    sink = FakeFluentd(port=None, unix_path=path).start()
+    try:
+        fluent_sender = sender.FluentSender('bench', host='unix://' + path)
+        return run_sender(sink, lambda i: fluent_sender.emit('log',
+                                                             stamped(i)),
+                          int(5000 * scale) or 1)
+    finally:
+        sink.stop()
+
+
+@scenario
+def sender_batch(scale):
+    sink = FakeFluentd().start()
+    try:
+        fluent_sender = sender.FluentSender('bench', host='127.0.0.1',
+                                            port=sink.port)
+        batch = []
+
+        def emit(i):
+            batch.append(('log', int(time.time()), stamped(i)))
+            if len(batch) == 100:
+                fluent_sender.emit_batch(batch)
+                del batch[:]
+        metrics = run_sender(sink, emit, int(5000 * scale) or 1,
+                             lambda: fluent_sender.emit_batch(batch))
+        return metrics
+    finally:
+        sink.stop()
+
+
+@scenario
+def sender_loop(scale):
+    sink = FakeFluentd().start()
+    loop = EventLoop()
+    loop.start()
+    try:
+        fluent_sender = LoopSender('bench', loop=loop, host='127.0.0.1',
+                                   port=sink.port)
+        return run_sender(sink, lambda i: fluent_sender.emit('log',
+                                                             stamped(i)),
+                          int(5000 * scale) or 1)
+    finally:
+        loop.stop()
+        sink.stop()
+
+
+@scenario
+def sender_loop_ack(scale):
+    sink = FakeFluentd(ack_latency=0.005).start()
+    loop = EventLoop()
+    loop.start()
+    try:
+        fluent_sender = LoopSender('bench', loop=loop, host='127.0.0.1',
+                                   port=sink.port, require_ack_response=True,
+                                   bufmax=64 * 1024 * 1024)
+        metrics = run_sender(sink, lambda i: fluent_sender.emit('log',
+                                                                stamped(i)),
+                             int(5000 * scale) or 1)
+        stats = fluent_sender.ack_stats()
+        metrics['ack_rtt_avg_ms'] = stats['rtt_avg_ms']
+        metrics['retransmits'] = stats['retransmits']
+        return metrics
+    finally:
+        loop.stop()
+        sink.stop()
+
+
+@scenario
+def sender_process(scale):
+    sink = FakeFluentd().start()
+    fluent_sender = ProcessSender('bench', host='127.0.0.1', port=sink.port)
+    try:
+        return run_sender(sink, lambda i: fluent_sender.emit('log',
+                                                             stamped(i)),
+                          int(5000 * scale) or 1)
+    finally:
+        fluent_sender.close()
+        sink.stop()
+
+
+@scenario
+def handler_async(scale):
+    sink = FakeFluentd().start()
+    log_handler = asynchandler.AsyncFluentHandler(
+        'bench', host='127.0.0.1', port=sink.port, queue_max=100000,
+        flush_interval=0.05)
+    log_handler.setFormatter(handler.FluentRecordFormatter())
+    logger = logging.Logger('bench')
+    logger.addHandler(log_handler)
+    try:
+        return run_sender(sink, lambda i: logger.info(stamped(i)),
+                          int(5000 * scale) or 1)
+    finally:
+        log_handler.close()
+        sink.stop()
+
+
+# failures
+
+@scenario
+def reconnect_storm(scale):
+    """The sink drops the connection every 50 messages."""
+    sink = FakeFluentd(drop_every=50).start()
+    try:
+        fluent_sender = sender.FluentSender('bench', host='127.0.0.1',
+                                            port=sink.port)
+        count = int(2000 * scale) or 1
+        started = time.time()
+        for i in range(count):
+            fluent_sender.emit('log', stamped(i))
+        # events written to a socket the sink closed are lost
+        received = sink.wait_for(count, timeout=2.0)
+        return {'events_per_sec': received / (time.time() - started),
+                'delivered_ratio': float(received) / count,
+                'connections': sink.accepted}
+    finally:
+        sink.stop()
+
+
+@scenario
+def reconnect_storm_ack(scale):
+    """Same storm, at-least-once delivery must not lose anything."""
+    sink = FakeFluentd(drop_every=50).start()
+    loop = EventLoop()
+    loop.start()
+    try:
+        fluent_sender = LoopSender('bench', loop=loop, host='127.0.0.1',
+                                   port=sink.port, require_ack_response=True,
+                                   backoff_min=0.01, backoff_max=0.05,
+                                   bufmax=64 * 1024 * 1024)
+        count = int(2000 * scale) or 1
+        started = time.time()
+        for i in range(count):
+            fluent_sender.emit('log', stamped(i))
+        deadline = time.time() + 60
+        while fluent_sender.buffered and time.time() < deadline:
+            time.sleep(0.01)
+        return {'events_per_sec': count / (time.time() - started),
+                'delivered_ratio': float(len(sink.sequences)) / count,
+                'duplicate_ratio': float(sink.events) / count - 1,
+                'undelivered': fluent_sender.buffered,
+                'connections': sink.accepted,
+                'retransmits': fluent_sender.ack_stats()['retransmits']}
+    finally:
+        loop.stop()
+        sink.stop()
+
+
+@scenario
+def writer_crash(scale):
+    """The writer process is killed twice, the ring must not lose events."""
+    sink = FakeFluentd().start()
+    fluent_sender = ProcessSender('bench', host='127.0.0.1', port=sink.port)
+    try:
+        count = int(2000 * scale) or 1
+        started = time.time()
+        for i in range(count):
+            if i in (count // 3, 2 * count // 3):
+                os.kill(fluent_sender.child.pid, signal.SIGKILL)
+                fluent_sender.child.wait()
+                # let the next emit notice the dead writer
+                fluent_sender._checked = 0
+            fluent_sender.emit('log', stamped(i))
+        deadline = time.time() + 30
+        while fluent_sender.buffered and time.time() < deadline:
+            time.sleep(0.01)
+        # resent events count in sink.events, wait for the unique ones
+        deadline = time.time() + 2.0
+        while len(sink.sequences) < count and time.time() < deadline:
+            time.sleep(0.005)
+        return {'events_per_sec': count / (time.time() - started),
+                'delivered_ratio': float(len(sink.sequences)) / count,
+                'duplicate_ratio': float(sink.events) / count - 1,
+                'undelivered': fluent_sender.buffered,
+                'restarts': fluent_sender.restarts}
+    finally:
+        fluent_sender.close()
+        sink.stop()
+
+
+@scenario
+def withheld_acks(scale):
+    """The sink swallows acks, the sender must time out and resend."""
+    sink = FakeFluentd(withhold_acks=10).start()
+    loop = EventLoop()
+    loop.start()
+    try:
+        fluent_sender = LoopSender('bench', loop=loop, host='127.0.0.1',
+                                   port=sink.port, require_ack_response=True,
+                                   ack_timeout=0.2, backoff_min=0.01)
+        count = int(500 * scale) or 1
+        started = time.time()
+        for i in range(count):
+            fluent_sender.emit('log', stamped(i))
+        deadline = time.time() + 30
+        while fluent_sender.buffered and time.time() < deadline:
+            time.sleep(0.01)
+        stats = fluent_sender.ack_stats()
+        return {'recovery_sec': time.time() - started,
+                'undelivered': fluent_sender.buffered,
+                'timeouts': stats['timeouts'],
+                'retransmits': stats['retransmits']}
+    finally:
+        loop.stop()
+        sink.stop()
+
+
+@scenario
+def memory_budget(scale):
+    """The sink is down: bulk is shed, then spilled, critical stays in
+    memory."""
+    probe = socket.socket()
+    probe.bind(('127.0.0.1', 0))
+    port = probe.getsockname()[1]
+    probe.close()
+    spill_dir = tempfile.mkdtemp()
+    budget = MemoryBudget(64 * 1024, 128 * 1024, check_interval=0)
+    fluent_sender = sender.FluentSender('bench', host='127.0.0.1', port=port,
+                                        timeout=0.05, budget=budget,
+                                        spill_dir=spill_dir)
+    budget.register('sender', fluent_sender)
+    sink = FakeFluentd(port=port)
+    try:
+        count = int(3000 * scale) or 10
+        counts = [0, 0, 0]
+        peak = 0
+        for i in range(count):
+            # critical is never spilled, it must fit under the soft limit
+            if i % 10 == 0:
+                priority = sender.PRIORITY_CRITICAL
+            elif i % 2:
+                priority = sender.PRIORITY_NORMAL
+            else:
+                priority = sender.PRIORITY_BULK
+            counts[priority] += 1
+            fluent_sender.emit(sender.PRIORITY_NAMES[priority], stamped(i),
+                               priority)
+            peak = max(peak, budget.total())
+        sink.start()
+        fluent_sender.emit('critical', stamped(count), sender.PRIORITY_CRITICAL)
+        critical = counts[sender.PRIORITY_CRITICAL] + 1
+        normal = counts[sender.PRIORITY_NORMAL]
+        deadline = time.time() + 10
+        while sink.tags.get('bench.critical', 0) < critical and \
+                time.time() < deadline:
+            time.sleep(0.01)
+        sink.wait_for(critical + normal, timeout=2.0)
+        shed = budget.snapshot()['shed']
+        return {'peak_ratio': float(peak) / budget.soft_limit,
+                'critical_delivered_ratio':
+                    float(sink.tags.get('bench.critical', 0)) / critical,
+                'normal_delivered_ratio':
+                    float(sink.tags.get('bench.normal', 0)) / normal,
+                'bulk_shed_bytes': shed['bulk'],
+                'spilled_bytes': shed['spill'],
+                'dropped_bytes': shed['drop']}
+    finally:
+        sink.stop()
+        shutil.rmtree(spill_dir)
+
+
+# collectors
+
+def fixture_open(path, *args):
+    if path.startswith('/proc/'):
+        path = os.path.join(PROCFS, path[len('/proc/'):])
+    return open(path, *args)
+
+
+COLLECTORS = {
+    'cpu_times': cpu_stat.cpu_times,
+    'load_avg': cpu_stat.load_avg,
+    'file_desc': cpu_stat.file_desc,
+    'procs_running': cpu_stat.procs_running,
+    'cpu_info': cpu_stat.cpu_info,
+    'mem_stats': mem_stat.mem_stats,
+    'rx_tx_bytes': lambda: net_stat.rx_tx_bytes('wlan0'),
+    'disk_reads_writes': lambda: disk_stat.disk_reads_writes('mmcblk0'),
+    'thermal_stats': ThermalStat(SYSFS, PROCFS).thermal_stats,
+}
+
+
+@scenario
+def collectors(scale):
+    """Collector cost against the procfs tree in fixtures/procfs."""
+    modules = (cpu_stat, disk_stat, mem_stat, net_stat)
+    for module in modules:
+        # module globals shadow the open() builtin
+        module.open = fixture_open
+    try:
+        number = int(2000 * scale) or 1
+        metrics = dict([(name + '_us', 1e6 / rate(number, function))
+                        for name, function in COLLECTORS.items()])
+        metrics['tick_us'] = sum([metrics[name + '_us']
+                                  for name in ('cpu_times', 'load_avg',
+                                               'file_desc', 'procs_running',
+                                               'rx_tx_bytes',
+                                               'thermal_stats')])
+        return metrics
+    finally:
+        for module in modules:
+            del module.open
+
+
+# fleet
+
+@scenario
+def fleet(scale):
+    """Hundreds of robots sending to one sink."""
+    robots = int(200 * scale) or 1
+    per_robot = 20
+    sink = FakeFluentd().start()
+    loop = EventLoop()
+    loop.start()
+    try:
+        senders = [LoopSender('robot%03d' % i, loop=loop, host='127.0.0.1',
+                              port=sink.port) for i in range(robots)]
+        count = robots * per_robot
+        started = time.time()
+        for i in range(per_robot):
+            for fluent_sender in senders:
+                fluent_sender.emit('log', stamped(i))
+        received = sink.wait_for(count)
+        elapsed = time.time() - started
+        metrics = {'robots': robots,
+                   'connections': sink.accepted,
+                   'events_per_sec': received / elapsed,
+                   'delivered_ratio': float(received) / count}
+        metrics.update(latency_metrics(sink))
+        return metrics
+    finally:
+        loop.stop()
+        sink.stop()
+
+
+def check(results, thresholds):
+    failures = []
+    for name, limits in sorted(thresholds.items()):
+        metrics = results.get(name)
+        if metrics is None:
+            continue
+        for metric, bounds in sorted(limits.items()):
+            value = metrics.get(metric)
+            if value is None:
+                failures.append('%s.%s: missing' % (name, metric))
+            elif 'min' in bounds and value < bounds['min']:
+                failures.append('%s.%s: %g < min %g' % (name, metric, value,
+                                                        bounds['min']))
+            elif 'max' in bounds and value > bounds['max']:
+                failures.append('%s.%s: %g > max %g' % (name, metric, value,
+                                                        bounds['max']))
+    return failures
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--scale', type=float, default=1.0,
+                        help='multiply the scenario sizes')
+    parser.add_argument('--only', default='',
+                        help='run the scenarios whose name contains this')
+    parser.add_argument('--output', help='write the results as JSON')
+    parser.add_argument('--thresholds',
+                        default=os.path.join(HERE, 'thresholds.json'))
+    parser.add_argument('--no-check', action='store_true')
+    args = parser.parse_args(argv)
+
+    results = {}
+    for function in SCENARIOS:
+        name = function.__name__
+        if args.only not in name:
+            continue
+        metrics = function(args.scale)
+        results[name] = metrics
+        print(name)
+        for metric in sorted(metrics):
+            print('  %-20s %14.3f' % (metric, metrics[metric]))
+        sys.stdout.flush()
+
+    failures = []
+    if not args.no_check and os.path.exists(args.thresholds):
+        with open(args.thresholds) as f:
+            failures = check(results, json.load(f))
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump({'python': platform.python_version(),
+                       'scale': args.scale,
+                       'time': int(time.time()),
+                       'results': results,
+                       'failures': failures}, f, indent=2, sort_keys=True)
+    for failure in failures:
+        print('REGRESSION %s' % failure)
+    return 1 if failures else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,203 @@
+# -*- coding: utf-8 -*-
+"""End-to-end load test of FluentLoggerService on a plain Linux box.
+
+    python benchmarks/soak.py --duration 600 --rate 2000 \\
+        [--mix ALMemory=3:4,myapp=1:6] [--memory-latency 0.01] \\
+        [--memory-failure-rate 0.05] \\
+        [--pref qi_log_mode=both ...] [--output soak.json]
+
+The service runs against the fake ``qi`` module in benchmarks/fakeqi and
+sends to a `FakeFluentd` sink running in a child process. After an idle
+phase measuring the baseline CPU usage, a `LogFlood` publishes log
+messages for ``--duration`` seconds. Reported: CPU milliseconds per 1000
+log messages (above the idle baseline, without the cost of generating
+the messages), metrics tick latency and RSS growth.
+"""
+
+from __future__ import print_function
+
+import argparse
+import gc
+import json
+import multiprocessing
+import os
+import sys
+import time
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path[:0] = [os.path.join(HERE, 'fakeqi'),
+                os.path.join(HERE, '..', 'fluentlogger'),
+                os.path.join(HERE, '..', 'fluentlogger', 'lib')]
+
+import qi
+
+import fluentlogger
+
+from fakesink import FakeFluentd
+
+
+def cpu_seconds():
+    times = os.times()
+    return times[0] + times[1]
+
+
+def rss_kb():
+    with open('/proc/self/status') as f:
+        for line in f:
+            if line.startswith('VmRSS:'):
+                return int(line.split()[1])
+    return 0
+
+
+def slope(samples):
+    """Least squares slope of (x, y) samples."""
+    if len(samples) < 2:
+        return 0.0
+    n = float(len(samples))
+    mean_x = sum([x for x, _ in samples]) / n
+    mean_y = sum([y for _, y in samples]) / n
+    var = sum([(x - mean_x) ** 2 for x, _ in samples])
+    if not var:
+        return 0.0
+    return sum([(x - mean_x) * (y - mean_y) for x, y in samples]) / var
+
+
+def serve_sink(ports, stop, events):
+    sink = FakeFluentd().start()
+    ports.put(sink.port)
+    stop.wait()
+    events.put(sink.events)
+    sink.stop()
+
+
+def parse_mix(value):
+    """Parse 'category=weight:level,...' into a LogFlood mix."""
+    mix = {}
+    for item in value.split(','):
+        category, spec = item.strip().split('=')
+        weight, level = spec.split(':')
+        mix[category] = (int(weight), int(level))
+    return mix
+
+
+def generation_cost(flood, number=5000):
+    """CPU seconds LogFlood spends building one message."""
+    started = cpu_seconds()
+    for i in range(number):
+        flood.message(i)
+    return (cpu_seconds() - started) / number
+
+
+def measure_idle(seconds):
+    started_cpu, started = cpu_seconds(), time.time()
+    time.sleep(seconds)
+    return (cpu_seconds() - started_cpu) / (time.time() - started)
+
+
+def run(args):
+    qi.time_scale = args.time_scale
+    ports, events = multiprocessing.Queue(), multiprocessing.Queue()
+    stop = multiprocessing.Event()
+    sink = multiprocessing.Process(target=serve_sink,
+                                   args=(ports, stop, events))
+    sink.start()
+    preferences = {'host': '127.0.0.1', 'port': str(ports.get(timeout=10)),
+                   'qi_log': '1', 'qi_log_level': 'Debug',
+                   'metrics_interval': str(fluentlogger.MIN_METRICS_INTERVAL)}
+    preferences.update(dict([pref.split('=', 1) for pref in args.pref]))
+    memory = qi.ALMemory(latency=args.memory_latency,
+                         failure_rate=args.memory_failure_rate)
+    logManager = qi.LogManager()
+    session = qi.Session(
+        memory=memory, log_manager=logManager,
+        preferences=qi.ALPreferenceManager(
+            {fluentlogger.PREF_DOMAIN: preferences}))
+    service = fluentlogger.FluentLoggerService(session)
+    session.registerService('FluentLoggerService', service)
+    service.start()
+
+    idleCpu = measure_idle(args.idle)
+    gc.collect()
+    objectsBefore = len(gc.get_objects())
+    flood = qi.LogFlood(logManager, rate=args.rate,
+                        mix=parse_mix(args.mix) if args.mix else None,
+                        templates=args.templates)
+    perMessage = generation_cost(flood)
+    flood.start()
+    started, startedCpu = time.time(), cpu_seconds()
+    rss = []
+    while time.time() - started < args.duration:
+        time.sleep(min(args.sample, args.duration))
+        rss.append((time.time() - started, rss_kb()))
+    elapsed = time.time() - started
+    usedCpu = cpu_seconds() - startedCpu
+    flood.stop()
+    received = service.stats.snapshot()['counters'].get(
+        'service.log_messages', 0)
+    tick = service.getStats()['histograms'].get('service.tick', {})
+    service.stop()
+    qi.cancel_timers()
+    time.sleep(0.5)
+    stop.set()
+    sinkEvents = events.get(timeout=10)
+    sink.join()
+    gc.collect()
+    serviceCpu = usedCpu - idleCpu * elapsed - perMessage * flood.sent
+
+    # the first samples include the warm-up of caches and buffers
+    steady = rss[len(rss) // 4:]
+    return {
+        'duration_sec': elapsed,
+        'published': flood.sent,
+        'received': received,
+        'sink_events': sinkEvents,
+        'idle_cpu_percent': idleCpu * 100,
+        'cpu_percent': usedCpu / elapsed * 100,
+        'cpu_ms_per_1000_messages': (serviceCpu * 1e6 / received
+                                     if received else 0.0),
+        'ticks': tick.get('count', 0),
+        'tick_avg_ms': (tick['sum_ms'] / tick['count']
+                        if tick.get('count') else 0.0),
+        'rss_start_kb': rss[0][1] if rss else 0,
+        'rss_end_kb': rss[-1][1] if rss else 0,
+        'rss_growth_kb_per_hour': slope(steady) * 3600,
+        'object_growth': len(gc.get_objects()) - objectsBefore,
+        'memory_reads': memory.reads,
+        'memory_failures': memory.failures,
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--duration', type=float, default=60)
+    parser.add_argument('--rate', type=float, default=1000,
+                        help='log messages per second')
+    parser.add_argument('--mix',
+                        help='category=weight:level,... (default: a mix '
+                        'of NAOqi categories)')
+    parser.add_argument('--templates', type=int, default=20,
+                        help='distinct message texts')
+    parser.add_argument('--idle', type=float, default=5,
+                        help='seconds of idle baseline')
+    parser.add_argument('--sample', type=float, default=5,
+                        help='seconds between RSS samples')
+    parser.add_argument('--time-scale', type=float, default=0.1,
+                        help='speed factor of qi.async timers')
+    parser.add_argument('--memory-latency', type=float, default=0.0)
+    parser.add_argument('--memory-failure-rate', type=float, default=0.0)
+    parser.add_argument('--pref', action='append', default=[],
+                        help='service preference as name=value')
+    parser.add_argument('--output', help='write the results as JSON')
+    args = parser.parse_args(argv)
+
+    results = run(args)
+    for name in sorted(results):
+        print('%-28s %14.3f' % (name, results[name]))
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=2, sort_keys=True)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
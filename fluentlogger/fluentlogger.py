@@ -1,20 +1,78 @@
 # -*- coding: utf-8 -*-
+import os
 import sys
+import time
 import qi
 import random
 import threading
 import traceback
 import socket
+import subprocess
+import msgpack_pure as msgpack
 from fluent import sender
 from fluent import event
+from fluent.budget import MemoryBudget
+from fluent.eventloop import EventLoop
+from fluent.filesink import FileSink
+from fluent.loopsender import LoopSender
+from fluent.procsender import ProcessSender
+from fluent.relay import ForwardRelay
+from fluent.stats import get_global_stats
 from linux_metrics import cpu_stat
 from linux_metrics import cpu_stat
 from linux_metrics import net_stat
+from linux_metrics.thermal_stat import ThermalStat
+from pepperlog.memory_events import MemoryEventCollector
+from pepperlog.streaming import JointStreamer
+from pepperlog import recorder
+from pepperlog import policy
+from pepperlog import profiler
+from pepperlog.prefs import PreferenceStore
+from pepperlog import logfilter
+from pepperlog.ratelimit import LogThrottle
+from pepperlog.logstats import LogStats
+from pepperlog.compactlog import CompactLogEncoder
+from pepperlog.ingest import IngestQueue
+from pepperlog.tsdb import MetricStore
 
 PREF_DOMAIN = 'com.github.yacchin1205.fluentlogger'
 DEFAULT_METRICS_INTERVAL = 30
 MIN_METRICS_INTERVAL = 10
 DURATION_CPUPERC = 1
+DEFAULT_MEMORY_EVENTS = ['BatteryChargeChanged',
+                         'BatteryPowerPluggedChanged',
+                         'ALBattery/ConnectedToChargingStation',
+                         'ALTemperature/TemperatureStatusChanged']
+DEFAULT_MEMORY_EVENT_INTERVAL = 1.0
+DEFAULT_STREAMING_SENSORS = 'Temperature,ElectricCurrent'
+MAX_STREAMING_RATE = 50
+MAX_STREAMING_DURATION = 600
+DEFAULT_RECORDER_RATE = 10
+DEFAULT_RECORDER_PRE_SEC = 30
+DEFAULT_RECORDER_POST_SEC = 10
+DEFAULT_RECORDER_TRIGGERS = 'cpu_busy > 90,log:*:Fatal'
+DEFAULT_ADAPTIVE_INTERVAL_FACTOR = 3
+DEFAULT_ADAPTIVE_LOG_LEVEL = 'Warning'
+DEFAULT_SENDER_FLUSH_MS = 0
+DEFAULT_SENDER_ACK_WINDOW = 64
+DEFAULT_SINK_DIR = '/home/nao/.local/share/fluentlogger/sink'
+DEFAULT_SINK_MAX_MB = 8
+DEFAULT_SINK_ROTATE_SEC = 3600
+DEFAULT_SINK_BUDGET_MB = 64
+DEFAULT_HISTORY_DIR = '/home/nao/.local/share/fluentlogger/history'
+DEFAULT_HISTORY_BUDGET_MB = 16
+DEFAULT_MEMORY_SOFT_MB = 4
+DEFAULT_MEMORY_HARD_MB = 8
+DEFAULT_SPILL_DIR = '/home/nao/.local/share/fluentlogger/spill'
+DEFAULT_SPILL_MAX_MB = 16
+CRITICAL_TAGS = ('service', 'policy')
+BULK_TAGS = ('temperature', 'joint_stream', 'net')
+MIN_PROFILE_INTERVAL_MS = 5
+MAX_PROFILE_INTERVAL_MS = 1000
+MAX_PROFILE_DURATION = 300
+MAX_CPROFILE_DURATION = 30
+PROFILE_EVENT_STACKS = 200
+HISTORY_TAGS = ('cpu', 'cpu_thermal', 'temperature', 'battery')
 
 ACTUATORS = ["HeadPitch", "HeadYaw",
              "RShoulderRoll", "RShoulderPitch", "RElbowYaw", "RElbowRoll",
@@ -23,20 +81,46 @@ ACTUATORS = ["HeadPitch", "HeadYaw",
              "LWristYaw", "LHand",
              "HipPitch", "HipRoll", "KneePitch",
              "WheelFL", "WheelFR", "WheelB"]
+TEMPERATURE_KEYS = ['Device/SubDeviceList/%s/Temperature/Sensor/Value' % a
+                    for a in ACTUATORS]
 
 
 class FluentLoggerService:
     def __init__(self, session):
         self.session = session
+        self.services = {}
+        self.prefs = None
         self.lock = threading.RLock()
         self.running = False
         self.logListener = None
+        self.logFilter = None
+        self.logThrottle = None
+        self.logStats = None
+        self.logRaw = True
+        self.logEncoder = None
         self.handlerId = None
         self.metricsInterval = DEFAULT_METRICS_INTERVAL
         self.logLevel = {'Fatal': 1, 'Error': 2, 'Warning': 3, 'Info': 4,
                          'Verbose': 5, 'Debug': 6}
         self.robotName = None
         self.memory = None
+        self.memoryEvents = None
+        self.streamer = None
+        self.recorder = None
+        self.ingest = None
+        self.eventLoop = None
+        self.stats = get_global_stats()
+        self.budget = MemoryBudget(DEFAULT_MEMORY_SOFT_MB * 1024 * 1024,
+                                   DEFAULT_MEMORY_HARD_MB * 1024 * 1024)
+        self.relay = None
+        self.history = None
+        self.profiler = None
+        self.lastCpuTimes = None
+        self.cpuStats = None
+        self.thermalStat = None
+        self.policy = None
+        self.intervalFactor = 1
+        self.logLevelCap = None
         self.retryCount = 0
 
     def start(self):
@@ -45,23 +129,33 @@ class FluentLoggerService:
     def stop(self):
         self.retryCount = 0
         self._stopWatchingLogs()
+        self._stopMemoryEvents()
+        self.stopJointStreaming()
+        self._stopRecorder()
+        self._stopIngest()
+        self._stopRelay()
+        self._stopHistory()
+        self.stopProfiler()
         with self.lock:
             if self.running:
                 self.sendEvent('service', {'status': 'stopped'})
             self.running = False
 
     def setForwarder(self, host, port):
-        prefManager = self.session.service('ALPreferenceManager')
-        prefManager.setValue(PREF_DOMAIN, 'host', host)
-        prefManager.setValue(PREF_DOMAIN, 'port', str(port))
+        self._set_pref('host', host)
+        self._set_pref('port', str(port))
         self.start()
 
+    def reloadPreferences(self):
+        self._getPrefs().load()
+        self.start()
+        return True
+
     def setWatchingLogs(self, enabled):
         value = 0
         if enabled:
             value = 1
-        prefManager = self.session.service('ALPreferenceManager')
-        prefManager.setValue(PREF_DOMAIN, 'qi_log', str(value))
+        self._set_pref('qi_log', str(value))
         if enabled:
             self._startWatchingLogs()
         else:
@@ -72,20 +166,234 @@ class FluentLoggerService:
         validLevels = sorted(self.logLevel.keys())
         if level not in validLevels:
             return False
-        prefManager = self.session.service('ALPreferenceManager')
-        prefManager.setValue(PREF_DOMAIN, 'qi_log_level', level)
+        self._set_pref('qi_log_level', level)
         if self.logListener:
-            self.logListener.setLevel(self.logLevel[level])
+            self._applyLogLevel()
         else:
             self._startWatchingLogs()
         return True
 
+    def setWatchingLogRules(self, rules):
+        try:
+            logfilter.parse_rules(rules, self.logLevel)
+        except ValueError:
+            return False
+        self._set_pref('qi_log_rules', rules)
+        with self.lock:
+            self._applyLogLevel()
+        return True
+
+    def emitEvent(self, label, record):
+        return self.emitBatch(label, [record]) == 1
+
+    def emitBatch(self, label, records):
+        ingest = self.ingest
+        if ingest is None or self.robotName is None:
+            return 0
+        timestamp = int(time.time())
+        entries = []
+        for record in records:
+            if isinstance(record, dict):
+                record['robot'] = self.robotName
+                entries.append((label, timestamp, record))
+        # clients are told apart by the first component of their labels
+        return ingest.push(label.split('.')[0], entries)
+
+    def getIngestStats(self):
+        ingest = self.ingest
+        if ingest is None:
+            return {}
+        return ingest.stats()
+
+    def getLaneStats(self):
+        fluentSender = sender.get_global_sender()
+        if fluentSender is None:
+            return {}
+        return fluentSender.lane_stats()
+
+    def getStats(self):
+        self._updateStatsGauges()
+        return self.stats.snapshot()
+
+    def getMemoryUsage(self):
+        return self.budget.snapshot()
+
+    def getMetricsHistory(self, name, start, end, resolution):
+        history = self.history
+        if history is None:
+            return []
+        return history.query(name, start, end, resolution)
+
+    def getMetricsNames(self):
+        history = self.history
+        if history is None:
+            return []
+        return history.names()
+
+    def startProfiler(self, mode, intervalMs, duration):
+        if duration <= 0:
+            return False
+        if mode == 'sample':
+            if intervalMs < MIN_PROFILE_INTERVAL_MS or \
+                    intervalMs > MAX_PROFILE_INTERVAL_MS or \
+                    duration > MAX_PROFILE_DURATION:
+                return False
+            profile = profiler.SamplingProfiler(intervalMs / 1000.0,
+                                                duration, self.onProfile)
+        elif mode == 'cprofile':
+            if duration > MAX_CPROFILE_DURATION:
+                return False
+            profile = profiler.DeterministicProfiler(duration,
+                                                     self.onProfile)
+        else:
+            return False
+        with self.lock:
+            if not self.running:
+                return False
+            if self.profiler is not None and self.profiler.is_alive():
+                return False
+            self.profiler = profile
+            profile.start()
+        return True
+
+    def stopProfiler(self):
+        with self.lock:
+            profile = self.profiler
+        if profile is not None:
+            profile.stop()
+        return True
+
+    def onProfile(self, profile, result):
+        try:
+            record = dict(result)
+            path = self._writeProfile(profile, result)
+            if path is not None:
+                record['file'] = path
+            if 'stacks' in record:
+                record['stacks'] = profiler.top_stacks(result['stacks'],
+                                                       PROFILE_EVENT_STACKS)
+            self.sendEvent('profile', record)
+        except:
+            print('Failed to send profile: %s' % sys.exc_info()[0])
+            traceback.print_exc()
+
+    def getAckStats(self):
+        fluentSender = sender.get_global_sender()
+        if not isinstance(fluentSender, LoopSender):
+            return {}
+        return fluentSender.ack_stats()
+
+    def startJointStreaming(self, duration, rate):
+        if duration <= 0 or duration > MAX_STREAMING_DURATION:
+            return False
+        if rate <= 0 or rate > MAX_STREAMING_RATE:
+            return False
+        with self.lock:
+            if not self.running:
+                return False
+            if self.streamer is not None and self.streamer.is_alive():
+                self.streamer.stop()
+            sensors = self._get_pref('streaming_sensors',
+                                     DEFAULT_STREAMING_SENSORS)
+            keys = []
+            names = []
+            for sensor in [s.strip() for s in sensors.split(',') if s.strip()]:
+                for actuator in ACTUATORS:
+                    keys.append('Device/SubDeviceList/%s/%s/Sensor/Value' %
+                                (actuator, sensor))
+                    names.append('%s_%s' % (actuator.lower(), sensor.lower()))
+            self.streamer = JointStreamer(self._getMemory(), keys, names,
+                                          rate, duration, self.onJointBatch)
+            self.streamer.start()
+        return True
+
+    def stopJointStreaming(self):
+        with self.lock:
+            if self.streamer is not None:
+                self.streamer.stop()
+                self.streamer = None
+        return True
+
+    def onJointBatch(self, record, start):
+        try:
+            self._sendEventAt('joint_stream', record, start)
+        except:
+            print('Failed to send joint batch: %s' % sys.exc_info()[0])
+            traceback.print_exc()
+
+    def onBurst(self, record, triggerTime):
+        try:
+            self._sendEventAt('burst', record, triggerTime)
+        except:
+            print('Failed to send burst: %s' % sys.exc_info()[0])
+            traceback.print_exc()
+
     def onLogMessage(self, msg):
         try:
-            self.sendEvent('log', msg)
+            self.stats.incr('service.log_messages')
+            if self.recorder is not None:
+                self.recorder.notify_log(msg)
+            logFilter = self.logFilter
+            if logFilter is not None and \
+                    not logFilter.allows(msg['category'], msg['level']):
+                self.stats.incr('service.log_filtered')
+                return
+            logStats = self.logStats
+            if logStats is not None:
+                logStats.add(msg)
+                if not self.logRaw:
+                    return
+            logThrottle = self.logThrottle
+            if logThrottle is not None:
+                for record in logThrottle.process(msg, time.time()):
+                    self._sendLog(record)
+                return
+            self._sendLog(msg)
         except:
             pass
 
+    def _onLogMessage(self, msg):
+        self._profiled(self.onLogMessage, msg)
+
+    def _onMemoryEvent(self, key, value, timestamp, count):
+        self._profiled(self.onMemoryEvent, key, value, timestamp, count)
+
+    def _profiled(self, function, *args):
+        profile = self.profiler
+        if profile is None or profile.mode != 'cprofile':
+            return function(*args)
+        return profile.call(function, *args)
+
+    def _writeProfile(self, profile, result):
+        directory = self._get_pref('profile_dir', '')
+        if not directory:
+            return None
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+        name = 'profile-%s-%s' % (result['mode'],
+                                  time.strftime('%Y%m%d-%H%M%S'))
+        if result['mode'] == 'cprofile':
+            path = os.path.join(directory, name + '.pstats')
+            if not profile.dump(path):
+                return None
+        else:
+            path = os.path.join(directory, name + '.folded')
+            with open(path, 'w') as f:
+                f.write(profiler.format_collapsed(result['stacks']))
+        return path
+
+    def onMemoryEvent(self, key, value, timestamp, count):
+        try:
+            if key == 'BatteryChargeChanged':
+                self._sendEventAt('battery', {'charge': value}, timestamp)
+            else:
+                self._sendEventAt('memory', {'key': key, 'value': value,
+                                             'coalesced': count}, timestamp)
+        except:
+            print('Failed to send memory event %s: %s' % (key,
+                                                          sys.exc_info()[0]))
+            traceback.print_exc()
+
     def _tryToStart(self):
         self.robotName = self._getRobotName()
         if self.robotName is None:
@@ -96,38 +404,423 @@ class FluentLoggerService:
             if self.running:
                 self.stop()
             host = self._get_pref('host')
-            if host is not None:
+            if host is not None or self._get_pref('sink') == 'file':
                 tag = self._get_pref('tag', 'pepper')
-                sender.setup(tag, host=host,
-                             port=int(self._get_pref('port', '24224')))
+                self._setupBudget()
+                self._setupSender(tag, host,
+                                  int(self._get_pref('port', '24224')))
+                self.budget.register('sender', sender.get_global_sender())
                 self.running = True
                 interval = self._get_pref('metrics_interval',
                                           str(DEFAULT_METRICS_INTERVAL))
                 self.metricsInterval = max(int(interval), MIN_METRICS_INTERVAL)
+                self._setupPolicy()
                 metrics_conf = {'interval_sec': self.metricsInterval}
                 self.sendEvent('service', {'status': 'started',
                                            'config': metrics_conf,
                                            'retried': self.retryCount})
                 self.sendEvent('cpu_info', cpu_stat.cpu_info())
         self._startWatchingLogs()
+        self._startMemoryEvents()
+        self._startRecorder()
+        self._startIngest()
+        self._startRelay()
+        self._startHistory()
         self._sendMetrics()
 
     def _startWatchingLogs(self):
         with self.lock:
             if int(self._get_pref('qi_log', '0')) != 0 and not self.handlerId:
-                self.logListener = self.session.service('LogManager') \
+                self.logListener = self._service('LogManager') \
                                        .createListener()
-                logLevelStr = self._get_pref('qi_log_level', 'Info')
-                self.logListener.setLevel(self.logLevel[logLevelStr])
+                self._applyLogLevel()
+                mode = self._get_pref('qi_log_mode', 'raw')
+                self.logRaw = mode in ('raw', 'both')
+                if mode in ('stats', 'both'):
+                    self.logStats = LogStats(top_k=int(self._get_pref(
+                        'qi_log_stats_top', '10')))
+                if self._get_pref('qi_log_format', 'full') == 'compact':
+                    self.logEncoder = CompactLogEncoder(
+                        resync_interval=int(self._get_pref(
+                            'qi_log_resync_interval', '300')))
+                    self.budget.register('log_dictionary', self.logEncoder)
+                if int(self._get_pref('qi_log_throttle', '0')) != 0:
+                    self.logThrottle = LogThrottle(
+                        category_rate=float(self._get_pref(
+                            'qi_log_category_rate', '50')),
+                        category_burst=float(self._get_pref(
+                            'qi_log_category_burst', '200')),
+                        message_rate=float(self._get_pref(
+                            'qi_log_message_rate', '10')),
+                        message_burst=float(self._get_pref(
+                            'qi_log_message_burst', '50')),
+                        repeat_window=float(self._get_pref(
+                            'qi_log_repeat_window', '5')))
                 self.handlerId = self.logListener \
-                                     .onLogMessage.connect(self.onLogMessage)
+                                     .onLogMessage.connect(self._onLogMessage)
 
     def _stopWatchingLogs(self):
         with self.lock:
             if self.handlerId:
                 self.logListener.onLogMessage.disconnect(self.handlerId)
                 self.logListener = None
+                self.logFilter = None
                 self.handlerId = None
+                self._flushLogThrottle(float('inf'))
+                self.logThrottle = None
+                self._sendLogStats()
+                self.logStats = None
+                self.logRaw = True
+                self.logEncoder = None
+                self.budget.unregister('log_dictionary')
+
+    def _sendLog(self, msg):
+        logEncoder = self.logEncoder
+        if logEncoder is None:
+            self.sendEvent('log', msg)
+        else:
+            self.sendEvent('log_compact', logEncoder.encode(
+                msg, sender.get_global_sender().generation))
+
+    def _sendLogDictionary(self):
+        logEncoder = self.logEncoder
+        if logEncoder is None:
+            return
+        record = logEncoder.resync_record(time.time())
+        if record is not None:
+            self.sendEvent('log_dict', record)
+
+    def _sendLogStats(self):
+        logStats = self.logStats
+        if logStats is None:
+            return
+        record = logStats.snapshot()
+        record['interval_sec'] = self.metricsInterval * self.intervalFactor
+        self.sendEvent('log_stats', record)
+
+    def _sendLoggerStats(self):
+        if int(self._get_pref('logger_stats', '1')) == 0:
+            return
+        self._updateStatsGauges()
+        snapshot = self.stats.snapshot()
+        histograms = []
+        for name, histogram in sorted(snapshot['histograms'].items()):
+            record = {'name': name}
+            record.update(histogram)
+            histograms.append(record)
+        self.sendEvent('logger_stats', {
+            'interval_sec': self.metricsInterval * self.intervalFactor,
+            'counters': [{'name': name, 'value': value} for name, value
+                         in sorted(snapshot['counters'].items())],
+            'gauges': [{'name': name, 'value': float(value)} for name, value
+                       in sorted(snapshot['gauges'].items())],
+            'histograms': histograms,
+            'bounds_ms': snapshot['bounds_ms']})
+
+    def _updateStatsGauges(self):
+        usage = self.budget.usage()
+        self.stats.gauge('memory.total_bytes', sum(usage.values()))
+        for name, used in usage.items():
+            self.stats.gauge('memory.%s_bytes' % name, used)
+        fluentSender = sender.get_global_sender()
+        if fluentSender is None:
+            return
+        self.stats.gauge('sender.buffered_bytes', fluentSender.buffered)
+        for name, laneStats in fluentSender.lane_stats().items():
+            self.stats.gauge('sender.%s.depth' % name, laneStats['depth'])
+        if isinstance(fluentSender, LoopSender):
+            self.stats.gauge('sender.in_flight',
+                             fluentSender.ack_stats()['in_flight'])
+        relay = self.relay
+        if relay is not None:
+            self.stats.gauge('relay.clients', relay.stats()['clients'])
+
+    def _flushLogThrottle(self, now):
+        logThrottle = self.logThrottle
+        if logThrottle is None:
+            return
+        for record in logThrottle.flush(now):
+            self._sendLog(record)
+
+    def _applyLogLevel(self):
+        level = self._effectiveLogLevel(self._get_pref('qi_log_level',
+                                                       'Info'))
+        try:
+            rules = logfilter.parse_rules(self._get_pref('qi_log_rules', ''),
+                                          self.logLevel)
+        except ValueError:
+            print('Invalid log rules: %s' % sys.exc_info()[1])
+            rules = {}
+        if self.logLevelCap is not None:
+            rules = dict([(pattern, min(ruleLevel, self.logLevelCap))
+                          for pattern, ruleLevel in rules.items()])
+        if rules:
+            self.logFilter = logfilter.CategoryFilter(rules, level)
+        else:
+            self.logFilter = None
+        listener = self.logListener
+        if listener is None:
+            return
+        listener.setLevel(level)
+        try:
+            # let qi drop filtered messages before they reach us
+            listener.clearFilters()
+            for pattern, ruleLevel in rules.items():
+                listener.addFilter(pattern, ruleLevel)
+        except Exception:
+            if self.logFilter is not None:
+                listener.setLevel(self.logFilter.max_level())
+
+    def _startMemoryEvents(self):
+        with self.lock:
+            if not self.running or self.memoryEvents is not None:
+                return
+            keys = self._get_pref('memory_events',
+                                  ','.join(DEFAULT_MEMORY_EVENTS))
+            keys = [key.strip() for key in keys.split(',') if key.strip()]
+            if not keys:
+                return
+            interval = float(self._get_pref('memory_event_interval',
+                                            str(DEFAULT_MEMORY_EVENT_INTERVAL)))
+            self.memoryEvents = MemoryEventCollector(self._getMemory(), keys,
+                                                     self._onMemoryEvent,
+                                                     min_interval=interval)
+            try:
+                self.memoryEvents.start()
+            except:
+                print('Failed to subscribe memory events: %s' %
+                      sys.exc_info()[0])
+                traceback.print_exc()
+
+    def _stopMemoryEvents(self):
+        with self.lock:
+            if self.memoryEvents is not None:
+                self.memoryEvents.stop()
+                self.memoryEvents = None
+
+    def _startIngest(self):
+        with self.lock:
+            if not self.running or self.ingest is not None:
+                return
+            self.ingest = IngestQueue(
+                sender.get_global_sender().emit_batch,
+                rate=float(self._get_pref('ingest_rate', '100')),
+                burst=float(self._get_pref('ingest_burst', '1000')),
+                queue_max=int(self._get_pref('ingest_queue_max', '1000')),
+                sizeof=self._packedSize)
+            self.ingest.start()
+            self.budget.register('ingest', self.ingest)
+
+    def _stopIngest(self):
+        with self.lock:
+            if self.ingest is not None:
+                self.ingest.stop()
+                self.ingest = None
+                self.budget.unregister('ingest')
+
+    def _packedSize(self, entry):
+        return len(msgpack.packb(entry))
+
+    def _setupBudget(self):
+        self.budget.soft_limit = int(self._get_pref(
+            'memory_soft_mb', str(DEFAULT_MEMORY_SOFT_MB))) * 1024 * 1024
+        self.budget.hard_limit = int(self._get_pref(
+            'memory_hard_mb', str(DEFAULT_MEMORY_HARD_MB))) * 1024 * 1024
+
+    def _setupSender(self, tag, host, port):
+        previous = sender.get_global_sender()
+        if isinstance(previous, (LoopSender, ProcessSender, FileSink)):
+            previous._close()
+        if isinstance(previous, sender.FluentSender):
+            previous.close_spill()
+        spillDir = None
+        if int(self._get_pref('memory_spill', '1')) != 0:
+            spillDir = self._get_pref('spill_dir', DEFAULT_SPILL_DIR)
+            if previous is None:
+                self._removeSpillFiles(spillDir)
+        spillMax = int(self._get_pref('spill_max_mb',
+                                      str(DEFAULT_SPILL_MAX_MB)))
+        spill = {'budget': self.budget, 'spill_dir': spillDir,
+                 'spill_max': spillMax * 1024 * 1024}
+        if self._get_pref('sink', 'fluentd') == 'file':
+            sender.setup(
+                tag, sender_class=FileSink,
+                directory=self._get_pref('sink_dir', DEFAULT_SINK_DIR),
+                format=self._get_pref('sink_format', 'json'),
+                compress=int(self._get_pref('sink_gzip', '0')) != 0,
+                max_bytes=int(self._get_pref(
+                    'sink_max_mb', str(DEFAULT_SINK_MAX_MB))) * 1024 * 1024,
+                max_age=int(self._get_pref(
+                    'sink_rotate_sec', str(DEFAULT_SINK_ROTATE_SEC))),
+                disk_budget=int(self._get_pref(
+                    'sink_budget_mb',
+                    str(DEFAULT_SINK_BUDGET_MB))) * 1024 * 1024,
+                uploader=self._uploadSinkFile)
+            return
+        senderMode = self._get_pref('sender_mode', 'blocking')
+        # acks are read asynchronously, so they require the loop sender
+        requireAck = int(self._get_pref('sender_ack', '0')) != 0
+        if requireAck or senderMode == 'loop':
+            flushMs = int(self._get_pref('sender_flush_ms',
+                                         str(DEFAULT_SENDER_FLUSH_MS)))
+            window = int(self._get_pref('sender_ack_window',
+                                        str(DEFAULT_SENDER_ACK_WINDOW)))
+            sender.setup(tag, sender_class=LoopSender, host=host, port=port,
+                         classify=self._priorityOf, loop=self._getEventLoop(),
+                         flush_interval=flushMs / 1000.0,
+                         require_ack_response=requireAck, ack_window=window,
+                         **spill)
+        elif senderMode == 'process':
+            compress = int(self._get_pref('sender_gzip', '0')) != 0
+            sender.setup(tag, sender_class=ProcessSender, host=host,
+                         port=port, compress=compress)
+        else:
+            sender.setup(tag, host=host, port=port, classify=self._priorityOf,
+                         **spill)
+
+    def _removeSpillFiles(self, spillDir):
+        # spill files only extend the memory of the process that wrote them
+        if not os.path.isdir(spillDir):
+            return
+        for name in os.listdir(spillDir):
+            if name.startswith('spill-'):
+                try:
+                    os.unlink(os.path.join(spillDir, name))
+                except OSError:
+                    pass
+
+    def _uploadSinkFile(self, path, table):
+        # the command uploads the file and deletes it when done
+        command = self._get_pref('sink_upload_command')
+        if command:
+            subprocess.Popen([command, path, table], close_fds=True)
+
+    def _getEventLoop(self):
+        with self.lock:
+            if self.eventLoop is None:
+                self.eventLoop = EventLoop()
+                self.eventLoop.start()
+            return self.eventLoop
+
+    def _startRelay(self):
+        with self.lock:
+            if not self.running or self.relay is not None:
+                return
+            unixPath = self._get_pref('relay_unix', '')
+            port = self._get_pref('relay_port', '')
+            if not unixPath and not port:
+                return
+            try:
+                relay = ForwardRelay(sender.get_global_sender(),
+                                     self._getEventLoop(),
+                                     unix_path=unixPath or None,
+                                     port=int(port) if port else None)
+            except ValueError as e:
+                # the blocking sender would stall the event loop
+                print('Failed to start relay, it needs sender_mode=loop: %s'
+                      % e)
+                return
+            try:
+                relay.start()
+            except:
+                print('Failed to start relay: %s' % sys.exc_info()[0])
+                traceback.print_exc()
+                relay.stop()
+                return
+            self.relay = relay
+            self.budget.register('relay', relay)
+
+    def _stopRelay(self):
+        with self.lock:
+            if self.relay is not None:
+                self.relay.stop()
+                self.relay = None
+                self.budget.unregister('relay')
+
+    def _startHistory(self):
+        with self.lock:
+            if not self.running or self.history is not None:
+                return
+            if int(self._get_pref('history', '0')) == 0:
+                return
+            budget = int(self._get_pref('history_budget_mb',
+                                        str(DEFAULT_HISTORY_BUDGET_MB)))
+            try:
+                self.history = MetricStore(
+                    self._get_pref('history_dir', DEFAULT_HISTORY_DIR),
+                    disk_budget=budget * 1024 * 1024)
+            except:
+                print('Failed to open metrics history: %s' %
+                      sys.exc_info()[0])
+                traceback.print_exc()
+
+    def _stopHistory(self):
+        with self.lock:
+            if self.history is not None:
+                self.history.close()
+                self.history = None
+
+    def _recordHistory(self, tag, msg, timestamp):
+        history = self.history
+        if history is None or tag not in HISTORY_TAGS:
+            return
+        try:
+            history.record_many(tag, msg, timestamp)
+        except:
+            print('Failed to record %s history: %s' % (tag,
+                                                        sys.exc_info()[0]))
+            traceback.print_exc()
+
+    def _startRecorder(self):
+        with self.lock:
+            if not self.running or self.recorder is not None:
+                return
+            if int(self._get_pref('recorder', '0')) == 0:
+                return
+            rate = min(int(self._get_pref('recorder_rate',
+                                          str(DEFAULT_RECORDER_RATE))),
+                       MAX_STREAMING_RATE)
+            pre = int(self._get_pref('recorder_pre_sec',
+                                     str(DEFAULT_RECORDER_PRE_SEC)))
+            post = int(self._get_pref('recorder_post_sec',
+                                      str(DEFAULT_RECORDER_POST_SEC)))
+            names = ['%s_temperature' % actuator.lower()
+                     for actuator in ACTUATORS] + ['load_1min', 'cpu_busy']
+            try:
+                triggers = recorder.parse_triggers(
+                    self._get_pref('recorder_triggers',
+                                   DEFAULT_RECORDER_TRIGGERS), self.logLevel)
+                self.recorder = recorder.FlightRecorder(
+                    self._sampleRecorder, names, rate, pre, post, triggers,
+                    self.onBurst)
+            except (ValueError, KeyError):
+                print('Invalid recorder triggers: %s' % sys.exc_info()[1])
+                return
+            self.lastCpuTimes = None
+            self.recorder.start()
+            self.budget.register('recorder', self.recorder)
+
+    def _stopRecorder(self):
+        with self.lock:
+            if self.recorder is not None:
+                self.recorder.stop()
+                self.recorder = None
+                self.budget.unregister('recorder')
+
+    def _sampleRecorder(self):
+        values = [float(value) for value
+                  in self._getMemory().getListData(TEMPERATURE_KEYS)]
+        values.append(cpu_stat.load_avg()[0])
+        times = cpu_stat.cpu_times()
+        busy = 0.0
+        if self.lastCpuTimes is not None:
+            deltas = [b - a for a, b in zip(self.lastCpuTimes, times)]
+            total = sum(deltas)
+            if total > 0:
+                busy = 100.0 * (total - deltas[3]) / total
+        self.lastCpuTimes = times
+        values.append(busy)
+        return values
 
     def _sendLinuxMetrics(self):
         cpu_percents = {}
@@ -143,23 +836,29 @@ class FluentLoggerService:
                   'procs_blocked': cpu_stat.procs_blocked()}.items()
         stats += zip(['filedesc_allocated', 'filedesc_allocated_free',
                       'filedesc_max'], file_desc)
-        self.sendEvent('cpu', dict(stats))
+        self.cpuStats = dict(stats)
+        self.sendEvent('cpu', self.cpuStats)
+        if int(self._get_pref('thermal_metrics', '1')) != 0:
+            if self.thermalStat is None:
+                # the sysfs files are found once and stay open
+                self.thermalStat = ThermalStat()
+            self.sendEvent('cpu_thermal', self.thermalStat.thermal_stats())
 
         for nic in ['wlan0', 'eth0', 'usb0']:
             rx, tx = net_stat.rx_tx_bytes(nic)
             self.sendEvent('net', {'nic': nic, 'rx_bytes': rx, 'tx_bytes': tx})
 
     def _sendBodyMetrics(self):
-        if self.memory is None:
-            self.memory = self.session.service('ALMemory')
-        battery_charge = self.memory.getData('BatteryChargeChanged')
-        self.sendEvent('battery', {'charge': battery_charge})
+        memory = self._getMemory()
+        if not self._isSubscribed('BatteryChargeChanged'):
+            battery_charge = memory.getData('BatteryChargeChanged')
+            self.sendEvent('battery', {'charge': battery_charge})
 
         values = {}
         for actuator in ACTUATORS:
             key = 'Device/SubDeviceList/%s/Temperature/Sensor/Value' % actuator
             try:
-                values[actuator.lower()] = int(self.memory.getData(key))
+                values[actuator.lower()] = int(memory.getData(key))
             except:
                 print('Failed to get %s: %s' % (key, sys.exc_info()[0]))
                 traceback.print_exc()
@@ -168,6 +867,8 @@ class FluentLoggerService:
     def _sendMetrics(self):
         if not self.running:
             return
+        started = time.time()
+        self.cpuStats = None
         try:
             self._sendLinuxMetrics()
         except:
@@ -178,27 +879,180 @@ class FluentLoggerService:
         except:
             print('Failed to send body metrics: %s' % sys.exc_info()[0])
             traceback.print_exc()
+        try:
+            self._sendLogStats()
+        except:
+            print('Failed to send log stats: %s' % sys.exc_info()[0])
+            traceback.print_exc()
+        try:
+            self._sendLogDictionary()
+        except:
+            print('Failed to send log dictionary: %s' % sys.exc_info()[0])
+            traceback.print_exc()
+        try:
+            self._flushLogThrottle(time.time())
+        except:
+            print('Failed to flush log summaries: %s' % sys.exc_info()[0])
+            traceback.print_exc()
+        try:
+            self._applyPolicy(self.cpuStats)
+        except:
+            print('Failed to apply adaptive policy: %s' % sys.exc_info()[0])
+            traceback.print_exc()
+        try:
+            self._sendLoggerStats()
+        except:
+            print('Failed to send logger stats: %s' % sys.exc_info()[0])
+            traceback.print_exc()
+        try:
+            fluentSender = sender.get_global_sender()
+            if isinstance(fluentSender, FileSink):
+                fluentSender.flush()
+        except:
+            print('Failed to flush the file sink: %s' % sys.exc_info()[0])
+            traceback.print_exc()
+        try:
+            history = self.history
+            if history is not None:
+                history.flush()
+        except:
+            print('Failed to flush metrics history: %s' % sys.exc_info()[0])
+            traceback.print_exc()
+        try:
+            self.budget.enforce()
+        except:
+            print('Failed to enforce the memory budget: %s' %
+                  sys.exc_info()[0])
+            traceback.print_exc()
+        self.stats.observe('service.tick', time.time() - started)
 
-        qi.async(self._sendMetrics,
-                 delay=(self.metricsInterval - DURATION_CPUPERC) * 1000 * 1000)
+        interval = self.metricsInterval * self.intervalFactor
+        qi.async(self._profiled, self._sendMetrics,
+                 delay=(interval - DURATION_CPUPERC) * 1000 * 1000)
 
-    def _get_pref(self, name, default_value=None):
-        prefManager = self.session.service('ALPreferenceManager')
-        value = prefManager.getValue(PREF_DOMAIN, name)
-        if value is None:
-            return default_value
+    def _setupPolicy(self):
+        self.intervalFactor = 1
+        self.logLevelCap = None
+        if int(self._get_pref('adaptive_policy', '0')) == 0:
+            self.policy = None
+            return
+        self.policy = policy.AdaptivePolicy(
+            load_high=float(self._get_pref('adaptive_load_high', '2.0')),
+            cpu_high=float(self._get_pref('adaptive_cpu_high', '80')),
+            battery_low=int(self._get_pref('adaptive_battery_low', '30')))
+
+    def _applyPolicy(self, cpu):
+        if self.policy is None:
+            return
+        load = busy = None
+        if cpu is not None:
+            load = cpu['load_1min']
+            busy = 100.0 - cpu['cpu_idle']
+        charge = self._memoryValue('BatteryChargeChanged')
+        charging = self._memoryValue('BatteryPowerPluggedChanged')
+        decision = self.policy.update(load, busy, charge, charging)
+        if decision is None:
+            return
+        state, reason = decision
+        levelStr = self._get_pref('qi_log_level', 'Info')
+        if state == policy.RELAXED:
+            self.intervalFactor = int(self._get_pref(
+                'adaptive_interval_factor',
+                str(DEFAULT_ADAPTIVE_INTERVAL_FACTOR)))
+            self.logLevelCap = self.logLevel[self._get_pref(
+                'adaptive_log_level', DEFAULT_ADAPTIVE_LOG_LEVEL)]
         else:
-            return value
+            self.intervalFactor = 1
+            self.logLevelCap = None
+        with self.lock:
+            self._applyLogLevel()
+        self.sendEvent('policy', {'state': state, 'reason': reason,
+                                  'load_1min': load, 'cpu_busy': busy,
+                                  'battery_charge': charge,
+                                  'interval_sec': self.metricsInterval *
+                                  self.intervalFactor,
+                                  'log_level': self._effectiveLogLevel(
+                                      levelStr)})
+
+    def _effectiveLogLevel(self, levelStr):
+        level = self.logLevel[levelStr]
+        if self.logLevelCap is not None:
+            level = min(level, self.logLevelCap)
+        return level
+
+    def _isSubscribed(self, key):
+        return self.memoryEvents is not None and \
+            key in self.memoryEvents.subscribers
+
+    def _memoryValue(self, key):
+        if self._isSubscribed(key):
+            return self.memoryEvents.last_value(key)
+        try:
+            return self._getMemory().getData(key)
+        except:
+            return None
+
+    def _get_pref(self, name, default_value=None):
+        return self._getPrefs().get(name, default_value)
+
+    def _set_pref(self, name, value):
+        self._getPrefs().set(name, value)
+
+    def _getPrefs(self):
+        if self.prefs is None:
+            prefs = PreferenceStore(self._service('ALPreferenceManager'),
+                                    PREF_DOMAIN)
+            prefs.load()
+            self.prefs = prefs
+        return self.prefs
+
+    def _service(self, name):
+        service = self.services.get(name)
+        if service is None:
+            service = self.session.service(name)
+            self.services[name] = service
+        return service
+
+    def _priorityOf(self, tag, msg):
+        if tag in CRITICAL_TAGS:
+            return sender.PRIORITY_CRITICAL
+        if tag in BULK_TAGS:
+            return sender.PRIORITY_BULK
+        if tag in ('log_compact', 'log_dict'):
+            # one lane keeps string definitions ahead of their uses
+            return sender.PRIORITY_NORMAL
+        if tag == 'log':
+            level = msg.get('level')
+            if level is not None:
+                if level <= self.logLevel['Error']:
+                    return sender.PRIORITY_CRITICAL
+                if level >= self.logLevel['Verbose']:
+                    return sender.PRIORITY_BULK
+        return sender.PRIORITY_NORMAL
+
+    def _getMemory(self):
+        if self.memory is None:
+            self.memory = self._service('ALMemory')
+        return self.memory
 
     def sendEvent(self, tag, msg):
         if self.robotName is not None:
             msg['robot'] = self.robotName
+            self.stats.incr('service.events')
             event.Event(tag, msg)
+            self._recordHistory(tag, msg, time.time())
+
+    def _sendEventAt(self, tag, msg, timestamp):
+        if self.robotName is not None:
+            msg['robot'] = self.robotName
+            self.stats.incr('service.events')
+            event.Event(tag, msg, time=int(timestamp))
+            self._recordHistory(tag, msg, timestamp)
 
     def _getRobotName(self):
         realNotVirtual = False
         try:
-            ALMemory = self.session.service('ALMemory')
+            ALMemory = self._service('ALMemory')
             ALMemory.getData("DCM/Time")
             if ALMemory.getData("DCM/Simulation") != 1:
                 realNotVirtual = True
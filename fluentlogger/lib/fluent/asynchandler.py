@@ -0,0 +1,191 @@
+# -*- coding: utf-8 -*-
+
+from collections import deque
+import logging
+import threading
+import time
+
+try:
+    basestring
+except NameError:  # pragma: no cover
+    basestring = (str, bytes)
+
+from fluent import handler
+from fluent.budget import SHED_SPILL
+
+_EXC_FORMATTER = logging.Formatter()
+# what a queued record holds besides its message and exception text
+_RECORD_OVERHEAD = 512
+
+
+class AsyncFluentHandler(handler.FluentHandler):
+    '''
+    Logging Handler for fluent that never blocks on the network.
+
+    `emit` only queues the record. A background thread formats the queued
+    records and sends them in batches, as soon as a record of `flush_level`
+    or above is queued, `batch_size` records are waiting, or the oldest
+    waiting record is `flush_interval` seconds old. At most `queue_max`
+    records are kept; the oldest ones are dropped beyond that.
+
+    Queued records are detached from the caller: a string message is
+    merged with its arguments and a dict message is copied (not the
+    values it holds). The exception text is rendered and the traceback
+    released, so queued records keep no frames alive.
+
+    With a `budget`, the queue is accounted in that `MemoryBudget` too:
+    shedding drops the oldest records, counted in `dropped`.
+    '''
+    def __init__(self,
+                 tag,
+                 host='localhost',
+                 port=24224,
+                 timeout=3.0,
+                 verbose=False,
+                 sender=None,
+                 queue_max=1000,
+                 batch_size=100,
+                 flush_interval=1.0,
+                 flush_level=logging.ERROR,
+                 budget=None):
+
+        super(AsyncFluentHandler, self).__init__(tag, host=host, port=port,
+                                                 timeout=timeout,
+                                                 verbose=verbose,
+                                                 sender=sender,
+                                                 budget=budget)
+        self.queue_max = queue_max
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.flush_level = flush_level
+
+        self.queue = deque()
+        self.queued_bytes = 0
+        self.dropped = 0
+        self.urgent = False
+        self.closing = False
+        self.condition = threading.Condition(threading.Lock())
+        self.thread = threading.Thread(target=self._run,
+                                       name='AsyncFluentHandler')
+        self.thread.daemon = True
+        self.thread.start()
+        if budget is not None:
+            budget.register(self.budget_name + '.queue', self)
+
+    def emit(self, record):
+        self._prepare(record)
+        size = _record_size(record)
+        with self.condition:
+            if len(self.queue) >= self.queue_max:
+                self.queued_bytes -= _record_size(self.queue.popleft())
+                self.dropped += 1
+            self.queue.append(record)
+            self.queued_bytes += size
+            if record.levelno >= self.flush_level:
+                self.urgent = True
+                self.condition.notify()
+            elif len(self.queue) >= self.batch_size or len(self.queue) == 1:
+                # the first record arms the flush_interval deadline
+                self.condition.notify()
+        if self.budget is not None:
+            self.budget.check()
+
+    def memory_usage(self):
+        """Estimated bytes of the records waiting in the queue."""
+        return self.queued_bytes
+
+    def shed_memory(self, level, needed):
+        """Drop the oldest records until `needed` bytes are freed.
+
+        Queued records cannot be spilled, so SHED_SPILL frees nothing.
+        """
+        if level == SHED_SPILL:
+            return 0
+        freed = 0
+        with self.condition:
+            while freed < needed and self.queue:
+                freed += _record_size(self.queue.popleft())
+                self.dropped += 1
+            self.queued_bytes -= freed
+        return freed
+
+    def flush(self):
+        with self.condition:
+            self.urgent = True
+            self.condition.notify()
+
+    def close(self):
+        with self.condition:
+            self.closing = True
+            self.condition.notify()
+        self.thread.join(self.flush_interval + 5)
+        if self.budget is not None:
+            self.budget.unregister(self.budget_name + '.queue')
+        super(AsyncFluentHandler, self).close()
+
+    def _prepare(self, record):
+        # like logging.handlers.QueueHandler.prepare: the record is
+        # formatted later, in the background thread
+        if isinstance(record.msg, dict):
+            record.msg = dict(record.msg)
+        elif record.args:
+            record.msg = record.getMessage()
+        record.args = None
+        if record.exc_info:
+            if not record.exc_text:
+                formatter = self.formatter or _EXC_FORMATTER
+                record.exc_text = formatter.formatException(record.exc_info)
+            record.exc_info = None
+
+    def _run(self):
+        while True:
+            with self.condition:
+                while not self._due():
+                    self.condition.wait(self._wait_time())
+                records = list(self.queue)
+                self.queue.clear()
+                self.queued_bytes = 0
+                self.urgent = False
+                closing = self.closing
+            self._send(records)
+            if closing:
+                return
+
+    def _due(self):
+        if self.closing or self.urgent or len(self.queue) >= self.batch_size:
+            return True
+        return bool(self.queue) and \
+            time.time() - self.queue[0].created >= self.flush_interval
+
+    def _wait_time(self):
+        if not self.queue:
+            return None
+        return max(self.queue[0].created + self.flush_interval - time.time(),
+                   0.001)
+
+    def _send(self, records):
+        entries = []
+        for record in records:
+            try:
+                entries.append((None, int(record.created),
+                                self.format(record)))
+            except Exception:
+                self.handleError(record)
+        try:
+            self.sender.emit_batch(entries)
+        except Exception:
+            for record in records:
+                self.handleError(record)
+
+
+def _record_size(record):
+    size = _RECORD_OVERHEAD + len(record.exc_text or '')
+    msg = record.msg
+    if isinstance(msg, dict):
+        size += 64 * len(msg)
+        for value in msg.values():
+            if isinstance(value, basestring):
+                size += len(value)
+    elif isinstance(msg, basestring):
+        size += len(msg)
+    return size
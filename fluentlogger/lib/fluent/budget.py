@@ -0,0 +1,186 @@
+# -*- coding: utf-8 -*-
+
+import os
+import struct
+import threading
+import time
+
+from fluent.stats import get_global_stats
+
+# shedding levels, applied in this order
+SHED_BULK = 0
+SHED_SPILL = 1
+SHED_DROP = 2
+SHED_NAMES = ('bulk', 'spill', 'drop')
+
+# enqueue time and length of a spilled packet
+_SPILL_HEADER = struct.Struct('<dI')
+
+
+class MemoryBudget(object):
+    """Bounds the memory held by the buffers of the logging pipeline.
+
+    Buffers, queues and caches register under a name. Each reports the
+    bytes it holds with ``memory_usage()``; those that can give memory
+    back also implement ``shed_memory(level, needed)``, which frees up to
+    `needed` bytes at one of the levels below and returns the bytes freed:
+
+    - SHED_BULK: drop the bulk telemetry.
+    - SHED_SPILL: move buffered data to disk.
+    - SHED_DROP: drop data of any priority, the most important last.
+
+    When the total goes over `soft_limit`, the components shed bulk
+    telemetry, then spill, until the total is back under it. Over
+    `hard_limit`, whatever is still over it is dropped. At each level the
+    component holding the most memory sheds first.
+
+    `enforce` runs from the metrics tick; the senders also call `check`
+    after queueing a packet, which enforces at most every
+    `check_interval` seconds. Neither must be called with the lock of a
+    component held.
+    """
+    def __init__(self, soft_limit, hard_limit, check_interval=0.05,
+                 stats=None):
+        self.soft_limit = soft_limit
+        self.hard_limit = hard_limit
+        self.check_interval = check_interval
+        self.stats = stats if stats is not None else get_global_stats()
+        self.components = {}
+        self.shed = [0, 0, 0]
+        self.enforcements = 0
+        self.lock = threading.Lock()
+        self._checked = 0
+
+    def register(self, name, component):
+        """Account the memory of `component`, replacing `name` if known."""
+        self.components[name] = component
+
+    def unregister(self, name):
+        self.components.pop(name, None)
+
+    def usage(self):
+        """Return the bytes held by every component."""
+        usage = {}
+        for name, component in list(self.components.items()):
+            try:
+                usage[name] = int(component.memory_usage())
+            except Exception:
+                # e.g. a component closed while being read
+                usage[name] = 0
+        return usage
+
+    def total(self):
+        return sum(self.usage().values())
+
+    def snapshot(self):
+        usage = self.usage()
+        return {'total': sum(usage.values()),
+                'soft_limit': self.soft_limit,
+                'hard_limit': self.hard_limit,
+                'components': usage,
+                'shed': dict(zip(SHED_NAMES, self.shed)),
+                'enforcements': self.enforcements}
+
+    def check(self):
+        now = time.time()
+        if now - self._checked < self.check_interval:
+            return 0
+        self._checked = now
+        return self.enforce()
+
+    def enforce(self):
+        """Shed memory until the limits are met, return the bytes freed."""
+        if not self.lock.acquire(False):
+            # another thread is already shedding
+            return 0
+        try:
+            usage = self.usage()
+            total = sum(usage.values())
+            if total <= self.soft_limit:
+                return 0
+            self.enforcements += 1
+            freed = 0
+            for level, limit in ((SHED_BULK, self.soft_limit),
+                                 (SHED_SPILL, self.soft_limit),
+                                 (SHED_DROP, self.hard_limit)):
+                for name in sorted(usage, key=usage.get, reverse=True):
+                    needed = total - freed - limit
+                    if needed <= 0:
+                        break
+                    shed = getattr(self.components.get(name),
+                                   'shed_memory', None)
+                    if shed is None:
+                        continue
+                    try:
+                        released = shed(level, needed)
+                    except Exception:
+                        self.stats.incr('budget.errors')
+                        continue
+                    if released:
+                        freed += released
+                        self.shed[level] += released
+                        self.stats.incr('budget.shed_' + SHED_NAMES[level],
+                                        released)
+            return freed
+        finally:
+            self.lock.release()
+
+
+class SpillFile(object):
+    """A first in, first out file of packets moved out of memory.
+
+    Packets are appended with their enqueue time and read back in order;
+    the file is truncated whenever it has been read entirely. It only
+    extends the memory of a running sender: the file is removed on
+    `close` and nothing is read back after a restart.
+
+    :param max_bytes: `push` refuses packets beyond this file size.
+    """
+    def __init__(self, path, max_bytes=16 * 1024 * 1024):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.file = open(path, 'w+b')
+        self.read_pos = 0
+        self.write_pos = 0
+        self.depth = 0
+
+    @property
+    def pending(self):
+        return self.write_pos - self.read_pos
+
+    def push(self, bytes_, enqueued_at):
+        size = _SPILL_HEADER.size + len(bytes_)
+        if self.write_pos + size > self.max_bytes:
+            return False
+        self.file.seek(self.write_pos)
+        self.file.write(_SPILL_HEADER.pack(enqueued_at, len(bytes_)))
+        self.file.write(bytes_)
+        self.write_pos += size
+        self.depth += 1
+        return True
+
+    def pop(self, max_bytes):
+        """Return the next (bytes, enqueued_at) pairs, up to `max_bytes`
+        of packets but at least one if any."""
+        records = []
+        size = 0
+        self.file.flush()
+        self.file.seek(self.read_pos)
+        while self.read_pos < self.write_pos and size < max_bytes:
+            enqueued_at, length = _SPILL_HEADER.unpack(
+                self.file.read(_SPILL_HEADER.size))
+            records.append((self.file.read(length), enqueued_at))
+            self.read_pos += _SPILL_HEADER.size + length
+            size += length
+        self.depth -= len(records)
+        if self.read_pos == self.write_pos:
+            self.file.truncate(0)
+            self.read_pos = self.write_pos = 0
+        return records
+
+    def close(self):
+        self.file.close()
+        try:
+            os.unlink(self.path)
+        except OSError:
+            pass
@@ -1,8 +1,12 @@
 # -*- coding: utf-8 -*-
 
+import itertools
 import time
 
 from fluent import sender
+from fluent.stats import SAMPLE_EVERY, get_global_stats
+
+_created = itertools.count(1)
 
 
 class Event(object):
@@ -10,4 +14,10 @@ class Event(object):
         assert isinstance(data, dict), 'data must be a dict'
         sender_ = kwargs.get('sender', sender.get_global_sender())
         timestamp = kwargs.get('time', int(time.time()))
-        sender_.emit_with_time(label, timestamp, data)
+        priority = kwargs.get('priority')
+        if next(_created) % SAMPLE_EVERY:
+            sender_.emit_with_time(label, timestamp, data, priority)
+        else:
+            started = time.time()
+            sender_.emit_with_time(label, timestamp, data, priority)
+            get_global_stats().observe('event.emit', time.time() - started)
@@ -0,0 +1,214 @@
+# -*- coding: utf-8 -*-
+
+from __future__ import print_function
+from collections import deque, namedtuple
+import heapq
+import itertools
+import select
+import socket
+import sys
+import threading
+import time
+import traceback
+
+try:
+    import selectors
+except ImportError:  # pragma: no cover
+    # Python 2 has no selectors module
+    selectors = None
+
+EVENT_READ = 1
+EVENT_WRITE = 2
+
+SelectorKey = namedtuple('SelectorKey', ['fileobj', 'fd', 'events', 'data'])
+
+
+class _SelectSelector(object):
+    """The subset of `selectors.SelectSelector` used by `EventLoop`."""
+    def __init__(self):
+        self.keys = {}
+
+    def register(self, fileobj, events, data=None):
+        key = SelectorKey(fileobj, fileobj.fileno(), events, data)
+        self.keys[key.fd] = key
+        return key
+
+    def modify(self, fileobj, events, data=None):
+        return self.register(fileobj, events, data)
+
+    def unregister(self, fileobj):
+        return self.keys.pop(fileobj.fileno())
+
+    def select(self, timeout=None):
+        readers = [fd for fd, key in self.keys.items()
+                   if key.events & EVENT_READ]
+        writers = [fd for fd, key in self.keys.items()
+                   if key.events & EVENT_WRITE]
+        try:
+            readable, writable, _ = select.select(readers, writers, [],
+                                                  timeout)
+        except select.error:
+            return []
+        ready = {}
+        for fd in readable:
+            ready[fd] = ready.get(fd, 0) | EVENT_READ
+        for fd in writable:
+            ready[fd] = ready.get(fd, 0) | EVENT_WRITE
+        return [(self.keys[fd], events) for fd, events in ready.items()
+                if fd in self.keys]
+
+    def close(self):
+        self.keys = {}
+
+
+def _default_selector():
+    if selectors is not None:
+        return selectors.DefaultSelector()
+    return _SelectSelector()
+
+
+class TimerHandle(object):
+    __slots__ = ('when', 'callback', 'args', 'cancelled')
+
+    def __init__(self, when, callback, args):
+        self.when = when
+        self.callback = callback
+        self.args = args
+        self.cancelled = False
+
+    def cancel(self):
+        self.cancelled = True
+
+
+class EventLoop(object):
+    """A single-threaded loop multiplexing non-blocking sockets and timers.
+
+    Readers, writers and timers are plain callbacks called from the loop
+    thread, and must only be added from it. Other threads hand work to the
+    loop with `call_soon_threadsafe`. An exception raised by a callback is
+    printed and the loop goes on.
+    """
+    def __init__(self):
+        self.selector = _default_selector()
+        self.handlers = {}
+        self.timers = []
+        self._sequence = itertools.count()
+        self.callbacks = deque()
+        self.lock = threading.Lock()
+        self.running = False
+        self.thread = None
+
+        self._wakeup_r, self._wakeup_w = socket.socketpair()
+        self._wakeup_r.setblocking(False)
+        self._wakeup_w.setblocking(False)
+        self.add_reader(self._wakeup_r, self._drain_wakeup)
+
+    def add_reader(self, fileobj, callback):
+        self._update(fileobj, EVENT_READ, callback)
+
+    def remove_reader(self, fileobj):
+        self._update(fileobj, EVENT_READ, None)
+
+    def add_writer(self, fileobj, callback):
+        self._update(fileobj, EVENT_WRITE, callback)
+
+    def remove_writer(self, fileobj):
+        self._update(fileobj, EVENT_WRITE, None)
+
+    def call_later(self, delay, callback, *args):
+        handle = TimerHandle(time.time() + delay, callback, args)
+        heapq.heappush(self.timers, (handle.when, next(self._sequence),
+                                     handle))
+        return handle
+
+    def call_soon_threadsafe(self, callback, *args):
+        with self.lock:
+            self.callbacks.append((callback, args))
+        self._wakeup()
+
+    def start(self):
+        self.running = True
+        self.thread = threading.Thread(target=self.run, name='EventLoop')
+        self.thread.daemon = True
+        self.thread.start()
+
+    def stop(self):
+        self.running = False
+        self._wakeup()
+        if self.thread is not None and \
+                self.thread is not threading.current_thread():
+            self.thread.join(5)
+
+    def run(self):
+        self.running = True
+        while self.running:
+            self._run_once()
+
+    def _run_once(self):
+        timeout = None
+        while self.timers and self.timers[0][2].cancelled:
+            heapq.heappop(self.timers)
+        if self.timers:
+            timeout = max(self.timers[0][0] - time.time(), 0)
+        for key, events in self.selector.select(timeout):
+            # look the handlers up again: a callback may have removed them
+            if events & EVENT_READ:
+                reader = self.handlers.get(key.fd, (None, None))[0]
+                if reader is not None:
+                    self._call(reader, ())
+            if events & EVENT_WRITE:
+                writer = self.handlers.get(key.fd, (None, None))[1]
+                if writer is not None:
+                    self._call(writer, ())
+        with self.lock:
+            callbacks = list(self.callbacks)
+            self.callbacks.clear()
+        for callback, args in callbacks:
+            self._call(callback, args)
+        now = time.time()
+        while self.timers and self.timers[0][0] <= now:
+            handle = heapq.heappop(self.timers)[2]
+            if not handle.cancelled:
+                self._call(handle.callback, handle.args)
+
+    def _call(self, callback, args):
+        try:
+            callback(*args)
+        except Exception:
+            print('Failed to run %r in the event loop: %s' %
+                  (callback, sys.exc_info()[0]))
+            traceback.print_exc()
+
+    def _update(self, fileobj, event, callback):
+        fd = fileobj.fileno()
+        reader, writer = self.handlers.get(fd, (None, None))
+        if event == EVENT_READ:
+            reader = callback
+        else:
+            writer = callback
+        events = (EVENT_READ if reader else 0) | (EVENT_WRITE if writer else 0)
+        if fd in self.handlers:
+            if events:
+                self.selector.modify(fileobj, events)
+            else:
+                self.selector.unregister(fileobj)
+        elif events:
+            self.selector.register(fileobj, events)
+        if events:
+            self.handlers[fd] = (reader, writer)
+        else:
+            self.handlers.pop(fd, None)
+
+    def _wakeup(self):
+        try:
+            self._wakeup_w.send(b'x')
+        except socket.error:
+            # the pipe is full, the loop will wake up anyway
+            pass
+
+    def _drain_wakeup(self):
+        try:
+            while self._wakeup_r.recv(4096):
+                pass
+        except socket.error:
+            pass
@@ -0,0 +1,379 @@
+# -*- coding: utf-8 -*-
+
+from __future__ import print_function
+import gzip
+import json
+import os
+import threading
+import time
+import zlib
+
+import msgpack_pure as msgpack
+
+from fluent.budget import SHED_SPILL
+from fluent.stats import get_global_stats
+
+# suffix of the files still being written
+PARTIAL = '.part'
+EXTENSIONS = {'json': '.ndjson', 'msgpack': '.msgpack'}
+
+
+class _TagFile(object):
+    """The file being written for one table."""
+    def __init__(self, path, compress):
+        self.path = path
+        self.raw = open(path + PARTIAL, 'wb')
+        if compress:
+            self.out = gzip.GzipFile(fileobj=self.raw, mode='wb')
+        else:
+            self.out = self.raw
+        self.opened_at = time.time()
+        self.pending = []
+        self.pending_bytes = 0
+        self.written = 0
+        self.records = 0
+
+    def write(self):
+        if self.pending:
+            self.out.write(b''.join(self.pending))
+            self.written += self.pending_bytes
+            del self.pending[:]
+            self.pending_bytes = 0
+
+    def sync(self):
+        self.write()
+        if self.out is not self.raw:
+            self.out.flush(zlib.Z_SYNC_FLUSH)
+        self.raw.flush()
+        os.fsync(self.raw.fileno())
+
+    def size(self):
+        return self.raw.tell()
+
+    def close(self):
+        self.write()
+        if self.out is not self.raw:
+            self.out.close()
+        self.raw.flush()
+        os.fsync(self.raw.fileno())
+        self.raw.close()
+        os.rename(self.path + PARTIAL, self.path)
+
+
+class FileSink(object):
+    """Writes events to rotating per-table files instead of fluentd.
+
+    Each tag gets its own file named after its BigQuery table (the tag
+    with dots replaced by underscores, as in ``bqschema/``), holding one
+    row per event: the record with the event time under `time_key`.
+    With ``format='json'`` the files are newline-delimited JSON ready for
+    a bulk load, with ``format='msgpack'`` they hold the rows as
+    concatenated msgpack maps.
+
+    Rows are encoded when emitted, buffered, and written to the files in
+    chunks of `write_bytes`; the files are fsync'd every `sync_bytes`
+    bytes or `sync_interval` seconds. A file is closed once it reaches
+    `max_bytes` or `max_age` seconds and renamed to its final name, then
+    passed to ``uploader(path, table)``. The uploader should return
+    quickly; it deletes the file once uploaded. Files left ``.part`` by a
+    previous run are finalized when the sink starts.
+
+    Every row is checked against `disk_budget`, counting the files in
+    `directory` and the rows not written yet. The oldest closed files are
+    deleted to make room; rows are dropped when the open files alone
+    would exceed it.
+
+    The interface is the one of `FluentSender`; priorities are accepted
+    and ignored.
+    """
+    def __init__(self,
+                 tag,
+                 directory,
+                 format='json',
+                 compress=False,
+                 max_bytes=8 * 1024 * 1024,
+                 max_age=3600,
+                 disk_budget=64 * 1024 * 1024,
+                 write_bytes=64 * 1024,
+                 sync_bytes=256 * 1024,
+                 sync_interval=5.0,
+                 uploader=None,
+                 time_key='time',
+                 verbose=False,
+                 stats=None,
+                 **kwargs):
+        if format not in EXTENSIONS:
+            raise ValueError('unknown file format %r' % format)
+        self.tag = tag
+        self.directory = directory
+        self.format = format
+        self.compress = compress
+        self.max_bytes = max_bytes
+        self.max_age = max_age
+        self.disk_budget = disk_budget
+        self.write_bytes = write_bytes
+        self.sync_bytes = sync_bytes
+        self.sync_interval = sync_interval
+        self.uploader = uploader
+        self.time_key = time_key
+        self.verbose = verbose
+        self.stats = stats if stats is not None else get_global_stats()
+        self.extension = EXTENSIONS[format] + ('.gz' if compress else '')
+
+        self.lock = threading.Lock()
+        self.files = {}
+        # (path, size) of the closed files, oldest first
+        self.closed = []
+        self.buffered = 0
+        self.dropped = 0
+        self.evicted = 0
+        # incremented on every rotation and dropped row, so that the
+        # compact log dictionary is written again
+        self.generation = 0
+        self._unsynced = 0
+        self._synced_at = time.time()
+        self._sequence = 0
+
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+        self._recover()
+
+    def emit(self, label, data, priority=None):
+        self.emit_with_time(label, int(time.time()), data, priority)
+
+    def emit_with_time(self, label, timestamp, data, priority=None):
+        if label:
+            tag = '.'.join((self.tag, label))
+        else:
+            tag = self.tag
+        if self.verbose:
+            print((tag, timestamp, data))
+        row = self._encode(timestamp, data)
+        if row is not None:
+            self._append(tag, [row])
+
+    def emit_batch(self, entries, priority=None):
+        for label, timestamp, data in entries:
+            self.emit_with_time(label, timestamp, data)
+
+    def emit_raw(self, tag, entries, priority=None):
+        """Write already packed [time, record] entries under `tag`."""
+        self.stats.incr('sender.raw_packets')
+        rows = []
+        pos = 0
+        while pos < len(entries):
+            end = msgpack.skip(entries, pos)
+            timestamp, data = msgpack.unpackb(entries[pos:end])
+            pos = end
+            row = self._encode(timestamp, data)
+            if row is not None:
+                rows.append(row)
+        self._append(tag, rows)
+
+    def flush(self):
+        """Write and fsync the buffered rows, rotate expired files."""
+        with self.lock:
+            self._sync()
+            self._rotate_expired(time.time())
+
+    def lane_stats(self):
+        with self.lock:
+            return {'files': {
+                'depth': sum([len(f.pending) for f in self.files.values()]),
+                'bytes': self.buffered,
+                'open': len(self.files),
+                'closed': len(self.closed),
+                'disk_bytes': self._disk_usage(),
+                'dropped': self.dropped,
+                'evicted': self.evicted}}
+
+    def memory_usage(self):
+        return self.buffered
+
+    def shed_memory(self, level, needed):
+        """Write the buffered rows to their files, without a fsync."""
+        if level != SHED_SPILL:
+            return 0
+        with self.lock:
+            freed = 0
+            for tag_file in self.files.values():
+                size = tag_file.pending_bytes
+                try:
+                    tag_file.write()
+                except (IOError, OSError):
+                    self.stats.incr('sender.send_errors')
+                    continue
+                freed += size
+            self.buffered -= freed
+            return freed
+
+    def close(self):
+        with self.lock:
+            for table in list(self.files):
+                self._rotate(table)
+
+    def _close(self):
+        self.close()
+
+    def _encode(self, timestamp, data):
+        row = dict(data)
+        row[self.time_key] = timestamp
+        try:
+            if self.format == 'json':
+                return json.dumps(row, separators=(',', ':')) + '\n'
+            return msgpack.packb(row)
+        except (TypeError, ValueError):
+            # not representable, e.g. bytes that are not UTF-8
+            self.dropped += 1
+            self.generation += 1
+            self.stats.incr('sender.dropped')
+            return None
+
+    def _append(self, tag, rows):
+        if not rows:
+            return
+        size = sum([len(row) for row in rows])
+        with self.lock:
+            now = time.time()
+            table = tag.replace('.', '_')
+            tag_file = self.files.get(table)
+            if tag_file is not None and (
+                    tag_file.written + tag_file.pending_bytes >= self.max_bytes
+                    or now - tag_file.opened_at >= self.max_age):
+                self._rotate(table)
+                tag_file = None
+            # the rows buffered are on their way to the open files
+            needed = self.buffered + size
+            if self._disk_usage() + needed > self.disk_budget:
+                self._enforce_budget(needed)
+                if self._open_bytes() + needed > self.disk_budget:
+                    self.dropped += len(rows)
+                    self.generation += 1
+                    self.stats.incr('sender.dropped', len(rows))
+                    return
+            if tag_file is None:
+                tag_file = self._open(table)
+            tag_file.pending.extend(rows)
+            tag_file.pending_bytes += size
+            tag_file.records += len(rows)
+            self.buffered += size
+            self._unsynced += size
+            self.stats.incr('sender.bytes_sent', size)
+            if tag_file.pending_bytes >= self.write_bytes:
+                self.buffered -= tag_file.pending_bytes
+                tag_file.write()
+            if self._unsynced >= self.sync_bytes or \
+                    now - self._synced_at >= self.sync_interval:
+                self._sync()
+                self._rotate_expired(now)
+
+    def _open(self, table):
+        self._sequence += 1
+        name = '%s.%s.%d%s' % (table, time.strftime('%Y%m%d%H%M%S'),
+                               self._sequence, self.extension)
+        tag_file = _TagFile(os.path.join(self.directory, name), self.compress)
+        self.files[table] = tag_file
+        return tag_file
+
+    def _sync(self):
+        for tag_file in self.files.values():
+            try:
+                tag_file.sync()
+            except (IOError, OSError):
+                self.stats.incr('sender.send_errors')
+        self.buffered = 0
+        self._unsynced = 0
+        self._synced_at = time.time()
+
+    def _rotate_expired(self, now):
+        for table, tag_file in list(self.files.items()):
+            if now - tag_file.opened_at >= self.max_age or \
+                    tag_file.written >= self.max_bytes:
+                self._rotate(table)
+
+    def _rotate(self, table):
+        tag_file = self.files.pop(table)
+        self.buffered -= tag_file.pending_bytes
+        try:
+            tag_file.close()
+        except (IOError, OSError):
+            self.stats.incr('sender.send_errors')
+            return
+        self.generation += 1
+        self.stats.incr('filesink.files')
+        self._closed(tag_file.path, table)
+
+    def _closed(self, path, table):
+        self.closed.append((path, os.path.getsize(path)))
+        self._enforce_budget()
+        if self.uploader is not None:
+            try:
+                self.uploader(path, table)
+            except Exception:
+                self.stats.incr('filesink.upload_errors')
+
+    def _enforce_budget(self, needed=0):
+        """Delete the oldest closed files until `needed` more bytes fit."""
+        # forget the files the uploader removed
+        self.closed = [(path, size) for path, size in self.closed
+                       if os.path.exists(path)]
+        while self.closed and \
+                self._disk_usage() + needed > self.disk_budget:
+            path, _ = self.closed.pop(0)
+            try:
+                os.unlink(path)
+            except OSError:
+                pass
+            self.evicted += 1
+            self.stats.incr('filesink.evicted')
+
+    def _disk_usage(self):
+        return self._open_bytes() + sum([size for _, size in self.closed])
+
+    def _open_bytes(self):
+        return sum([f.size() for f in self.files.values()])
+
+    def _recover(self):
+        names = sorted(os.listdir(self.directory),
+                       key=lambda name: os.path.getmtime(
+                           os.path.join(self.directory, name)))
+        for name in names:
+            path = os.path.join(self.directory, name)
+            if name.endswith(PARTIAL):
+                final = path[:-len(PARTIAL)]
+                _repair(path)
+                os.rename(path, final)
+                self._closed(final, name.split('.', 1)[0])
+            elif name.endswith(('.ndjson', '.ndjson.gz',
+                                '.msgpack', '.msgpack.gz')):
+                self.closed.append((path, os.path.getsize(path)))
+        self._enforce_budget()
+
+
+def _repair(path):
+    """Drop the incomplete last row left by a crash while writing.
+
+    Compressed files are rewritten, their gzip trailer is missing.
+    """
+    compressed = path.endswith('.gz' + PARTIAL)
+    with open(path, 'rb') as f:
+        data = f.read()
+    if compressed:
+        data = zlib.decompressobj(16 + zlib.MAX_WBITS).decompress(data)
+    if '.ndjson' in path:
+        end = data.rfind(b'\n') + 1
+    else:
+        end = 0
+        try:
+            while end < len(data):
+                end = msgpack.skip(data, end)
+        except Exception:
+            pass
+    if compressed:
+        with open(path, 'wb') as raw:
+            out = gzip.GzipFile(fileobj=raw, mode='wb')
+            out.write(data[:end])
+            out.close()
+    elif end < len(data):
+        with open(path, 'rb+') as f:
+            f.truncate(end)
@@ -1,6 +1,7 @@
 # -*- coding: utf-8 -*-
 
 import logging
+import re
 import socket
 import sys
 
@@ -14,7 +15,7 @@ try:
 except NameError:  # pragma: no cover
     basestring = (str, bytes)
 
-from fluent import sender
+from fluent import sender as _sender
 
 
 class FluentRecordFormatter(logging.Formatter, object):
@@ -84,21 +85,84 @@ class FluentRecordFormatter(logging.Formatter, object):
                 data[str(key)] = value
 
 
+class FastFluentRecordFormatter(FluentRecordFormatter):
+    """ A :class:`FluentRecordFormatter` doing only the work its `fmt` needs.
+
+    The format strings are analyzed once: the message, time and exception
+    text are only computed when referenced, and string messages are only
+    parsed as JSON when they look like a JSON object. The output is the
+    same as :class:`FluentRecordFormatter`, except that a JSON string
+    which is not an object is kept as the message instead of failing.
+    """
+    _FIELD = re.compile(r'%\((\w+)\)')
+
+    def __init__(self, fmt=None, datefmt=None):
+        super(FastFluentRecordFormatter, self).__init__(fmt, datefmt)
+        self._fmt_items = list(self._fmt_dict.items())
+        fields = set()
+        for value in self._fmt_dict.values():
+            fields.update(self._FIELD.findall(value))
+        self._needs_message = 'message' in fields
+        self._needs_time = 'asctime' in fields
+        self._needs_exc_text = 'exc_text' in fields
+
+    def format(self, record):
+        if self._needs_message:
+            record.message = record.getMessage()
+        if self._needs_time:
+            record.asctime = self.formatTime(record, self.datefmt)
+        if self._needs_exc_text and record.exc_info and not record.exc_text:
+            record.exc_text = self.formatException(record.exc_info)
+        record.hostname = self.hostname
+        attributes = record.__dict__
+        data = dict([(key, value % attributes)
+                     for key, value in self._fmt_items])
+
+        msg = record.msg
+        if isinstance(msg, dict):
+            self._add_dic(data, msg)
+        elif isinstance(msg, basestring) and msg.lstrip().startswith('{'):
+            self._structuring(data, msg)
+        else:
+            data['message'] = msg
+        return data
+
+    def usesTime(self):
+        return self._needs_time
+
+
 class FluentHandler(logging.Handler):
     '''
     Logging Handler for fluent.
+
+    Handlers may share one connection by passing the same `sender`; a
+    shared sender is not closed with the handler.
+
+    With a `budget`, the sender created by the handler is accounted in
+    that `MemoryBudget` until the handler is closed. A shared sender is
+    registered by whoever created it.
     '''
     def __init__(self,
                  tag,
                  host='localhost',
                  port=24224,
                  timeout=3.0,
-                 verbose=False):
+                 verbose=False,
+                 sender=None,
+                 budget=None):
 
         self.tag = tag
-        self.sender = sender.FluentSender(tag,
+        self.budget = budget
+        self.budget_name = 'handler.%s.%x' % (tag, id(self))
+        self.owns_sender = sender is None
+        if sender is None:
+            sender = _sender.FluentSender(tag,
                                           host=host, port=port,
-                                          timeout=timeout, verbose=verbose)
+                                          timeout=timeout, verbose=verbose,
+                                          budget=budget)
+            if budget is not None:
+                budget.register(self.budget_name + '.sender', sender)
+        self.sender = sender
         logging.Handler.__init__(self)
 
     def emit(self, record):
@@ -108,7 +172,10 @@ class FluentHandler(logging.Handler):
     def close(self):
         self.acquire()
         try:
-            self.sender._close()
+            if self.owns_sender:
+                if self.budget is not None:
+                    self.budget.unregister(self.budget_name + '.sender')
+                self.sender._close()
             logging.Handler.close(self)
         finally:
             self.release()
@@ -0,0 +1,416 @@
+# -*- coding: utf-8 -*-
+
+from collections import OrderedDict
+import binascii
+import errno
+import os
+import socket
+import threading
+import time
+
+import msgpack_pure as msgpack
+
+from fluent.sender import FluentSender, PRIORITY_NORMAL, SEND_CHUNK
+
+_IN_PROGRESS = (errno.EINPROGRESS, errno.EWOULDBLOCK, errno.EAGAIN)
+
+
+class LoopSender(FluentSender):
+    """A `FluentSender` whose socket is driven by an `EventLoop`.
+
+    `emit` only queues the packet in the lanes and returns: connecting,
+    writing and reconnecting happen without blocking in the loop thread,
+    so one loop can drive several senders next to a `ForwardRelay`.
+    Packets are written as soon as they are queued, or on the next
+    `flush_interval` deadline when it is set. A failed connection is
+    retried after a delay growing from `backoff_min` to `backoff_max`
+    seconds.
+
+    With `require_ack_response`, every packet carries a chunk id and stays
+    buffered until fluentd acknowledges it. Up to `ack_window` packets or
+    `ack_window_bytes` bytes are in flight at once, and acks are matched
+    as they arrive. When an ack is not received within `ack_timeout`
+    seconds, or the connection is lost, the connection is reset and the
+    unacknowledged packets go back to the front of their lanes. Packets
+    in flight do not count toward `bufmax`: the window bounds them.
+
+    The address of fluentd is looked up when the sender is created; when
+    that fails, it is looked up again in a short-lived thread, so the
+    loop never waits on DNS.
+
+    :param loop: a started `EventLoop`.
+    """
+    def __init__(self, tag, loop=None, flush_interval=0,
+                 backoff_min=0.5, backoff_max=30.0,
+                 require_ack_response=False, ack_window=64,
+                 ack_window_bytes=1 * 1024 * 1024, ack_timeout=30.0,
+                 **kwargs):
+        self.loop = loop
+        self.flush_interval = flush_interval
+        self.backoff_min = backoff_min
+        self.backoff_max = backoff_max
+        self.backoff = backoff_min
+        self.require_ack_response = require_ack_response
+        self.ack_window = ack_window
+        self.ack_window_bytes = ack_window_bytes
+        self.ack_timeout = ack_timeout
+
+        # (family, address) of fluentd, None until resolved
+        self.address = None
+        self.closed = False
+
+        # state below is only touched from the loop thread
+        self.resolving = False
+        self.connecting = False
+        self.outbuf = None
+        self.written = 0
+        self.inflight = []
+        self.reconnect_timer = None
+        self.flush_timer = None
+        self.reconnects = 0
+        # packets waiting for an ack: sequence -> [lane, item, sent_at, ids]
+        self.unacked = OrderedDict()
+        self.unacked_bytes = 0
+        self.chunks = {}
+        self.inbuf = b''
+        self.ack_timer = None
+        self._chunk_prefix = str(binascii.hexlify(os.urandom(8))
+                                 .decode('ascii'))
+        self._chunk_seq = 0
+        self.acked = 0
+        self.retransmits = 0
+        self.ack_timeouts = 0
+        self.rtt_sum = 0.0
+        self.rtt_max = 0.0
+        # set under self.lock by emitting threads
+        self._kick_pending = False
+        self._flush_pending = False
+
+        FluentSender.__init__(self, tag, **kwargs)
+
+    def _send(self, bytes_, priority=PRIORITY_NORMAL):
+        with self.lock:
+            self.lanes[priority].push(bytes_, time.time())
+            self.buffered += len(bytes_)
+            self._shed()
+            callback = None
+            if self.flush_interval and self.buffered < SEND_CHUNK:
+                if not (self._flush_pending or self._kick_pending):
+                    self._flush_pending = True
+                    callback = self._arm_flush
+            elif not self._kick_pending:
+                self._kick_pending = True
+                callback = self._kick
+        if callback is not None:
+            self.loop.call_soon_threadsafe(callback)
+        if self.budget is not None:
+            self.budget.check()
+
+    def ack_stats(self):
+        with self.lock:
+            return {'in_flight': len(self.unacked),
+                    'in_flight_bytes': self.unacked_bytes,
+                    'acked': self.acked,
+                    'retransmits': self.retransmits,
+                    'timeouts': self.ack_timeouts,
+                    'rtt_avg_ms': (self.rtt_sum * 1000 / self.acked
+                                   if self.acked else 0.0),
+                    'rtt_max_ms': self.rtt_max * 1000}
+
+    def _queued(self):
+        return self.buffered - self.unacked_bytes
+
+    def _reconnect(self):
+        # called by FluentSender.__init__: connect from the loop instead
+        self._resolve()
+        self.loop.call_soon_threadsafe(self._kick)
+
+    def _close(self):
+        # for good: a replaced sender must not connect again
+        self.closed = True
+        self.loop.call_soon_threadsafe(self._disconnect, False)
+
+    def _resolve(self):
+        try:
+            if self.host.startswith('unix://'):
+                address = (socket.AF_UNIX, self.host[len('unix://'):])
+            else:
+                family, _, _, _, sockaddr = socket.getaddrinfo(
+                    self.host, self.port, 0, socket.SOCK_STREAM)[0]
+                address = (family, sockaddr)
+        except socket.error:
+            self.stats.incr('sender.resolve_errors')
+            return False
+        self.address = address
+        return True
+
+    def _resolve_later(self):
+        def resolve():
+            if self._resolve():
+                callback = self._connect_resolved
+            else:
+                callback = self._schedule_reconnect
+            self.loop.call_soon_threadsafe(callback)
+        self.resolving = True
+        thread = threading.Thread(target=resolve, name='LoopSenderResolve')
+        thread.daemon = True
+        thread.start()
+
+    def _connect_resolved(self):
+        self.resolving = False
+        self._connect()
+
+    def _arm_flush(self):
+        if self.flush_timer is None:
+            self.flush_timer = self.loop.call_later(self.flush_interval,
+                                                    self._kick)
+
+    def _kick(self):
+        with self.lock:
+            self._kick_pending = False
+            self._flush_pending = False
+        if self.flush_timer is not None:
+            self.flush_timer.cancel()
+            self.flush_timer = None
+        if self.socket is None:
+            if not (self.connecting or self.resolving) and \
+                    self.reconnect_timer is None:
+                self._connect()
+        elif not self.connecting and self.outbuf is None:
+            self._write()
+
+    def _connect(self):
+        if self.closed:
+            return
+        if self.address is None:
+            self._resolve_later()
+            return
+        family, address = self.address
+        try:
+            sock = socket.socket(family, socket.SOCK_STREAM)
+            sock.setblocking(False)
+        except socket.error:
+            self._schedule_reconnect()
+            return
+        self.socket = sock
+        self.connecting = True
+        err = sock.connect_ex(address)
+        if err == 0:
+            self._on_connected()
+        elif err in _IN_PROGRESS:
+            self.loop.add_writer(sock, self._on_connected)
+        else:
+            self._disconnect()
+
+    def _on_connected(self):
+        self.loop.remove_writer(self.socket)
+        err = self.socket.getsockopt(socket.SOL_SOCKET, socket.SO_ERROR)
+        if err:
+            self._disconnect()
+            return
+        self.connecting = False
+        self.backoff = self.backoff_min
+        with self.lock:
+            self.generation += 1
+        self.stats.incr('sender.connects')
+        self.loop.add_reader(self.socket, self._on_readable)
+        self._write()
+
+    def _on_readable(self):
+        try:
+            data = self.socket.recv(4096)
+        except socket.error as e:
+            if e.args[0] in _IN_PROGRESS:
+                return
+            data = b''
+        if not data:
+            # the peer closed the connection
+            self._disconnect()
+            return
+        if not self.require_ack_response:
+            return
+        buf = self.inbuf + data
+        pos = 0
+        try:
+            while pos < len(buf):
+                try:
+                    end = msgpack.skip(buf, pos)
+                except msgpack.OutOfData:
+                    break
+                self._on_ack(msgpack.unpackb(buf[pos:end]))
+                pos = end
+        except Exception:
+            # not an ack stream
+            self._disconnect()
+            return
+        self.inbuf = buf[pos:]
+        if self.outbuf is None:
+            # the window may have room again
+            self._write()
+
+    def _on_ack(self, response):
+        chunk = None
+        if isinstance(response, dict):
+            chunk = response.get('ack', response.get(b'ack'))
+        if chunk is None:
+            return
+        if not isinstance(chunk, str):
+            chunk = chunk.decode('utf-8')
+        sequence = self.chunks.pop(chunk, None)
+        entry = self.unacked.get(sequence)
+        if entry is None:
+            # acked after a retransmission
+            return
+        entry[3] -= 1
+        if entry[3]:
+            return
+        del self.unacked[sequence]
+        lane, item, sent_at, _ = entry
+        rtt = time.time() - sent_at
+        with self.lock:
+            self.unacked_bytes -= len(item[0])
+            self._mark_sent([(lane, item)])
+            self.acked += 1
+            self.stats.observe('sender.ack_rtt', rtt)
+            self.rtt_sum += rtt
+            if rtt > self.rtt_max:
+                self.rtt_max = rtt
+
+    def _take_window(self):
+        """Pop the packets that fit in the ack window."""
+        batch = []
+        size = 0
+        while size < SEND_CHUNK and \
+                len(self.unacked) + len(batch) < self.ack_window and \
+                self.unacked_bytes + size < self.ack_window_bytes:
+            lane = self._next_lane()
+            if lane is None:
+                break
+            item = lane.pop()
+            batch.append((lane, item))
+            size += len(item[0])
+        self.unacked_bytes += size
+        return batch
+
+    def _chunked(self, batch):
+        """Add a chunk option to every packet of `batch` and track them."""
+        now = time.time()
+        packets = []
+        for lane, item in batch:
+            bytes_ = item[0]
+            pos = 0
+            ids = 0
+            sequence = self._chunk_seq
+            while pos < len(bytes_):
+                end = msgpack.skip(bytes_, pos)
+                # [tag, time, record] or [tag, entries] gets an option map
+                self._chunk_seq += 1
+                chunk = '%s%x' % (self._chunk_prefix, self._chunk_seq)
+                self.chunks[chunk] = sequence
+                header = ord(bytes_[pos:pos + 1])
+                packets.append(bytearray([header + 1]))
+                packets.append(bytes_[pos + 1:end])
+                packets.append(msgpack.packb({'chunk': chunk}))
+                ids += 1
+                pos = end
+            self.unacked[sequence] = [lane, item, now, ids]
+        if self.ack_timer is None and self.unacked:
+            self.ack_timer = self.loop.call_later(self.ack_timeout,
+                                                  self._check_acks)
+        return b''.join([bytes(packet) for packet in packets])
+
+    def _check_acks(self):
+        self.ack_timer = None
+        if not self.unacked:
+            return
+        oldest = next(iter(self.unacked.values()))[2]
+        late = time.time() - oldest
+        if late >= self.ack_timeout:
+            self.ack_timeouts += 1
+            self.stats.incr('sender.ack_timeouts')
+            self._disconnect()
+        else:
+            self.ack_timer = self.loop.call_later(self.ack_timeout - late,
+                                                  self._check_acks)
+
+    def _write(self):
+        while True:
+            if self.outbuf is None:
+                if self.require_ack_response:
+                    with self.lock:
+                        batch = self._take_window()
+                    if not batch:
+                        self.loop.remove_writer(self.socket)
+                        return
+                    self.outbuf = self._chunked(batch)
+                else:
+                    with self.lock:
+                        self.inflight = self._take_batch()
+                    if not self.inflight:
+                        self.loop.remove_writer(self.socket)
+                        return
+                    self.outbuf = b''.join([item[0]
+                                            for _, item in self.inflight])
+                self.written = 0
+            try:
+                self.written += self.socket.send(self.outbuf[self.written:])
+            except socket.error as e:
+                if e.args[0] in _IN_PROGRESS:
+                    self.loop.add_writer(self.socket, self._write)
+                else:
+                    self._disconnect()
+                return
+            if self.written < len(self.outbuf):
+                # wait until the socket accepts more
+                self.loop.add_writer(self.socket, self._write)
+                return
+            with self.lock:
+                self._mark_sent(self.inflight)
+            self.inflight = []
+            self.outbuf = None
+
+    def _disconnect(self, retry=True):
+        sock = self.socket
+        if sock is not None:
+            self.stats.incr('sender.disconnects')
+            self.loop.remove_reader(sock)
+            self.loop.remove_writer(sock)
+            sock.close()
+        self.socket = None
+        self.connecting = False
+        self.outbuf = None
+        self.inbuf = b''
+        for timer in (self.ack_timer, self.flush_timer, self.reconnect_timer):
+            if timer is not None:
+                timer.cancel()
+        self.ack_timer = self.flush_timer = self.reconnect_timer = None
+        unacked = [(entry[0], entry[1]) for entry in self.unacked.values()]
+        self.unacked.clear()
+        self.chunks.clear()
+        with self.lock:
+            # the next packet arms the flush timer again
+            self._flush_pending = False
+            # a partially written batch is sent again in full
+            self._requeue(self.inflight)
+            self.inflight = []
+            self._requeue(unacked)
+            self.retransmits += len(unacked)
+            self.stats.incr('sender.retransmits', len(unacked))
+            self.unacked_bytes = 0
+            self._shed()
+        if retry:
+            self._schedule_reconnect()
+
+    def _schedule_reconnect(self):
+        self.resolving = False
+        if self.reconnect_timer is not None or self.closed:
+            return
+        self.reconnects += 1
+        self.reconnect_timer = self.loop.call_later(self.backoff,
+                                                    self._retry)
+        self.backoff = min(self.backoff * 2, self.backoff_max)
+
+    def _retry(self):
+        self.reconnect_timer = None
+        if self.buffered or self._spilled():
+            self._connect()
@@ -0,0 +1,197 @@
+# -*- coding: utf-8 -*-
+
+from __future__ import print_function
+import marshal
+import os
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+from fluent.ring import Ring, RingFull
+from fluent.stats import get_global_stats
+from fluent.writer import KIND_EVENT, KIND_RAW
+
+_LIB_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+try:
+    _INTEGERS = (int, long)
+    _SCALARS = frozenset([type(None), bool, float, str, unicode])
+except NameError:
+    _INTEGERS = (int,)
+    _SCALARS = frozenset([type(None), bool, float, bytes, str])
+
+
+def _packable(value):
+    """Whether msgpack can pack `value`, which marshal already accepts."""
+    kind = type(value)
+    if kind in _SCALARS:
+        return True
+    if kind is dict:
+        for key, item in value.items():
+            if not (_packable(key) and _packable(item)):
+                return False
+        return True
+    if kind is list or kind is tuple:
+        for item in value:
+            if not _packable(item):
+                return False
+        return True
+    if kind in _INTEGERS:
+        return -2 ** 63 <= value < 2 ** 64
+    # e.g. sets and complex numbers
+    return False
+
+
+class ProcessSender(object):
+    """Hands events to a writer process through a shared-memory `Ring`.
+
+    The calling thread only marshals the record and copies it into the
+    ring; msgpack packing, batching, compression and socket I/O happen in
+    a ``fluent.writer`` child process. The child is restarted when it
+    dies and resumes from the records it had not written yet. Records
+    that do not fit in the ring, or that msgpack cannot pack, are
+    dropped.
+
+    The interface is the one of `FluentSender`, except that the ring is
+    first in, first out: priorities are accepted and ignored.
+
+    :param bufmax: size of the ring in bytes.
+    :param compress: gzip the PackedForward messages.
+    """
+    def __init__(self,
+                 tag,
+                 host='localhost',
+                 port=24224,
+                 bufmax=4 * 1024 * 1024,
+                 timeout=3.0,
+                 verbose=False,
+                 compress=False,
+                 executable=None,
+                 stats=None,
+                 **kwargs):
+        self.tag = tag
+        self.host = host
+        self.port = port
+        self.timeout = timeout
+        self.verbose = verbose
+        self.compress = compress
+        self.executable = executable or sys.executable
+        self.stats = stats if stats is not None else get_global_stats()
+
+        directory = '/dev/shm' if os.path.isdir('/dev/shm') else None
+        fd, path = tempfile.mkstemp(prefix='fluent-ring-', dir=directory)
+        os.close(fd)
+        self.ring = Ring(path, bufmax)
+        self.lock = threading.Lock()
+        self.dropped = 0
+        self.restarts = 0
+        self.child = None
+        self._checked = 0
+        # records the writer skipped, already counted in the stats
+        self._writer_dropped = 0
+        self._spawn()
+
+    @property
+    def generation(self):
+        # the writer counts new connections, a dropped record also
+        # changes the generation
+        return self.ring.generation + self.dropped + self.ring.dropped
+
+    @property
+    def buffered(self):
+        return self.ring.used()
+
+    def emit(self, label, data, priority=None):
+        self.emit_with_time(label, int(time.time()), data, priority)
+
+    def emit_with_time(self, label, timestamp, data, priority=None):
+        if label:
+            tag = '.'.join((self.tag, label))
+        else:
+            tag = self.tag
+        if self.verbose:
+            print((tag, timestamp, data))
+        try:
+            if not _packable(data):
+                raise ValueError('not packable: %r' % (data,))
+            payload = marshal.dumps((KIND_EVENT, tag, timestamp, data))
+        except ValueError:
+            # only plain Python values can be marshalled and packed
+            self.dropped += 1
+            self.stats.incr('sender.dropped')
+            return
+        self._put(payload)
+
+    def emit_batch(self, entries, priority=None):
+        for label, timestamp, data in entries:
+            self.emit_with_time(label, timestamp, data)
+
+    def emit_raw(self, tag, entries, priority=None):
+        """Send already packed [time, record] entries under `tag`."""
+        self.stats.incr('sender.raw_packets')
+        self._put(marshal.dumps((KIND_RAW, tag, 0, entries)))
+
+    def memory_usage(self):
+        # the marshalled records waiting in the ring
+        return self.ring.used()
+
+    def lane_stats(self):
+        return {'ring': {'depth': self.ring.depth,
+                         'bytes': self.ring.used(),
+                         'dropped': self.dropped + self.ring.dropped,
+                         'restarts': self.restarts}}
+
+    def close(self, timeout=None):
+        """Wait for the writer to empty the ring, then stop it."""
+        deadline = time.time() + (self.timeout if timeout is None
+                                  else timeout)
+        while self.ring.used() and time.time() < deadline and \
+                self.child.poll() is None:
+            time.sleep(0.01)
+        if self.child.poll() is None:
+            self.child.terminate()
+            self.child.wait()
+        self.ring.close()
+        try:
+            os.unlink(self.ring.path)
+        except OSError:
+            # removed by a writer that saw the service exit
+            pass
+
+    def _close(self):
+        self.close()
+
+    def _put(self, payload):
+        with self.lock:
+            try:
+                self.ring.put(payload)
+            except RingFull:
+                self.dropped += 1
+                self.stats.incr('sender.dropped')
+            now = time.time()
+            if now - self._checked >= 1:
+                self._checked = now
+                self._supervise()
+
+    def _supervise(self):
+        dropped = self.ring.dropped
+        if dropped > self._writer_dropped:
+            self.stats.incr('sender.dropped', dropped - self._writer_dropped)
+            self._writer_dropped = dropped
+        if self.child.poll() is None:
+            return
+        # what the writer had not committed is still in the ring
+        self.restarts += 1
+        self.stats.incr('sender.writer_restarts')
+        self._spawn()
+
+    def _spawn(self):
+        env = dict(os.environ)
+        env['PYTHONPATH'] = os.pathsep.join(
+            [_LIB_DIR] + [p for p in [env.get('PYTHONPATH')] if p])
+        command = [self.executable, '-m', 'fluent.writer', self.ring.path,
+                   self.host, str(self.port), '--timeout', str(self.timeout)]
+        if self.compress:
+            command.append('--gzip')
+        self.child = subprocess.Popen(command, env=env, close_fds=True)
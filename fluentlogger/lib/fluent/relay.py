@@ -0,0 +1,218 @@
+# -*- coding: utf-8 -*-
+
+import errno
+import os
+import socket
+import zlib
+
+import msgpack_pure as msgpack
+
+from fluent.loopsender import LoopSender
+from fluent.sender import FluentSender
+
+
+class _Client(object):
+    def __init__(self, sock):
+        self.sock = sock
+        self.inbuf = b''
+        self.outbuf = b''
+        # where to resume skipping the incomplete message starting inbuf
+        self.resume = None
+
+
+class ForwardRelay(object):
+    """Local Forward protocol server feeding a `FluentSender`.
+
+    Other processes on the robot send events to a unix socket and/or a
+    localhost TCP port. Message, Forward and PackedForward modes are
+    re-framed as PackedForward packets for the sender without decoding the
+    records: only the tag and the options are decoded. Tags which do not
+    start with the sender's tag are prefixed with it. Chunk options are
+    acknowledged once the events are handed to the sender.
+
+    All socket work happens in the thread of `loop`, an `EventLoop`, and
+    the events are handed to the sender from it: a `FluentSender` would
+    connect and write to fluentd there and stall every client, so it is
+    refused with a ValueError. Use a `LoopSender`, which only queues.
+    """
+    def __init__(self, sender, loop, unix_path=None, host='127.0.0.1',
+                 port=None, max_clients=128, buffer_max=1 * 1024 * 1024):
+        if isinstance(sender, FluentSender) and \
+                not isinstance(sender, LoopSender):
+            raise ValueError('the relay needs a LoopSender, '
+                             'not a blocking FluentSender')
+        self.sender = sender
+        self.loop = loop
+        self.unix_path = unix_path
+        self.host = host
+        self.port = port
+        self.max_clients = max_clients
+        self.buffer_max = buffer_max
+
+        self.listeners = []
+        self.clients = {}
+        self.messages = 0
+        self.received_bytes = 0
+        self.rejected_clients = 0
+
+    def start(self):
+        if self.unix_path:
+            if os.path.exists(self.unix_path):
+                os.unlink(self.unix_path)
+            listener = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            listener.bind(self.unix_path)
+            self._listen(listener)
+        if self.port is not None:
+            listener = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+            listener.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+            listener.bind((self.host, self.port))
+            self.port = listener.getsockname()[1]
+            self._listen(listener)
+
+    def stop(self):
+        self.loop.call_soon_threadsafe(self._close_all)
+
+    def stats(self):
+        return {'clients': len(self.clients), 'messages': self.messages,
+                'bytes': self.received_bytes,
+                'rejected_clients': self.rejected_clients}
+
+    def memory_usage(self):
+        return sum([len(client.inbuf) + len(client.outbuf)
+                    for client in list(self.clients.values())])
+
+    def _listen(self, listener):
+        listener.setblocking(False)
+        listener.listen(16)
+        self.listeners.append(listener)
+        self.loop.call_soon_threadsafe(
+            self.loop.add_reader, listener, lambda: self._accept(listener))
+
+    def _close_all(self):
+        for client in list(self.clients.values()):
+            self._close(client)
+        for listener in self.listeners:
+            self.loop.remove_reader(listener)
+            listener.close()
+        self.listeners = []
+        if self.unix_path and os.path.exists(self.unix_path):
+            os.unlink(self.unix_path)
+
+    def _accept(self, listener):
+        try:
+            sock, _ = listener.accept()
+        except socket.error:
+            return
+        if len(self.clients) >= self.max_clients:
+            self.rejected_clients += 1
+            sock.close()
+            return
+        sock.setblocking(False)
+        client = _Client(sock)
+        self.clients[sock.fileno()] = client
+        self.loop.add_reader(sock, lambda: self._read(client))
+
+    def _close(self, client):
+        self.loop.remove_reader(client.sock)
+        self.loop.remove_writer(client.sock)
+        self.clients.pop(client.sock.fileno(), None)
+        client.sock.close()
+
+    def _read(self, client):
+        try:
+            data = client.sock.recv(65536)
+        except socket.error as e:
+            if e.args[0] in (errno.EAGAIN, errno.EWOULDBLOCK, errno.EINTR):
+                return
+            data = b''
+        if not data:
+            self._close(client)
+            return
+        self.received_bytes += len(data)
+        buf = client.inbuf + data
+        pos = 0
+        resume = client.resume
+        client.resume = None
+        try:
+            while pos < len(buf):
+                try:
+                    if resume is not None:
+                        # the first message was partly skipped already
+                        end = msgpack.skip(buf, *resume)
+                        resume = None
+                    else:
+                        end = msgpack.skip(buf, pos)
+                except msgpack.OutOfData as e:
+                    client.resume = (e.pos - pos, e.remaining)
+                    break
+                self._handle(client, buf, pos, end)
+                pos = end
+        except Exception:
+            # not a Forward protocol stream
+            self._close(client)
+            return
+        client.inbuf = buf[pos:]
+        if len(client.inbuf) > self.buffer_max:
+            self._close(client)
+
+    def _handle(self, client, buf, pos, end):
+        count, tag_pos = msgpack.container_header(buf, pos)
+        if count < 2 or count > 4:
+            raise ValueError('not a Forward protocol message')
+        second = msgpack.skip(buf, tag_pos)
+        tag = msgpack.unpackb(buf[tag_pos:second])
+        header = ord(buf[second])
+        if (header & 0xf0) == 0x90 or header in (0xdc, 0xdd):
+            # Forward mode: [tag, [[time, record], ...], option?]
+            _, first = msgpack.container_header(buf, second)
+            after = msgpack.skip(buf, second)
+            entries = buf[first:after]
+            options = count - 2
+        elif (header & 0xe0) == 0xa0 or header in (0xd9, 0xda, 0xdb,
+                                                    0xc4, 0xc5, 0xc6):
+            # PackedForward mode: [tag, packed entries, option?]
+            after = msgpack.skip(buf, second)
+            entries = msgpack.unpackb(buf[second:after])
+            options = count - 2
+        else:
+            # Message mode: [tag, time, record, option?]
+            after = msgpack.skip(buf, msgpack.skip(buf, second))
+            entries = b'\x92' + buf[second:after]
+            options = count - 3
+        option = {}
+        if options == 1:
+            option = msgpack.unpackb(buf[after:end]) or {}
+        elif options != 0:
+            raise ValueError('not a Forward protocol message')
+        if option.get('compressed') == 'gzip':
+            entries = zlib.decompress(entries, 16 + zlib.MAX_WBITS)
+
+        self.messages += 1
+        self.sender.emit_raw(self._retag(tag), entries)
+        if 'chunk' in option:
+            self._reply(client, msgpack.packb({'ack': option['chunk']}))
+
+    def _retag(self, tag):
+        prefix = self.sender.tag
+        if tag == prefix or tag.startswith(prefix + '.'):
+            return tag
+        return '.'.join((prefix, tag))
+
+    def _reply(self, client, data):
+        client.outbuf += data
+        self._flush(client)
+
+    def _flush(self, client):
+        try:
+            sent = client.sock.send(client.outbuf)
+        except socket.error as e:
+            if e.args[0] not in (errno.EAGAIN, errno.EWOULDBLOCK,
+                                 errno.EINTR):
+                self._close(client)
+                return
+            sent = 0
+        client.outbuf = client.outbuf[sent:]
+        if client.outbuf:
+            self.loop.add_writer(client.sock, lambda: self._flush(client))
+        else:
+            self.loop.remove_writer(client.sock)
@@ -0,0 +1,164 @@
+# -*- coding: utf-8 -*-
+
+import mmap
+import os
+import struct
+
+MAGIC = b'FLRING01'
+# header: magic, capacity, then the producer and consumer fields on their
+# own cache lines; the record area follows
+_CAPACITY = 8
+_HEAD = 64
+_PRODUCED = 72
+_TAIL = 128
+_CONSUMED = 136
+_GENERATION = 192
+_DROPPED = 200
+HEADER_SIZE = 256
+
+_U32 = struct.Struct('<I')
+_U64 = struct.Struct('<Q')
+# length of the record header marking the unused end of the area
+_WRAP = 0xffffffff
+
+
+class RingFull(Exception):
+    pass
+
+
+class Ring(object):
+    """Single-producer single-consumer ring buffer in a shared file mapping.
+
+    The producer appends length-prefixed records and then publishes the new
+    `head`; the consumer reads records up to the head and publishes the new
+    `tail` once it is done with them. Each offset has a single writer, so
+    the processes need no lock. Offsets grow monotonically, their value
+    modulo the capacity is the position in the record area, and records
+    are 8-byte aligned. A record that does not fit before the end of the
+    area starts at the beginning, after a wrap marker.
+
+    Records between the tail and the head survive the consumer process:
+    a restarted consumer resumes from the last published tail.
+    """
+    def __init__(self, path, capacity=None):
+        create = capacity is not None
+        flags = os.O_RDWR | (os.O_CREAT | os.O_TRUNC if create else 0)
+        fd = os.open(path, flags, 0o600)
+        try:
+            if create:
+                capacity = (capacity + 7) & ~7
+                os.ftruncate(fd, HEADER_SIZE + capacity)
+            else:
+                capacity = os.fstat(fd).st_size - HEADER_SIZE
+            self.map = mmap.mmap(fd, HEADER_SIZE + capacity)
+        finally:
+            os.close(fd)
+        self.path = path
+        if create:
+            self.map[0:8] = MAGIC
+            _U64.pack_into(self.map, _CAPACITY, capacity)
+        elif self.map[0:8] != MAGIC:
+            raise ValueError('%s is not a ring buffer' % path)
+        self.capacity = _U64.unpack_from(self.map, _CAPACITY)[0]
+
+    def close(self):
+        self.map.close()
+
+    @property
+    def head(self):
+        return self._read_offset(_HEAD)
+
+    @property
+    def tail(self):
+        return self._read_offset(_TAIL)
+
+    @property
+    def generation(self):
+        return self._read_offset(_GENERATION)
+
+    @property
+    def dropped(self):
+        """Number of records the consumer could not process."""
+        return self._read_offset(_DROPPED)
+
+    @property
+    def depth(self):
+        """Number of records not committed yet."""
+        return self._read_offset(_PRODUCED) - self._read_offset(_CONSUMED)
+
+    def used(self):
+        return self.head - self.tail
+
+    # producer side
+
+    def put(self, payload):
+        """Append a record, raise RingFull when there is no room."""
+        size = 4 + len(payload)
+        aligned = (size + 7) & ~7
+        if aligned > self.capacity:
+            raise RingFull()
+        head = self.head
+        pos = head % self.capacity
+        skip = 0
+        if pos + aligned > self.capacity:
+            # not enough room before the end: wrap
+            skip = self.capacity - pos
+        if head + skip + aligned - self.tail > self.capacity:
+            raise RingFull()
+        if skip:
+            _U32.pack_into(self.map, HEADER_SIZE + pos, _WRAP)
+            pos = 0
+        start = HEADER_SIZE + pos
+        _U32.pack_into(self.map, start, len(payload))
+        self.map[start + 4:start + size] = payload
+        # publish the record only once it is written
+        _U64.pack_into(self.map, _PRODUCED,
+                       self._read_offset(_PRODUCED) + 1)
+        _U64.pack_into(self.map, _HEAD, head + skip + aligned)
+
+    # consumer side
+
+    def read(self, max_bytes, tail=None):
+        """Return (records, new tail) of the records after `tail`.
+
+        Reading does not release the records: pass the new tail to
+        `commit` once they are processed.
+        """
+        if tail is None:
+            tail = self.tail
+        head = self.head
+        records = []
+        total = 0
+        while tail < head and total < max_bytes:
+            pos = tail % self.capacity
+            length = _U32.unpack_from(self.map, HEADER_SIZE + pos)[0]
+            if length == _WRAP:
+                tail += self.capacity - pos
+                continue
+            start = HEADER_SIZE + pos + 4
+            records.append(self.map[start:start + length])
+            tail += (4 + length + 7) & ~7
+            total += length
+        return records, tail
+
+    def commit(self, tail, count):
+        """Release the records before `tail`, `count` records in all."""
+        _U64.pack_into(self.map, _CONSUMED,
+                       self._read_offset(_CONSUMED) + count)
+        _U64.pack_into(self.map, _TAIL, tail)
+
+    def add_dropped(self, count):
+        _U64.pack_into(self.map, _DROPPED, self.dropped + count)
+
+    def bump_generation(self):
+        _U64.pack_into(self.map, _GENERATION, self.generation + 1)
+
+    def _read_offset(self, offset):
+        # read until stable, the other process may be halfway through a
+        # store of the same offset
+        value = _U64.unpack_from(self.map, offset)[0]
+        while True:
+            again = _U64.unpack_from(self.map, offset)[0]
+            if again == value:
+                return value
+            value = again
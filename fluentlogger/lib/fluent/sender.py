@@ -1,36 +1,132 @@
 # -*- coding: utf-8 -*-
 
 from __future__ import print_function
+from collections import deque
+import os
 import socket
+import tempfile
 import threading
 import time
 
 import msgpack_pure as msgpack
 
+from fluent.budget import SHED_BULK, SHED_SPILL, SpillFile
+from fluent.stats import SAMPLE_EVERY, get_global_stats
 
-_global_sender = None
 
+PRIORITY_CRITICAL = 0
+PRIORITY_NORMAL = 1
+PRIORITY_BULK = 2
+PRIORITY_NAMES = ('critical', 'normal', 'bulk')
+
+# bytes written with a single sendall() when draining the lanes
+SEND_CHUNK = 64 * 1024
+
+_global_sender = None
 
-def setup(tag, **kwargs):
-    host = kwargs.get('host', 'localhost')
-    port = kwargs.get('port', 24224)
 
+def setup(tag, sender_class=None, **kwargs):
     global _global_sender
-    _global_sender = FluentSender(tag, host=host, port=port)
+    if sender_class is None:
+        sender_class = FluentSender
+    _global_sender = sender_class(tag, **kwargs)
 
 
 def get_global_sender():
     return _global_sender
 
 
+class _Lane(object):
+    """Buffered packets of one priority class.
+
+    Packets spilled to disk are older than the ones in `queue`; they are
+    read back into `reloaded`, which is sent first.
+    """
+    def __init__(self, name, bufmax):
+        self.name = name
+        self.bufmax = bufmax
+        self.queue = deque()
+        self.reloaded = deque()
+        self.spill = None
+        # bytes held in memory
+        self.bytes = 0
+        self.sent = 0
+        self.dropped = 0
+        self.latency_sum = 0.0
+        self.latency_max = 0.0
+
+    def push(self, bytes_, enqueued_at):
+        self.queue.append((bytes_, enqueued_at))
+        self.bytes += len(bytes_)
+
+    def pop(self):
+        if self.reloaded:
+            item = self.reloaded.popleft()
+        else:
+            item = self.queue.popleft()
+        self.bytes -= len(item[0])
+        return item
+
+    def unpop(self, item):
+        self.reloaded.appendleft(item)
+        self.bytes += len(item[0])
+
+    def oldest(self):
+        """Return the enqueue time of the next packet in memory."""
+        if self.reloaded:
+            return self.reloaded[0][1]
+        return self.queue[0][1]
+
+    def spilled(self):
+        return self.spill is not None and self.spill.pending > 0
+
+    def __len__(self):
+        return len(self.reloaded) + len(self.queue)
+
+    def stats(self):
+        return {'depth': len(self),
+                'bytes': self.bytes,
+                'spilled': self.spill.depth if self.spill else 0,
+                'sent': self.sent,
+                'dropped': self.dropped,
+                'latency_avg_ms': (self.latency_sum * 1000 / self.sent
+                                   if self.sent else 0.0),
+                'latency_max_ms': self.latency_max * 1000}
+
+
 class FluentSender(object):
+    """Sends events to fluentd with the Forward protocol.
+
+    Packets that cannot be sent are buffered in one lane per priority
+    class. Lanes are drained in strict priority order, except that a
+    waiting lower lane gets one packet after `starvation_limit` packets
+    from higher lanes. When more than `bufmax` bytes are buffered, or a lane
+    exceeds its own bound from `lane_bufmax`, the oldest packets of the
+    lowest priority are dropped first.
+
+    :param classify: optional ``classify(label, data)`` returning the
+      priority of events emitted without an explicit one.
+    :param stats: the `Stats` counting events, bytes and latencies,
+      the global one by default.
+    :param budget: the `MemoryBudget` checked after queueing a packet.
+    :param spill_dir: where normal and bulk packets are spilled when the
+      budget asks for it; without one, shedding only drops them.
+    :param spill_max: size of the spill file of each lane in bytes.
+    """
     def __init__(self,
                  tag,
                  host='localhost',
                  port=24224,
                  bufmax=1 * 1024 * 1024,
                  timeout=3.0,
-                 verbose=False):
+                 verbose=False,
+                 classify=None,
+                 lane_bufmax=None,
+                 starvation_limit=32,
+                 stats=None,
+                 budget=None,
+                 spill_dir=None,
+                 spill_max=16 * 1024 * 1024):
 
         self.tag = tag
         self.host = host
@@ -38,10 +134,26 @@ class FluentSender(object):
         self.bufmax = bufmax
         self.timeout = timeout
         self.verbose = verbose
+        self.classify = classify
+        self.starvation_limit = starvation_limit
+        self.stats = stats if stats is not None else get_global_stats()
+        self.budget = budget
+        self.spill_dir = spill_dir
+        self.spill_max = spill_max
+
+        if lane_bufmax is None:
+            lane_bufmax = (bufmax, bufmax, bufmax)
+        self.lanes = [_Lane(name, limit)
+                      for name, limit in zip(PRIORITY_NAMES, lane_bufmax)]
+        self.buffered = 0
+        self._streak = 0
+        self._packed = 0
 
         self.socket = None
-        self.pendings = None
         self.lock = threading.Lock()
+        # incremented on every new connection and dropped packet: stateful
+        # encodings such as the compact log must start over
+        self.generation = 0
 
         try:
             self._reconnect()
@@ -49,13 +161,98 @@ class FluentSender(object):
             # will be retried in emit()
             self._close()
 
-    def emit(self, label, data):
+    def emit(self, label, data, priority=None):
         cur_time = int(time.time())
-        self.emit_with_time(label, cur_time, data)
+        self.emit_with_time(label, cur_time, data, priority)
+
+    def emit_with_time(self, label, timestamp, data, priority=None):
+        if priority is None:
+            priority = self._priority_of(label, data)
+        self._packed += 1
+        if self._packed % SAMPLE_EVERY:
+            bytes_ = self._make_packet(label, timestamp, data)
+        else:
+            started = time.time()
+            bytes_ = self._make_packet(label, timestamp, data)
+            self.stats.observe('sender.serialize', time.time() - started)
+        self._send(bytes_, priority)
+
+    def emit_batch(self, entries, priority=None):
+        """Send (label, timestamp, data) entries with a single write.
+
+        Without an explicit priority, the batch gets the most urgent
+        priority of its entries.
+        """
+        if not entries:
+            return
+        if priority is None:
+            priority = min([self._priority_of(label, data)
+                            for label, _, data in entries])
+        started = time.time()
+        bytes_ = b''.join([self._make_packet(label, timestamp, data)
+                           for label, timestamp, data in entries])
+        self.stats.observe('sender.serialize_batch', time.time() - started)
+        self._send(bytes_, priority)
 
-    def emit_with_time(self, label, timestamp, data):
-        bytes_ = self._make_packet(label, timestamp, data)
-        self._send(bytes_)
+    def emit_raw(self, tag, entries, priority=PRIORITY_NORMAL):
+        """Send already packed [time, record] entries in PackedForward mode.
+
+        `tag` is used as is, without the sender's tag prefix.
+        """
+        bytes_ = b'\x92' + msgpack.packb(tag) + msgpack.packb(entries)
+        self.stats.incr('sender.raw_packets')
+        self._send(bytes_, priority)
+
+    def lane_stats(self):
+        with self.lock:
+            return dict([(lane.name, lane.stats()) for lane in self.lanes])
+
+    def memory_usage(self):
+        """Bytes of the packed events held, sent or not yet acked."""
+        return self.buffered
+
+    def shed_memory(self, level, needed):
+        """Free up to `needed` bytes for the `MemoryBudget`.
+
+        Critical packets are never spilled: they would wait behind
+        every newer packet of their lane.
+        """
+        if level == SHED_BULK:
+            priorities = [PRIORITY_BULK]
+        elif level == SHED_SPILL:
+            if self.spill_dir is None:
+                return 0
+            priorities = [PRIORITY_BULK, PRIORITY_NORMAL]
+        else:
+            priorities = [PRIORITY_BULK, PRIORITY_NORMAL, PRIORITY_CRITICAL]
+        freed = 0
+        with self.lock:
+            for priority in priorities:
+                lane = self.lanes[priority]
+                if level == SHED_SPILL:
+                    # the packets read back are older than the spill file
+                    while freed < needed and lane.queue:
+                        size = len(lane.queue[0][0])
+                        if not self._spill(lane):
+                            break
+                        freed += size
+                else:
+                    while freed < needed and len(lane):
+                        freed += self._drop(lane)
+        return freed
+
+    def close_spill(self):
+        """Remove the spill files, with the packets they hold."""
+        with self.lock:
+            for lane in self.lanes:
+                if lane.spill is not None:
+                    lane.spill.close()
+                    lane.spill = None
+
+    def _priority_of(self, label, data):
+        if self.classify is None:
+            return PRIORITY_NORMAL
+        return self.classify(label, data)
 
     def _make_packet(self, label, timestamp, data):
         if label:
@@ -67,37 +264,147 @@ class FluentSender(object):
             print(packet)
         return msgpack.packb(packet)
 
-    def _send(self, bytes_):
+    def _send(self, bytes_, priority=PRIORITY_NORMAL):
         self.lock.acquire()
         try:
-            self._send_internal(bytes_)
+            self._send_internal(bytes_, priority)
         finally:
             self.lock.release()
+        if self.budget is not None:
+            self.budget.check()
 
-    def _send_internal(self, bytes_):
+    def _send_internal(self, bytes_, priority):
         # buffering
-        if self.pendings:
-            self.pendings += bytes_
-            bytes_ = self.pendings
+        self.lanes[priority].push(bytes_, time.time())
+        self.buffered += len(bytes_)
 
         try:
             # reconnect if possible
             self._reconnect()
 
-            # send message
-            self.socket.sendall(bytes_)
-
-            # send finished
-            self.pendings = None
+            # send messages
+            self._drain()
         except Exception:
+            self.stats.incr('sender.send_errors')
             # close socket
             self._close()
-            # clear buffer if it exceeds max bufer size
-            if self.pendings and (len(self.pendings) > self.bufmax):
-                # TODO: add callback handler here
-                self.pendings = None
-            else:
-                self.pendings = bytes_
+            # drop packets if the buffers exceed their max size
+            self._shed()
+
+    def _drain(self):
+        while self.buffered or self._spilled():
+            batch = self._take_batch()
+            if not batch:
+                break
+            try:
+                self.socket.sendall(b''.join([item[0]
+                                              for _, item in batch]))
+            except Exception:
+                self._requeue(batch)
+                raise
+            self._mark_sent(batch)
+
+    def _take_batch(self):
+        """Pop up to SEND_CHUNK bytes of (lane, item) pairs from the lanes."""
+        batch = []
+        size = 0
+        while size < SEND_CHUNK:
+            lane = self._next_lane()
+            if lane is None:
+                break
+            item = lane.pop()
+            batch.append((lane, item))
+            size += len(item[0])
+        return batch
+
+    def _requeue(self, batch):
+        for lane, item in reversed(batch):
+            lane.unpop(item)
+
+    def _mark_sent(self, batch):
+        now = time.time()
+        size = 0
+        for lane, (bytes_, enqueued_at) in batch:
+            latency = now - enqueued_at
+            size += len(bytes_)
+            lane.sent += 1
+            lane.latency_sum += latency
+            if latency > lane.latency_max:
+                lane.latency_max = latency
+            # the histogram count is the number of packets sent
+            self.stats.observe('sender.latency', latency)
+        self.buffered -= size
+        self.stats.incr('sender.bytes_sent', size)
+
+    def _next_lane(self):
+        for lane in self.lanes:
+            if not lane.reloaded and lane.spilled():
+                self._unspill(lane)
+        waiting = [lane for lane in self.lanes if len(lane)]
+        if not waiting:
+            return None
+        if len(waiting) == 1:
+            self._streak = 0
+            return waiting[0]
+        if self._streak >= self.starvation_limit:
+            # let the lower lane that waits the longest send one packet
+            self._streak = 0
+            return min(waiting[1:], key=lambda lane: lane.oldest())
+        self._streak += 1
+        return waiting[0]
+
+    def _shed(self):
+        for lane in self.lanes:
+            while lane.bytes > lane.bufmax:
+                self._drop(lane)
+        for lane in reversed(self.lanes):
+            while self._queued() > self.bufmax and len(lane):
+                self._drop(lane)
+
+    def _queued(self):
+        """Bytes buffered in the lanes, the measure of `bufmax`."""
+        return self.buffered
+
+    def _drop(self, lane):
+        # TODO: add callback handler here
+        bytes_, _ = lane.pop()
+        self.buffered -= len(bytes_)
+        lane.dropped += 1
+        self.generation += 1
+        self.stats.incr('sender.dropped')
+        return len(bytes_)
+
+    def _spill(self, lane):
+        """Move the oldest packet of `lane.queue` to its spill file."""
+        if lane.spill is None:
+            if not os.path.isdir(self.spill_dir):
+                os.makedirs(self.spill_dir)
+            fd, path = tempfile.mkstemp(prefix='spill-%s-' % lane.name,
+                                        dir=self.spill_dir)
+            os.close(fd)
+            lane.spill = SpillFile(path, self.spill_max)
+        bytes_, enqueued_at = lane.queue[0]
+        try:
+            if not lane.spill.push(bytes_, enqueued_at):
+                return False
+        except (IOError, OSError):
+            self.stats.incr('sender.spill_errors')
+            return False
+        lane.queue.popleft()
+        lane.bytes -= len(bytes_)
+        self.buffered -= len(bytes_)
+        self.stats.incr('sender.spilled')
+        return True
+
+    def _unspill(self, lane):
+        # read back ahead of the newer packets of the lane
+        for bytes_, enqueued_at in lane.spill.pop(SEND_CHUNK):
+            lane.reloaded.append((bytes_, enqueued_at))
+            lane.bytes += len(bytes_)
+            self.buffered += len(bytes_)
+
+    def _spilled(self):
+        return any([lane.spilled() for lane in self.lanes])
 
     def _reconnect(self):
         if not self.socket:
@@ -110,6 +417,8 @@ class FluentSender(object):
                 sock.settimeout(self.timeout)
                 sock.connect((self.host, self.port))
             self.socket = sock
+            self.generation += 1
+            self.stats.incr('sender.connects')
 
     def _close(self):
         if self.socket:
@@ -0,0 +1,129 @@
+# -*- coding: utf-8 -*-
+
+from bisect import bisect_left
+import threading
+import weakref
+
+# upper bounds of the latency histogram buckets, the last bucket is open
+LATENCY_BOUNDS_MS = (1, 5, 10, 50, 100, 500, 1000, 5000)
+# hot paths time one call in SAMPLE_EVERY, reading the clock is not free
+SAMPLE_EVERY = 16
+
+
+class Stats(object):
+    """Counters, gauges and latency histograms of the logging pipeline.
+
+    Counters and histograms are accumulated without locking in
+    dictionaries owned by the calling thread; `snapshot` merges the
+    dictionaries of all the threads. Gauges are plain values, the last
+    write wins.
+
+    The dictionaries of threads that have exited are folded into a shared
+    total when a thread records for the first time and on `snapshot`, so
+    short-lived threads do not accumulate.
+    """
+    def __init__(self, bounds_ms=LATENCY_BOUNDS_MS):
+        self.bounds_ms = bounds_ms
+        self.gauges = {}
+        self._local = threading.local()
+        # (owner thread weakref, counters, histograms)
+        self._shards = []
+        self._retired = ({}, {})
+        self._lock = threading.Lock()
+
+    def incr(self, name, value=1):
+        try:
+            counters = self._local.counters
+        except AttributeError:
+            counters = self._new_shard()[0]
+        counters[name] = counters.get(name, 0) + value
+
+    def gauge(self, name, value):
+        self.gauges[name] = value
+
+    def observe(self, name, seconds):
+        """Add a latency in seconds to the histogram `name`."""
+        try:
+            histograms = self._local.histograms
+        except AttributeError:
+            histograms = self._new_shard()[1]
+        try:
+            histogram = histograms[name]
+        except KeyError:
+            # [count, sum_ms, bucket counts...]
+            histogram = histograms[name] = [0, 0.0] + \
+                [0] * (len(self.bounds_ms) + 1)
+        ms = seconds * 1000
+        histogram[0] += 1
+        histogram[1] += ms
+        histogram[2 + bisect_left(self.bounds_ms, ms)] += 1
+
+    def snapshot(self):
+        with self._lock:
+            self._collect()
+            shards = [shard[1:] for shard in self._shards]
+            counters = dict(self._retired[0])
+            histograms = dict([(name, list(values)) for name, values
+                               in self._retired[1].items()])
+        for shard_counters, shard_histograms in shards:
+            # dict.copy() is atomic, the owner may be writing meanwhile
+            _merge(counters, histograms, shard_counters.copy(),
+                   shard_histograms.copy())
+        return {'counters': counters,
+                'gauges': dict(self.gauges),
+                'histograms': dict([(name, {'count': values[0],
+                                            'sum_ms': values[1],
+                                            'buckets': values[2:]})
+                                    for name, values in histograms.items()]),
+                'bounds_ms': list(self.bounds_ms)}
+
+    def _new_shard(self):
+        shard = (self._local.__dict__.setdefault('counters', {}),
+                 self._local.__dict__.setdefault('histograms', {}))
+        owner = weakref.ref(threading.current_thread())
+        with self._lock:
+            self._collect()
+            self._shards.append((owner,) + shard)
+        return shard
+
+    def _collect(self):
+        # called with self._lock held; exited threads no longer write
+        alive = []
+        for owner, counters, histograms in self._shards:
+            thread = owner()
+            if thread is not None and thread.is_alive():
+                alive.append((owner, counters, histograms))
+            else:
+                _merge(self._retired[0], self._retired[1], counters,
+                       histograms)
+        self._shards = alive
+
+
+def _merge(counters, histograms, shard_counters, shard_histograms):
+    for name, value in shard_counters.items():
+        counters[name] = counters.get(name, 0) + value
+    for name, values in shard_histograms.items():
+        merged = histograms.get(name)
+        if merged is None:
+            histograms[name] = list(values)
+        else:
+            histograms[name] = [a + b for a, b in zip(merged, values)]
+
+
+class NullStats(Stats):
+    """A `Stats` that records nothing, to turn the instrumentation off."""
+    def incr(self, name, value=1):
+        pass
+
+    def gauge(self, name, value):
+        pass
+
+    def observe(self, name, seconds):
+        pass
+
+
+_global_stats = Stats()
+
+
+def get_global_stats():
+    return _global_stats
@@ -0,0 +1,234 @@
+# -*- coding: utf-8 -*-
+
+import logging
+import sys
+import threading
+import time
+import unittest
+
+from .asynchandler import AsyncFluentHandler
+from .budget import MemoryBudget, SHED_BULK, SHED_DROP, SHED_SPILL
+from .handler import FluentHandler, FluentRecordFormatter
+from .sender import FluentSender
+from .stats import Stats
+from .test_sender import closed_port
+
+
+class FakeSender(object):
+    def __init__(self):
+        self.batches = []
+        self.sent = threading.Condition()
+
+    def emit_batch(self, entries):
+        with self.sent:
+            self.batches.append(entries)
+            self.sent.notify_all()
+
+    def wait_for(self, count, timeout=2.0):
+        deadline = time.time() + timeout
+        with self.sent:
+            while len(self.messages()) < count and time.time() < deadline:
+                self.sent.wait(0.05)
+        return self.messages()
+
+    def messages(self):
+        return [entry[2]['message'] for batch in self.batches
+                for entry in batch]
+
+
+class BrokenFormatter(FluentRecordFormatter):
+    def format(self, record):
+        if record.msg == 'broken':
+            raise ValueError('cannot format')
+        return super(BrokenFormatter, self).format(record)
+
+
+class TestAsyncFluentHandler(unittest.TestCase):
+
+    def setUp(self):
+        self.sender = FakeSender()
+        self.errors = []
+        self.handlers = []
+
+    def tearDown(self):
+        for handler in self.handlers:
+            handler.close()
+
+    def handler(self, formatter=None, **kwargs):
+        kwargs.setdefault('flush_interval', 60)
+        handler = AsyncFluentHandler('app', sender=self.sender, **kwargs)
+        handler.setFormatter(formatter or FluentRecordFormatter(
+            fmt={'level': '%(levelname)s'}))
+        handler.handleError = self.errors.append
+        self.handlers.append(handler)
+        return handler
+
+    def log(self, handler, msg, level=logging.INFO, **attributes):
+        attributes.update({'msg': msg, 'levelno': level,
+                           'levelname': logging.getLevelName(level)})
+        record = logging.makeLogRecord(attributes)
+        handler.handle(record)
+        return record
+
+    def test_batch_size(self):
+        handler = self.handler(batch_size=3)
+        for i in range(3):
+            self.log(handler, 'm%d' % i)
+        self.assertEqual(self.sender.wait_for(3), ['m0', 'm1', 'm2'])
+        self.assertEqual([len(batch) for batch in self.sender.batches], [3])
+
+    def test_flush_level(self):
+        handler = self.handler()
+        self.log(handler, 'info')
+        self.log(handler, 'error', logging.ERROR)
+        self.assertEqual(self.sender.wait_for(2), ['info', 'error'])
+
+    def test_flush_interval(self):
+        handler = self.handler(flush_interval=0.05)
+        self.log(handler, 'late')
+        self.assertEqual(self.sender.wait_for(1), ['late'])
+
+    def test_flush_interval_idle_worker(self):
+        handler = self.handler(flush_interval=0.05)
+        # the worker is already waiting for records
+        time.sleep(0.2)
+        self.log(handler, 'late')
+        self.assertEqual(self.sender.wait_for(1, timeout=1.0), ['late'])
+
+    def test_overflow(self):
+        handler = self.handler(queue_max=3)
+        for i in range(5):
+            self.log(handler, 'm%d' % i)
+        self.assertEqual(handler.dropped, 2)
+        handler.close()
+        # the oldest records were dropped
+        self.assertEqual(self.sender.messages(), ['m2', 'm3', 'm4'])
+
+    def test_flush_on_close(self):
+        handler = self.handler()
+        self.log(handler, 'm0')
+        self.log(handler, 'm1')
+        self.assertEqual(self.sender.batches, [])
+        handler.close()
+        self.assertEqual(self.sender.messages(), ['m0', 'm1'])
+        self.assertFalse(handler.thread.is_alive())
+
+    def test_formatter_error(self):
+        handler = self.handler(formatter=BrokenFormatter(
+            fmt={'level': '%(levelname)s'}))
+        self.log(handler, 'ok')
+        self.log(handler, 'broken')
+        self.log(handler, 'also ok')
+        handler.close()
+        self.assertEqual(self.sender.messages(), ['ok', 'also ok'])
+        self.assertEqual([record.msg for record in self.errors],
+                         ['broken'])
+
+    def test_sender_error(self):
+        handler = self.handler()
+
+        def emit_batch(entries):
+            raise IOError()
+        self.sender.emit_batch = emit_batch
+        self.log(handler, 'm0')
+        self.log(handler, 'm1')
+        handler.close()
+        self.assertEqual(len(self.errors), 2)
+
+    def test_dict_snapshot(self):
+        handler = self.handler()
+        msg = {'message': 'before', 'count': 1}
+        self.log(handler, msg)
+        # the caller reuses its dict before the record is formatted
+        msg['message'] = 'after'
+        msg['count'] = 2
+        handler.close()
+        entry = self.sender.batches[0][0][2]
+        self.assertEqual((entry['message'], entry['count']), ('before', 1))
+
+    def test_args_snapshot(self):
+        handler = self.handler()
+        arg = [1]
+        self.log(handler, 'value %s', args=(arg,))
+        arg.append(2)
+        handler.close()
+        self.assertEqual(self.sender.messages(), ['value [1]'])
+
+    def test_exc_info_released(self):
+        handler = self.handler(formatter=FluentRecordFormatter(
+            fmt={'exc': '%(exc_text)s'}))
+        try:
+            raise ValueError('failed')
+        except ValueError:
+            record = self.log(handler, 'error', logging.WARNING,
+                              exc_info=sys.exc_info())
+        # no traceback, and its frames, kept while queued
+        self.assertEqual(record.exc_info, None)
+        handler.close()
+        entry = self.sender.batches[0][0][2]
+        self.assertTrue(entry['exc'].startswith('Traceback'))
+        self.assertTrue('ValueError: failed' in entry['exc'])
+
+    def test_memory_usage(self):
+        handler = self.handler()
+        self.assertEqual(handler.memory_usage(), 0)
+        self.log(handler, 'x' * 1000)
+        self.log(handler, {'message': 'y' * 2000})
+        self.assertTrue(handler.memory_usage() > 3000)
+        handler.flush()
+        self.sender.wait_for(2)
+        self.assertEqual(handler.memory_usage(), 0)
+
+    def test_shed_memory(self):
+        handler = self.handler()
+        for i in range(4):
+            self.log(handler, 'm%d' % i + 'x' * 1000)
+        usage = handler.memory_usage()
+        self.assertEqual(handler.shed_memory(SHED_SPILL, usage), 0)
+        freed = handler.shed_memory(SHED_BULK, 1)
+        self.assertTrue(freed > 1000)
+        self.assertEqual(handler.memory_usage(), usage - freed)
+        self.assertEqual(handler.shed_memory(SHED_DROP, usage), usage - freed)
+        self.assertEqual(handler.memory_usage(), 0)
+        self.assertEqual(handler.dropped, 4)
+        handler.close()
+        self.assertEqual(self.sender.messages(), [])
+
+    def test_budget(self):
+        budget = MemoryBudget(5000, 10000, check_interval=0, stats=Stats())
+        handler = self.handler(budget=budget)
+        name = handler.budget_name + '.queue'
+        self.assertEqual(list(budget.components), [name])
+        for i in range(10):
+            self.log(handler, 'x' * 1000)
+        # the oldest records were shed down to the soft limit
+        self.assertTrue(handler.memory_usage() <= 5000)
+        self.assertTrue(handler.dropped > 0)
+        handler.close()
+        self.assertEqual(budget.components, {})
+
+
+class TestFluentHandlerBudget(unittest.TestCase):
+
+    def test_owned_sender(self):
+        budget = MemoryBudget(1000, 2000, stats=Stats())
+        handler = FluentHandler('app', port=closed_port(), timeout=0.1,
+                                budget=budget)
+        self.assertTrue(handler.sender.budget is budget)
+        name = handler.budget_name + '.sender'
+        self.assertTrue(budget.components[name] is handler.sender)
+        handler.close()
+        self.assertEqual(budget.components, {})
+
+    def test_shared_sender(self):
+        budget = MemoryBudget(1000, 2000, stats=Stats())
+        sender = FluentSender('app', port=closed_port(), timeout=0.1)
+        handler = FluentHandler('app', sender=sender, budget=budget)
+        # registered by whoever created it
+        self.assertEqual(budget.components, {})
+        handler.close()
+        sender._close()
+
+
+if __name__ == '__main__':
+    unittest.main()
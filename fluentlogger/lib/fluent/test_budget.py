@@ -0,0 +1,204 @@
+# -*- coding: utf-8 -*-
+
+import os
+import shutil
+import tempfile
+import unittest
+
+from .budget import (MemoryBudget, SHED_BULK, SHED_DROP, SHED_SPILL,
+                     SpillFile)
+from .sender import (FluentSender, PRIORITY_BULK, PRIORITY_CRITICAL,
+                     PRIORITY_NORMAL)
+from .stats import Stats
+from .test_sender import closed_port
+
+
+class Component(object):
+    """Holds `sizes[level]` bytes that can be freed at each level."""
+
+    def __init__(self, log, name, bulk=0, spill=0, drop=0):
+        self.log = log
+        self.name = name
+        self.sizes = [bulk, spill, drop]
+
+    def memory_usage(self):
+        return sum(self.sizes)
+
+    def shed_memory(self, level, needed):
+        freed = min(needed, self.sizes[level])
+        self.sizes[level] -= freed
+        self.log.append((self.name, level, needed, freed))
+        return freed
+
+
+class TestMemoryBudget(unittest.TestCase):
+
+    def setUp(self):
+        self.log = []
+        self.budget = MemoryBudget(100, 200, check_interval=0, stats=Stats())
+
+    def add(self, name, **sizes):
+        component = Component(self.log, name, **sizes)
+        self.budget.register(name, component)
+        return component
+
+    def test_under_soft_limit(self):
+        self.add('a', bulk=50, drop=50)
+        self.assertEqual(self.budget.enforce(), 0)
+        self.assertEqual(self.log, [])
+        self.assertEqual(self.budget.enforcements, 0)
+
+    def test_bulk_before_spill(self):
+        self.add('a', bulk=30, spill=50, drop=60)
+        self.assertEqual(self.budget.enforce(), 40)
+        self.assertEqual(self.log, [('a', SHED_BULK, 40, 30),
+                                    ('a', SHED_SPILL, 10, 10)])
+        self.assertEqual(self.budget.total(), 100)
+
+    def test_drop_down_to_hard_limit(self):
+        self.add('a', bulk=10, spill=20, drop=300)
+        self.assertEqual(self.budget.enforce(), 130)
+        self.assertEqual(self.log, [('a', SHED_BULK, 230, 10),
+                                    ('a', SHED_SPILL, 220, 20),
+                                    ('a', SHED_DROP, 100, 100)])
+        self.assertEqual(self.budget.total(), 200)
+        self.assertEqual(self.budget.snapshot()['shed'],
+                         {'bulk': 10, 'spill': 20, 'drop': 100})
+
+    def test_largest_component_first(self):
+        self.add('small', bulk=40)
+        self.add('large', bulk=80)
+        self.budget.enforce()
+        # the large one frees what it can, the small one the rest
+        self.assertEqual(self.log, [('large', SHED_BULK, 20, 20)])
+        self.log[:] = []
+        self.budget.register('small', Component(self.log, 'small', bulk=90))
+        self.budget.enforce()
+        self.assertEqual(self.log, [('small', SHED_BULK, 50, 50)])
+
+    def test_needed_shrinks_across_components(self):
+        self.add('a', bulk=10, drop=100)
+        self.add('b', bulk=20, drop=50)
+        self.budget.enforce()
+        self.assertEqual(self.log[:2], [('a', SHED_BULK, 80, 10),
+                                        ('b', SHED_BULK, 70, 20)])
+
+    def test_failing_component(self):
+        broken = self.add('broken', drop=150)
+
+        def shed_memory(level, needed):
+            raise IOError()
+        broken.shed_memory = shed_memory
+        self.add('ok', bulk=10)
+        self.assertEqual(self.budget.enforce(), 10)
+        self.assertEqual(self.budget.stats.snapshot()['counters']
+                         ['budget.errors'], 2)
+
+
+class TestSpillFile(unittest.TestCase):
+
+    def setUp(self):
+        fd, self.path = tempfile.mkstemp(prefix='spill-')
+        os.close(fd)
+        self.spill = SpillFile(self.path, max_bytes=1024)
+
+    def tearDown(self):
+        self.spill.close()
+
+    def test_round_trip(self):
+        for i in range(5):
+            self.assertTrue(self.spill.push(b'p%d' % i, float(i)))
+        self.assertEqual(self.spill.depth, 5)
+        self.assertEqual(self.spill.pop(4), [(b'p0', 0.0), (b'p1', 1.0)])
+        self.assertEqual(self.spill.depth, 3)
+        # at least one packet, even larger than max_bytes
+        self.assertEqual(self.spill.pop(1), [(b'p2', 2.0)])
+        self.spill.push(b'p5', 5.0)
+        self.assertEqual(self.spill.pop(100),
+                         [(b'p3', 3.0), (b'p4', 4.0), (b'p5', 5.0)])
+        self.assertEqual(self.spill.pop(100), [])
+
+    def test_truncate_when_drained(self):
+        self.spill.push(b'x' * 100, 0.0)
+        self.spill.push(b'y' * 100, 0.0)
+        self.spill.pop(100)
+        self.assertTrue(os.path.getsize(self.path) > 0)
+        self.spill.pop(100)
+        self.assertEqual(self.spill.pending, 0)
+        self.assertEqual(self.spill.write_pos, 0)
+        self.assertEqual(os.path.getsize(self.path), 0)
+
+    def test_max_bytes(self):
+        self.assertTrue(self.spill.push(b'x' * 900, 0.0))
+        self.assertFalse(self.spill.push(b'y' * 200, 0.0))
+        self.assertEqual(self.spill.depth, 1)
+        self.spill.pop(1024)
+        # the space is usable again once read back
+        self.assertTrue(self.spill.push(b'y' * 200, 0.0))
+
+    def test_close_removes_file(self):
+        self.spill.push(b'x', 0.0)
+        self.spill.close()
+        self.assertFalse(os.path.exists(self.path))
+
+
+class TestSenderSpill(unittest.TestCase):
+
+    def setUp(self):
+        self.spill_dir = tempfile.mkdtemp()
+        self.sender = FluentSender('app', host='127.0.0.1',
+                                   port=closed_port(), timeout=0.1,
+                                   stats=Stats(), spill_dir=self.spill_dir)
+
+    def tearDown(self):
+        self.sender.close_spill()
+        shutil.rmtree(self.spill_dir)
+
+    def push(self, priority, payload, enqueued_at=0.0):
+        self.sender.lanes[priority].push(payload, enqueued_at)
+        self.sender.buffered += len(payload)
+
+    def take(self):
+        return [item[0] for _, item in self.sender._take_batch()]
+
+    def test_critical_not_spilled(self):
+        self.push(PRIORITY_CRITICAL, b'c' * 10)
+        self.push(PRIORITY_NORMAL, b'n' * 10)
+        self.push(PRIORITY_BULK, b'b' * 10)
+        self.assertEqual(self.sender.shed_memory(SHED_SPILL, 30), 20)
+        self.assertEqual(self.sender.buffered, 10)
+        stats = self.sender.lane_stats()
+        self.assertEqual(stats['critical']['depth'], 1)
+        self.assertEqual(stats['critical']['spilled'], 0)
+        self.assertEqual(stats['normal']['spilled'], 1)
+        self.assertEqual(stats['bulk']['spilled'], 1)
+
+    def test_spill_read_back_first(self):
+        self.push(PRIORITY_NORMAL, b'n1')
+        self.push(PRIORITY_NORMAL, b'n2')
+        self.sender.shed_memory(SHED_SPILL, 4)
+        self.push(PRIORITY_NORMAL, b'n3')
+        self.push(PRIORITY_CRITICAL, b'c1')
+        # read back while other lanes still have packets
+        self.assertEqual(self.take(), [b'c1', b'n1', b'n2', b'n3'])
+        self.assertEqual(self.sender.buffered, 8)
+        self.assertFalse(self.sender._spilled())
+
+    def test_requeue_keeps_reloaded_order(self):
+        self.push(PRIORITY_BULK, b'b1')
+        self.sender.shed_memory(SHED_SPILL, 2)
+        self.push(PRIORITY_BULK, b'b2')
+        self.sender._requeue(self.sender._take_batch())
+        self.assertEqual(self.take(), [b'b1', b'b2'])
+
+    def test_drop_includes_reloaded(self):
+        self.push(PRIORITY_NORMAL, b'n1')
+        self.sender.shed_memory(SHED_SPILL, 2)
+        self.sender._next_lane()
+        self.assertEqual(self.sender.shed_memory(SHED_DROP, 2), 2)
+        self.assertEqual(self.sender.buffered, 0)
+        self.assertEqual(self.take(), [])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,65 @@
+# -*- coding: utf-8 -*-
+
+import socket
+import threading
+import unittest
+
+from .eventloop import EventLoop
+
+
+class TestEventLoop(unittest.TestCase):
+
+    def setUp(self):
+        self.loop = EventLoop()
+        self.loop.start()
+
+    def tearDown(self):
+        self.loop.stop()
+
+    def call(self, callback, *args):
+        done = threading.Event()
+
+        def run():
+            try:
+                callback(*args)
+            finally:
+                done.set()
+        self.loop.call_soon_threadsafe(run)
+        self.assertTrue(done.wait(2))
+
+    def fail_once(self):
+        raise ValueError('broken callback')
+
+    def test_callback_error(self):
+        self.loop.call_soon_threadsafe(self.fail_once)
+        self.call(lambda: None)
+        self.assertTrue(self.loop.thread.is_alive())
+
+    def test_timer_error(self):
+        fired = threading.Event()
+        self.call(self.loop.call_later, 0, self.fail_once)
+        self.call(self.loop.call_later, 0.01, fired.set)
+        self.assertTrue(fired.wait(2))
+
+    def test_reader_error(self):
+        left, right = socket.socketpair()
+        received = threading.Event()
+
+        def reader():
+            data = left.recv(1)
+            if data == b'x':
+                raise ValueError('broken reader')
+            received.set()
+        try:
+            self.call(self.loop.add_reader, left, reader)
+            right.send(b'x')
+            right.send(b'y')
+            self.assertTrue(received.wait(2))
+            self.call(self.loop.remove_reader, left)
+        finally:
+            left.close()
+            right.close()
+
+
+if __name__ == '__main__':
+    unittest.main()
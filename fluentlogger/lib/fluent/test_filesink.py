@@ -0,0 +1,219 @@
+# -*- coding: utf-8 -*-
+
+import gzip
+import json
+import os
+import shutil
+import tempfile
+import time
+import unittest
+import zlib
+
+import msgpack_pure as msgpack
+
+from .filesink import FileSink
+from .stats import Stats
+
+
+def read_rows(path):
+    if path.endswith('.gz'):
+        f = gzip.open(path, 'rb')
+    else:
+        f = open(path, 'rb')
+    with f:
+        data = f.read()
+    if '.ndjson' in path:
+        return [json.loads(line) for line in data.splitlines()]
+    rows = []
+    pos = 0
+    while pos < len(data):
+        end = msgpack.skip(data, pos)
+        rows.append(msgpack.unpackb(data[pos:end]))
+        pos = end
+    return rows
+
+
+def gzip_partial(data):
+    """Compress `data` like a writer killed before the gzip trailer."""
+    compressor = zlib.compressobj(6, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+    return compressor.compress(data) + compressor.flush(zlib.Z_SYNC_FLUSH)
+
+
+class TestFileSink(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.uploads = []
+        self.sinks = []
+
+    def tearDown(self):
+        for sink in self.sinks:
+            sink.close()
+        shutil.rmtree(self.directory)
+
+    def sink(self, **kwargs):
+        kwargs.setdefault('uploader',
+                          lambda path, table: self.uploads.append(
+                              (path, table)))
+        sink = FileSink('app', self.directory, stats=Stats(), **kwargs)
+        self.sinks.append(sink)
+        return sink
+
+    def files(self):
+        return sorted(os.listdir(self.directory))
+
+    def write_part(self, name, data):
+        with open(os.path.join(self.directory, name), 'wb') as f:
+            f.write(data)
+
+    def test_json_rows(self):
+        sink = self.sink()
+        sink.emit_with_time('x', 1000, {'a': 1})
+        sink.emit_with_time('x', 1001, {'a': 2, 'time': 'shadowed'})
+        sink.close()
+        path, table = self.uploads[0]
+        self.assertEqual(table, 'app_x')
+        self.assertTrue(path.endswith('.ndjson'))
+        self.assertEqual(read_rows(path), [{'a': 1, 'time': 1000},
+                                           {'a': 2, 'time': 1001}])
+
+    def test_msgpack_rows(self):
+        sink = self.sink(format='msgpack', compress=True, time_key='ts')
+        sink.emit_batch([('y', 1000, {'a': 1}), ('y', 1001, {'a': 2})])
+        sink.close()
+        path, table = self.uploads[0]
+        self.assertEqual(table, 'app_y')
+        self.assertTrue(path.endswith('.msgpack.gz'))
+        self.assertEqual(read_rows(path), [{'a': 1, 'ts': 1000},
+                                           {'a': 2, 'ts': 1001}])
+
+    def test_unknown_format(self):
+        self.assertRaises(ValueError, FileSink, 'app', self.directory,
+                          format='csv')
+
+    def test_unencodable_row(self):
+        sink = self.sink(format='msgpack')
+        sink.emit_with_time('x', 1000, {'a': set([1])})
+        sink.emit_with_time('x', 1001, {'a': 1})
+        sink.close()
+        self.assertEqual(sink.dropped, 1)
+        self.assertEqual(read_rows(self.uploads[0][0]),
+                         [{'a': 1, 'time': 1001}])
+
+    def test_emit_raw(self):
+        sink = self.sink()
+        entries = msgpack.packb((1000, {'a': 1})) + \
+            msgpack.packb((1001, {'b': 2}))
+        sink.emit_raw('other.tag', entries)
+        sink.close()
+        path, table = self.uploads[0]
+        self.assertEqual(table, 'other_tag')
+        self.assertEqual(read_rows(path), [{'a': 1, 'time': 1000},
+                                           {'b': 2, 'time': 1001}])
+
+    def test_rotate_by_size(self):
+        sink = self.sink(max_bytes=100, write_bytes=1)
+        for i in range(10):
+            sink.emit_with_time('x', 1000, {'i': i, 'pad': 'x' * 20})
+        sink.close()
+        self.assertTrue(len(self.uploads) > 2)
+        rows = []
+        for path, table in self.uploads:
+            self.assertEqual(table, 'app_x')
+            # rotated by the first row past max_bytes
+            self.assertTrue(os.path.getsize(path) < 100 + 50)
+            rows.extend(read_rows(path))
+        self.assertEqual([row['i'] for row in rows], list(range(10)))
+        self.assertFalse([name for name in self.files()
+                          if name.endswith('.part')])
+
+    def test_rotate_by_age(self):
+        sink = self.sink(max_age=0.05)
+        sink.emit_with_time('x', 1000, {'i': 0})
+        self.assertEqual(self.uploads, [])
+        self.assertTrue(self.files()[0].endswith('.ndjson.part'))
+        time.sleep(0.1)
+        sink.flush()
+        self.assertEqual(len(self.uploads), 1)
+        self.assertEqual(read_rows(self.uploads[0][0]),
+                         [{'i': 0, 'time': 1000}])
+        # the next row starts a new file
+        sink.emit_with_time('x', 1001, {'i': 1})
+        self.assertEqual(len([name for name in self.files()
+                              if name.endswith('.part')]), 1)
+
+    def test_uploader_errors(self):
+        def uploader(path, table):
+            raise OSError('upload failed')
+        sink = self.sink(uploader=uploader)
+        sink.emit_with_time('x', 1000, {})
+        sink.close()
+        self.assertEqual(sink.stats.snapshot()['counters']
+                         ['filesink.upload_errors'], 1)
+
+    def test_recover_json(self):
+        self.write_part('app_x.20260101000000.1.ndjson.part',
+                        b'{"a":1,"time":1}\n{"a":2,"ti')
+        self.sink()
+        path = os.path.join(self.directory,
+                            'app_x.20260101000000.1.ndjson')
+        self.assertEqual(self.uploads, [(path, 'app_x')])
+        self.assertEqual(read_rows(path), [{'a': 1, 'time': 1}])
+
+    def test_recover_json_gzip(self):
+        self.write_part('app_x.20260101000000.1.ndjson.gz.part',
+                        gzip_partial(b'{"a":1,"time":1}\n{"a":2,"ti'))
+        self.sink()
+        path = self.uploads[0][0]
+        self.assertTrue(path.endswith('.ndjson.gz'))
+        self.assertEqual(read_rows(path), [{'a': 1, 'time': 1}])
+
+    def test_recover_msgpack(self):
+        data = msgpack.packb({'a': 1}) + msgpack.packb({'a': 2})
+        self.write_part('app_y.20260101000000.1.msgpack.part',
+                        data + msgpack.packb({'a': 3})[:-1])
+        self.write_part('app_z.20260101000000.2.msgpack.gz.part',
+                        gzip_partial(data + b'\x81'))
+        self.sink(format='msgpack')
+        self.assertEqual(sorted([table for _, table in self.uploads]),
+                         ['app_y', 'app_z'])
+        for path, _ in self.uploads:
+            self.assertEqual(read_rows(path), [{'a': 1}, {'a': 2}])
+
+    def test_evict_oldest_closed_files(self):
+        sink = self.sink(disk_budget=300, max_bytes=50, write_bytes=1,
+                         uploader=None)
+        for i in range(20):
+            sink.emit_with_time('x', 1000, {'i': i, 'pad': 'x' * 20})
+        stats = sink.lane_stats()['files']
+        self.assertTrue(stats['evicted'] > 0)
+        self.assertEqual(stats['dropped'], 0)
+        self.assertTrue(sink._disk_usage() <= 300)
+        sink.close()
+        # the newest rows were kept
+        rows = []
+        for name in self.files():
+            rows.extend(read_rows(os.path.join(self.directory, name)))
+        self.assertEqual(sorted([row['i'] for row in rows])[-1], 19)
+
+    def test_drop_over_budget(self):
+        sink = self.sink(disk_budget=1000, max_bytes=10 ** 6)
+        for i in range(200):
+            sink.emit_with_time('x', 1000, {'i': i})
+        sink.flush()
+        self.assertTrue(sink._disk_usage() <= 1000)
+        self.assertTrue(sink.dropped > 0)
+        generation = sink.generation
+        sink.emit_with_time('x', 1000, {'i': 200})
+        self.assertTrue(sink.generation > generation)
+
+    def test_budget_counts_recovered_files(self):
+        self.write_part('app_x.20260101000000.1.ndjson', b'x' * 800)
+        self.write_part('app_x.20260101000000.2.ndjson', b'y' * 800)
+        sink = self.sink(disk_budget=1000)
+        self.assertEqual(sink.evicted, 1)
+        self.assertEqual(len(self.files()), 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
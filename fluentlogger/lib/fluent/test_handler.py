@@ -0,0 +1,82 @@
+# -*- coding: utf-8 -*-
+
+import logging
+import sys
+import unittest
+
+from .handler import FastFluentRecordFormatter, FluentRecordFormatter
+
+FORMATS = [
+    None,
+    {'level': '%(levelname)s', 'where': '%(module)s:%(lineno)d'},
+    {'text': '%(message)s', 'host': '%(hostname)s'},
+    {'time': '%(asctime)s', 'level': '%(levelname)s'},
+    {'exc': '%(exc_text)s', 'name': '%(name)s'},
+]
+
+
+def make_record(msg, args=None, exc_info=None):
+    return logging.makeLogRecord({
+        'name': 'app.module', 'msg': msg, 'args': args,
+        'levelno': logging.WARNING, 'levelname': 'WARNING',
+        'pathname': '/srv/app/module.py', 'module': 'module',
+        'lineno': 42, 'created': 1700000000.25, 'msecs': 250.0,
+        'exc_info': exc_info})
+
+
+class TestFastFluentRecordFormatter(unittest.TestCase):
+
+    def assertSameOutput(self, msg, args=None, exc_info=None):
+        for fmt in FORMATS:
+            expected = FluentRecordFormatter(fmt, '%Y-%m-%d').format(
+                make_record(msg, args, exc_info))
+            actual = FastFluentRecordFormatter(fmt, '%Y-%m-%d').format(
+                make_record(msg, args, exc_info))
+            self.assertEqual(actual, expected, (fmt, msg))
+
+    def test_dict_message(self):
+        self.assertSameOutput({'message': 'hello', 'count': 3, 1: 'skipped'})
+        # the message overrides the formatted keys
+        self.assertSameOutput({'level': 'custom'})
+
+    def test_json_object_string(self):
+        self.assertSameOutput('{"message": "hello", "count": 3}')
+        self.assertSameOutput('  {"nested": {"a": [1, 2]}}')
+
+    def test_plain_string(self):
+        self.assertSameOutput('hello')
+        self.assertSameOutput('value %s', args=(3,))
+        self.assertSameOutput('{not json')
+        self.assertSameOutput(u'caf\xe9')
+
+    def test_other_messages(self):
+        self.assertSameOutput(42)
+        self.assertSameOutput(None)
+
+    def test_uses_time(self):
+        for fmt in FORMATS:
+            self.assertEqual(FastFluentRecordFormatter(fmt).usesTime(),
+                             FluentRecordFormatter(fmt).usesTime())
+        self.assertTrue(FastFluentRecordFormatter(FORMATS[3]).usesTime())
+
+    def test_exc_info(self):
+        try:
+            raise ValueError('failed')
+        except ValueError:
+            exc_info = sys.exc_info()
+        self.assertSameOutput('error', exc_info=exc_info)
+        record = make_record('error', exc_info=exc_info)
+        data = FastFluentRecordFormatter(FORMATS[4]).format(record)
+        self.assertTrue('ValueError: failed' in data['exc'])
+
+    def test_non_object_json(self):
+        # documented difference: the message is kept instead of failing
+        record = make_record('[1,2]')
+        self.assertRaises(AttributeError, FluentRecordFormatter().format,
+                          record)
+        data = FastFluentRecordFormatter().format(make_record('[1,2]'))
+        self.assertEqual(data['message'], '[1,2]')
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,310 @@
+# -*- coding: utf-8 -*-
+
+import socket
+import threading
+import time
+import unittest
+
+import msgpack_pure as msgpack
+
+from .eventloop import EventLoop
+from .loopsender import LoopSender
+from .sender import PRIORITY_CRITICAL
+from .stats import Stats
+
+
+class Peer(object):
+    """The fluentd end of one connection."""
+    def __init__(self, conn):
+        self.conn = conn
+        self.conn.settimeout(5)
+        self.buf = b''
+
+    def read(self, count):
+        """Return the next `count` messages."""
+        messages = []
+        while len(messages) < count:
+            try:
+                end = msgpack.skip(self.buf)
+            except msgpack.OutOfData:
+                data = self.conn.recv(65536)
+                if not data:
+                    raise EOFError()
+                self.buf += data
+                continue
+            messages.append(msgpack.unpackb(self.buf[:end]))
+            self.buf = self.buf[end:]
+        return messages
+
+    def closed(self):
+        try:
+            return self.conn.recv(65536) == b''
+        except socket.timeout:
+            return False
+
+    def close(self):
+        self.conn.close()
+
+
+class Server(object):
+    def __init__(self):
+        self.listener = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self.listener.bind(('127.0.0.1', 0))
+        self.listener.listen(5)
+        self.port = self.listener.getsockname()[1]
+
+    def accept(self, timeout=5):
+        self.listener.settimeout(timeout)
+        conn, _ = self.listener.accept()
+        return Peer(conn)
+
+    def close(self):
+        self.listener.close()
+
+
+def wait_until(predicate, timeout=5.0):
+    deadline = time.time() + timeout
+    while not predicate() and time.time() < deadline:
+        time.sleep(0.01)
+    return predicate()
+
+
+class LoopSenderTest(unittest.TestCase):
+
+    def setUp(self):
+        self.loop = EventLoop()
+        self.loop.start()
+        self.server = Server()
+        self.senders = []
+
+    def tearDown(self):
+        for sender in self.senders:
+            sender._close()
+        self.loop.stop()
+        self.server.close()
+
+    def sender(self, **kwargs):
+        kwargs.setdefault('backoff_min', 0.05)
+        sender = LoopSender('app', loop=self.loop, host='127.0.0.1',
+                            port=self.server.port, stats=Stats(), **kwargs)
+        self.senders.append(sender)
+        return sender
+
+    def call(self, callback, *args):
+        """Run `callback` in the loop thread and return its result."""
+        result = []
+        done = threading.Event()
+
+        def run():
+            result.append(callback(*args))
+            done.set()
+        self.loop.call_soon_threadsafe(run)
+        self.assertTrue(done.wait(5))
+        return result[0]
+
+
+class TestConnection(LoopSenderTest):
+
+    def test_connect_and_send(self):
+        sender = self.sender()
+        for i in range(3):
+            sender.emit('x', {'i': i})
+        peer = self.server.accept()
+        messages = peer.read(3)
+        self.assertEqual([message[0] for message in messages],
+                         ['app.x'] * 3)
+        self.assertEqual([message[2]['i'] for message in messages],
+                         [0, 1, 2])
+        self.assertTrue(wait_until(lambda: sender.buffered == 0))
+        self.assertEqual(sender.stats.snapshot()['counters']
+                         ['sender.connects'], 1)
+        peer.close()
+
+    def test_resolved_up_front(self):
+        lookups = []
+        getaddrinfo = socket.getaddrinfo
+
+        def recording(*args):
+            lookups.append(threading.current_thread().name)
+            return getaddrinfo(*args)
+        socket.getaddrinfo = recording
+        try:
+            sender = self.sender()
+            self.assertEqual(sender.address,
+                             (socket.AF_INET, ('127.0.0.1', self.server.port)))
+            peer = self.server.accept()
+            peer.close()
+            # reconnecting reuses the address
+            self.assertTrue(wait_until(
+                lambda: sender.stats.snapshot()['counters']
+                .get('sender.disconnects')))
+            sender.emit('x', {})
+            self.server.accept().read(1)
+        finally:
+            socket.getaddrinfo = getaddrinfo
+        self.assertEqual(lookups, [threading.current_thread().name])
+
+    def test_resolve_failure(self):
+        getaddrinfo = socket.getaddrinfo
+        lookups = []
+
+        def failing(*args):
+            lookups.append(threading.current_thread().name)
+            if len(lookups) == 1:
+                raise socket.gaierror(-2, 'Name or service not known')
+            return getaddrinfo(*args)
+        socket.getaddrinfo = failing
+        try:
+            sender = self.sender()
+            self.assertEqual(sender.address, None)
+            sender.emit('x', {'i': 1})
+            # looked up again outside of the loop thread
+            self.assertEqual(self.server.accept().read(1)[0][2], {'i': 1})
+        finally:
+            socket.getaddrinfo = getaddrinfo
+        self.assertEqual(lookups[1], 'LoopSenderResolve')
+        self.assertEqual(sender.stats.snapshot()['counters']
+                         ['sender.resolve_errors'], 1)
+
+    def test_backpressure(self):
+        sender = self.sender(bufmax=64 * 1024 * 1024)
+        peer = self.server.accept()
+        payload = 'x' * 20000
+        started = time.time()
+        for i in range(500):
+            sender.emit('x', {'i': i, 'payload': payload})
+        # emit only queues, even with a peer that does not read
+        self.assertTrue(time.time() - started < 2)
+        self.assertTrue(wait_until(lambda: self.call(
+            lambda: sender.outbuf is not None and
+            sender.socket.fileno() in self.loop.handlers)))
+        self.assertTrue(sender.buffered > 0)
+        messages = peer.read(500)
+        self.assertEqual([message[2]['i'] for message in messages],
+                         list(range(500)))
+        self.assertTrue(wait_until(lambda: sender.buffered == 0))
+        peer.close()
+
+    def test_reconnect(self):
+        sender = self.sender()
+        sender.emit('x', {'i': 0})
+        peer = self.server.accept()
+        peer.read(1)
+        peer.close()
+        self.assertTrue(wait_until(
+            lambda: sender.stats.snapshot()['counters']
+            .get('sender.disconnects')))
+        sender.emit('x', {'i': 1})
+        peer = self.server.accept()
+        self.assertEqual(peer.read(1)[0][2], {'i': 1})
+        self.assertTrue(sender.reconnects >= 1)
+        self.assertEqual(sender.stats.snapshot()['counters']
+                         ['sender.connects'], 2)
+        peer.close()
+
+    def test_reconnect_backoff(self):
+        self.server.close()
+        sender = self.sender(backoff_min=0.02, backoff_max=0.08)
+        sender.emit('x', {})
+        self.assertTrue(wait_until(lambda: sender.reconnects >= 4))
+        self.assertEqual(sender.backoff, 0.08)
+        self.assertTrue(sender.buffered > 0)
+
+    def test_close_cancels_timers(self):
+        sender = self.sender(flush_interval=0.05)
+        peer = self.server.accept()
+        self.assertTrue(wait_until(lambda: self.call(
+            lambda: sender.socket is not None and not sender.connecting)))
+        sender.emit('x', {})
+        sender._close()
+        self.assertTrue(peer.closed())
+        self.assertEqual(self.call(lambda: (sender.flush_timer,
+                                            sender.reconnect_timer)),
+                         (None, None))
+        # a thread still holding the replaced sender
+        sender.emit('x', {})
+        self.assertRaises(socket.timeout, self.server.accept, 0.3)
+
+
+class TestAcks(LoopSenderTest):
+
+    def sender(self, **kwargs):
+        kwargs.setdefault('require_ack_response', True)
+        return LoopSenderTest.sender(self, **kwargs)
+
+    def ack(self, peer, message):
+        peer.conn.sendall(msgpack.packb({'ack': message[3]['chunk']}))
+
+    def test_ack_matching(self):
+        sender = self.sender()
+        for i in range(3):
+            sender.emit('x', {'i': i})
+        peer = self.server.accept()
+        messages = peer.read(3)
+        chunks = set([message[3]['chunk'] for message in messages])
+        self.assertEqual(len(chunks), 3)
+        self.assertEqual(sender.ack_stats()['in_flight'], 3)
+        for message in reversed(messages):
+            self.ack(peer, message)
+        # unknown chunks are ignored
+        peer.conn.sendall(msgpack.packb({'ack': 'unknown'}))
+        self.assertTrue(wait_until(lambda: sender.acked == 3))
+        stats = sender.ack_stats()
+        self.assertEqual(stats['in_flight'], 0)
+        self.assertEqual(stats['in_flight_bytes'], 0)
+        self.assertEqual(sender.buffered, 0)
+        self.assertEqual(sender.lane_stats()['normal']['sent'], 3)
+        peer.close()
+
+    def test_ack_timeout_resend(self):
+        sender = self.sender(ack_timeout=0.2)
+        sender.emit('x', {'i': 1})
+        peer = self.server.accept()
+        first = peer.read(1)[0]
+        # no ack: the connection is reset and the packet sent again
+        self.assertTrue(peer.closed())
+        peer = self.server.accept()
+        second = peer.read(1)[0]
+        self.assertEqual(second[:3], first[:3])
+        self.assertNotEqual(second[3]['chunk'], first[3]['chunk'])
+        self.ack(peer, second)
+        self.assertTrue(wait_until(lambda: sender.acked == 1))
+        stats = sender.ack_stats()
+        self.assertEqual(stats['timeouts'], 1)
+        self.assertEqual(stats['retransmits'], 1)
+        self.assertEqual(sender.buffered, 0)
+        peer.close()
+
+    def test_window(self):
+        sender = self.sender(ack_window=2)
+        for i in range(5):
+            sender.emit('x', {'i': i})
+        peer = self.server.accept()
+        messages = peer.read(2)
+        peer.conn.settimeout(0.2)
+        self.assertRaises(socket.timeout, peer.read, 1)
+        peer.conn.settimeout(5)
+        self.ack(peer, messages[0])
+        messages = peer.read(1)
+        self.assertEqual(messages[0][2], {'i': 2})
+        self.assertEqual(sender.ack_stats()['in_flight'], 2)
+        peer.close()
+
+    def test_in_flight_not_shed(self):
+        sender = self.sender(bufmax=1000)
+        payload = 'x' * 300
+        for i in range(3):
+            sender.emit('x', {'i': i, 'payload': payload})
+        peer = self.server.accept()
+        peer.read(3)
+        self.assertTrue(sender.ack_stats()['in_flight_bytes'] > 900)
+        # over bufmax only when counting the packets in flight
+        sender.emit('x', {'i': 3, 'payload': payload}, PRIORITY_CRITICAL)
+        self.assertEqual(peer.read(1)[0][2]['i'], 3)
+        self.assertEqual(sender.stats.snapshot()['counters']
+                         .get('sender.dropped', 0), 0)
+        peer.close()
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,197 @@
+# -*- coding: utf-8 -*-
+
+import socket
+import struct
+import threading
+import time
+import unittest
+import zlib
+
+import msgpack_pure as msgpack
+
+from .eventloop import EventLoop
+from .relay import ForwardRelay
+from .sender import FluentSender
+from .test_sender import closed_port
+
+
+class TestSkip(unittest.TestCase):
+
+    def test_skip_objects(self):
+        values = [None, True, 1, -1, 300, -40000, 2 ** 40, 1.5, 'abc',
+                  'x' * 40, 'y' * 70000, (1, 'a', (2,)), {'k': (1, 2)},
+                  tuple(range(20)), dict([(i, i) for i in range(20)])]
+        packed = b''.join([msgpack.packb(value) for value in values])
+        pos = 0
+        for value in values:
+            end = msgpack.skip(packed, pos)
+            self.assertEqual(msgpack.unpackb(packed[pos:end]), value)
+            pos = end
+        self.assertEqual(pos, len(packed))
+
+    def test_skip_newer_types(self):
+        for packed in (b'\xd9\x03abc', b'\xc4\x03abc',
+                       b'\xc5\x00\x03abc', b'\xc6\x00\x00\x00\x03abc',
+                       b'\xd4\x01\x02', b'\xc7\x02\x01ab'):
+            self.assertEqual(msgpack.skip(packed + b'\xc0'), len(packed))
+
+    def test_out_of_data(self):
+        packed = msgpack.packb((1, 'abc', {'k': 'v' * 300}))
+        for size in range(len(packed)):
+            self.assertRaises(msgpack.OutOfData, msgpack.skip,
+                              packed[:size])
+
+    def test_resume(self):
+        packed = msgpack.packb(('tag', [(i, {'k': 'v' * i})
+                                        for i in range(50)]))
+        for step in (1, 7, 300):
+            buf = b''
+            resume = (0, 1)
+            for start in range(0, len(packed), step):
+                buf += packed[start:start + step]
+                try:
+                    end = msgpack.skip(buf, *resume)
+                    break
+                except msgpack.OutOfData as e:
+                    resume = (e.pos, e.remaining)
+            self.assertEqual(end, len(packed))
+
+    def test_unknown_header(self):
+        self.assertRaises(RuntimeError, msgpack.skip, b'\xc1')
+
+    def test_container_header(self):
+        self.assertEqual(msgpack.container_header(b'\x93'), (3, 1))
+        self.assertEqual(msgpack.container_header(b'\x00\x81', 1), (1, 2))
+        self.assertEqual(msgpack.container_header(b'\xdc\x01\x00'),
+                         (256, 3))
+        self.assertEqual(msgpack.container_header(
+            b'\xdf\x00\x01\x00\x00'), (65536, 5))
+        self.assertRaises(ValueError, msgpack.container_header, b'\xa1')
+
+    def test_unpack_str8_bin(self):
+        self.assertEqual(msgpack.unpackb(b'\xd9\x03abc'), b'abc')
+        self.assertEqual(msgpack.unpackb(b'\xc4\x02\x00\x01'), b'\x00\x01')
+        self.assertEqual(msgpack.unpackb(b'\xc5\x00\x01z'), b'z')
+        self.assertEqual(msgpack.unpackb(
+            b'\xc6' + struct.pack('>I', 300) + b'b' * 300), b'b' * 300)
+
+
+class FakeSender(object):
+    tag = 'app'
+
+    def __init__(self):
+        self.packets = []
+        self.received = threading.Condition()
+
+    def emit_raw(self, tag, entries):
+        with self.received:
+            self.packets.append((tag, entries))
+            self.received.notify_all()
+
+    def wait_for(self, count, timeout=2.0):
+        deadline = time.time() + timeout
+        with self.received:
+            while len(self.packets) < count and time.time() < deadline:
+                self.received.wait(0.05)
+        return self.packets
+
+    def events(self):
+        events = []
+        for tag, entries in self.packets:
+            pos = 0
+            while pos < len(entries):
+                end = msgpack.skip(entries, pos)
+                events.append((tag, msgpack.unpackb(entries[pos:end])))
+                pos = end
+        return events
+
+
+class TestForwardRelay(unittest.TestCase):
+
+    def setUp(self):
+        self.loop = EventLoop()
+        self.loop.start()
+        self.sender = FakeSender()
+        self.relay = ForwardRelay(self.sender, self.loop, port=0)
+        self.relay.start()
+        self.sock = self.connect()
+
+    def tearDown(self):
+        self.sock.close()
+        self.relay.stop()
+        self.loop.stop()
+
+    def connect(self):
+        sock = socket.create_connection(('127.0.0.1', self.relay.port))
+        sock.settimeout(2)
+        return sock
+
+    def test_message_mode(self):
+        self.sock.sendall(msgpack.packb(('app.x', 1, {'a': 1})))
+        self.sender.wait_for(1)
+        self.assertEqual(self.sender.events(), [('app.x', (1, {'a': 1}))])
+
+    def test_forward_mode(self):
+        self.sock.sendall(msgpack.packb(('x', [(1, {'a': 1}),
+                                               (2, {'a': 2})])))
+        self.sender.wait_for(1)
+        # tags outside the sender's tag are prefixed
+        self.assertEqual(self.sender.events(), [('app.x', (1, {'a': 1})),
+                                                ('app.x', (2, {'a': 2}))])
+
+    def test_packed_forward_mode(self):
+        entries = msgpack.packb((1, {'a': 1})) + msgpack.packb((2, {'b': 2}))
+        self.sock.sendall(msgpack.packb(('app', entries)))
+        # gzip-compressed entries in a bin value
+        compressor = zlib.compressobj(6, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+        gzipped = compressor.compress(entries) + compressor.flush()
+        self.sock.sendall(b'\x93' + msgpack.packb('app') + b'\xc4' +
+                          chr(len(gzipped)) + gzipped +
+                          msgpack.packb({'compressed': 'gzip'}))
+        self.sender.wait_for(2)
+        self.assertEqual([tag for tag, _ in self.sender.packets],
+                         ['app', 'app'])
+        self.assertEqual(self.sender.packets[0][1], entries)
+        self.assertEqual(self.sender.packets[1][1], entries)
+
+    def test_framing(self):
+        messages = b''.join([msgpack.packb(('app', i, {'v': 'x' * i}))
+                             for i in range(100)])
+        for start in range(0, len(messages), 37):
+            self.sock.sendall(messages[start:start + 37])
+            time.sleep(0.001)
+        self.sender.wait_for(100)
+        self.assertEqual([event[1][0] for event in self.sender.events()],
+                         list(range(100)))
+        self.assertEqual(self.relay.messages, 100)
+
+    def test_ack(self):
+        self.sock.sendall(msgpack.packb(('app', 1, {'a': 1},
+                                         {'chunk': 'abc'})))
+        self.assertEqual(msgpack.unpackb(self.sock.recv(100)),
+                         {'ack': 'abc'})
+        self.sock.sendall(msgpack.packb(('app', 1, {'a': 1}, {})))
+        self.sock.sendall(msgpack.packb(('app', [(1, {})],
+                                         {'chunk': 'def'})))
+        self.assertEqual(msgpack.unpackb(self.sock.recv(100)),
+                         {'ack': 'def'})
+        self.assertEqual(len(self.sender.wait_for(3)), 3)
+
+    def test_invalid_stream(self):
+        self.sock.sendall(b'GET / HTTP/1.0\r\n\r\n')
+        self.assertEqual(self.sock.recv(100), b'')
+        # other clients are not affected
+        other = self.connect()
+        try:
+            other.sendall(msgpack.packb(('app', 1, {})))
+            self.assertEqual(len(self.sender.wait_for(1)), 1)
+        finally:
+            other.close()
+
+    def test_blocking_sender_refused(self):
+        sender = FluentSender('app', host='127.0.0.1', port=closed_port())
+        self.assertRaises(ValueError, ForwardRelay, sender, self.loop)
+
+
+if __name__ == '__main__':
+    unittest.main()
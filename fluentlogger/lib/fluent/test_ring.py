@@ -0,0 +1,263 @@
+# -*- coding: utf-8 -*-
+
+import marshal
+import os
+import shutil
+import signal
+import socket
+import tempfile
+import threading
+import time
+import unittest
+
+import msgpack_pure as msgpack
+
+from .procsender import ProcessSender
+from .ring import Ring, RingFull
+from .writer import KIND_EVENT, KIND_RAW, RingWriter, pack_records
+
+
+def event(tag, timestamp, data):
+    return marshal.dumps((KIND_EVENT, tag, timestamp, data))
+
+
+def messages(data):
+    result = []
+    pos = 0
+    while pos < len(data):
+        end = msgpack.skip(data, pos)
+        result.append(msgpack.unpackb(data[pos:end]))
+        pos = end
+    return result
+
+
+def unpack_messages(data):
+    """Return the (tag, time, record) of a stream of PackedForward."""
+    events = []
+    for message in messages(data):
+        entries = message[1]
+        entry_pos = 0
+        while entry_pos < len(entries):
+            entry_end = msgpack.skip(entries, entry_pos)
+            timestamp, record = msgpack.unpackb(entries[entry_pos:entry_end])
+            events.append((message[0], timestamp, record))
+            entry_pos = entry_end
+    return events
+
+
+class Receiver(object):
+    """Accepts connections and keeps everything it reads."""
+    def __init__(self):
+        self.listener = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self.listener.bind(('127.0.0.1', 0))
+        self.listener.listen(5)
+        self.port = self.listener.getsockname()[1]
+        self.data = b''
+        self.lock = threading.Lock()
+        thread = threading.Thread(target=self._accept)
+        thread.daemon = True
+        thread.start()
+
+    def events(self):
+        with self.lock:
+            return unpack_messages(self.data)
+
+    def wait_for(self, count, timeout=5.0):
+        deadline = time.time() + timeout
+        while len(self.events()) < count and time.time() < deadline:
+            time.sleep(0.01)
+        return self.events()
+
+    def close(self):
+        self.listener.close()
+
+    def _accept(self):
+        while True:
+            try:
+                conn, _ = self.listener.accept()
+            except socket.error:
+                return
+            thread = threading.Thread(target=self._read, args=(conn,))
+            thread.daemon = True
+            thread.start()
+
+    def _read(self, conn):
+        while True:
+            data = conn.recv(65536)
+            if not data:
+                return
+            with self.lock:
+                self.data += data
+
+
+class TestRing(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.path = os.path.join(self.directory, 'ring')
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_put_read_commit(self):
+        ring = Ring(self.path, 256)
+        ring.put(b'first')
+        ring.put(b'second')
+        self.assertEqual(ring.depth, 2)
+        records, tail = ring.read(1024)
+        self.assertEqual(records, [b'first', b'second'])
+        # reading does not release the records
+        self.assertEqual(ring.read(1024)[0], records)
+        ring.commit(tail, len(records))
+        self.assertEqual(ring.depth, 0)
+        self.assertEqual(ring.used(), 0)
+
+    def test_wrap(self):
+        ring = Ring(self.path, 64)
+        for i in range(20):
+            payload = ('record %d' % i).encode('ascii') * 2
+            ring.put(payload)
+            records, tail = ring.read(1024)
+            self.assertEqual(records, [payload])
+            ring.commit(tail, 1)
+        self.assertTrue(ring.head > ring.capacity)
+
+    def test_full(self):
+        ring = Ring(self.path, 64)
+        self.assertRaises(RingFull, ring.put, b'x' * 64)
+        ring.put(b'x' * 20)
+        ring.put(b'x' * 20)
+        self.assertRaises(RingFull, ring.put, b'x' * 20)
+        records, tail = ring.read(1)
+        ring.commit(tail, len(records))
+        ring.put(b'x' * 20)
+
+    def test_resume_from_tail(self):
+        ring = Ring(self.path, 256)
+        for payload in (b'a', b'b', b'c'):
+            ring.put(payload)
+        records, tail = ring.read(1)
+        ring.commit(tail, len(records))
+        # a restarted consumer maps the same file
+        ring = Ring(self.path)
+        self.assertEqual(ring.read(1024)[0], [b'b', b'c'])
+        self.assertRaises(ValueError, Ring, __file__)
+
+
+class TestWriter(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.ring = Ring(os.path.join(self.directory, 'ring'), 4096)
+
+    def tearDown(self):
+        self.ring.close()
+        shutil.rmtree(self.directory)
+
+    def test_pack_records(self):
+        raw = msgpack.packb((3, {'c': 3}))
+        data, skipped = pack_records([
+            event('a', 1, {'a': 1}), event('a', 2, {'a': 2}),
+            marshal.dumps((KIND_RAW, 'b', 0, raw)), event('a', 4, {'a': 4})])
+        self.assertEqual(skipped, 0)
+        self.assertEqual(unpack_messages(data),
+                         [('a', 1, {'a': 1}), ('a', 2, {'a': 2}),
+                          ('b', 3, {'c': 3}), ('a', 4, {'a': 4})])
+        # consecutive records of a tag share one message
+        self.assertEqual(len(messages(data)), 3)
+
+    def test_pack_records_gzip(self):
+        data, _ = pack_records([event('a', 1, {'a': 1})], compress=True)
+        message = msgpack.unpackb(data)
+        self.assertEqual(message[2], {'compressed': 'gzip'})
+
+    def test_bad_records_are_skipped(self):
+        self.ring.put(event('a', 1, {'x': set([1])}))
+        self.ring.put(b'not marshal')
+        self.ring.put(event('a', 2, {'x': 2}))
+        receiver = Receiver()
+        try:
+            writer = RingWriter(self.ring, '127.0.0.1', receiver.port)
+            self.assertTrue(writer.step())
+            self.assertEqual(self.ring.depth, 0)
+            self.assertEqual(self.ring.dropped, 2)
+            self.assertEqual(receiver.wait_for(1), [('a', 2, {'x': 2})])
+            writer._close()
+        finally:
+            receiver.close()
+
+    def test_restart_resumes(self):
+        self.ring.put(event('a', 1, {'x': 1}))
+        receiver = Receiver()
+        try:
+            closed = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+            closed.bind(('127.0.0.1', 0))
+            port = closed.getsockname()[1]
+            closed.close()
+            writer = RingWriter(self.ring, '127.0.0.1', port, timeout=0.5)
+            self.assertRaises(socket.error, writer.step)
+            self.assertEqual(self.ring.depth, 1)
+            # the next writer sends what the first one could not
+            writer = RingWriter(self.ring, '127.0.0.1', receiver.port)
+            self.assertTrue(writer.step())
+            self.assertFalse(writer.step())
+            self.assertEqual(receiver.wait_for(1), [('a', 1, {'x': 1})])
+            writer._close()
+        finally:
+            receiver.close()
+
+    def test_orphan_gives_up(self):
+        self.ring.put(event('a', 1, {'x': 1}))
+        closed = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        closed.bind(('127.0.0.1', 0))
+        port = closed.getsockname()[1]
+        closed.close()
+        writer = RingWriter(self.ring, '127.0.0.1', port, timeout=0.5,
+                            backoff_max=0.05, orphan_timeout=0.2)
+        # the service died while fluentd is unreachable
+        writer.parent = -1
+        thread = threading.Thread(target=writer.run)
+        thread.daemon = True
+        thread.start()
+        thread.join(5)
+        self.assertFalse(thread.is_alive())
+        self.assertFalse(os.path.exists(self.ring.path))
+
+
+class TestProcessSender(unittest.TestCase):
+
+    def setUp(self):
+        self.receiver = Receiver()
+        self.sender = ProcessSender('app', host='127.0.0.1',
+                                    port=self.receiver.port, bufmax=65536)
+
+    def tearDown(self):
+        self.sender.close()
+        self.receiver.close()
+
+    def test_unpackable_rejected(self):
+        self.sender.emit_with_time('bad', 1, {'x': set([1])})
+        self.sender.emit_with_time('bad', 1, {'x': 1j})
+        self.sender.emit_with_time('good', 1, {'x': [1, 2.0, u'y']})
+        self.assertEqual(self.sender.dropped, 2)
+        # msgpack_pure unpacks arrays as tuples
+        self.assertEqual(self.receiver.wait_for(1),
+                         [('app.good', 1, {'x': (1, 2.0, 'y')})])
+
+    def test_writer_restart(self):
+        for i in range(3):
+            self.sender.emit_with_time('a', i, {'i': i})
+        self.receiver.wait_for(3)
+        os.kill(self.sender.child.pid, signal.SIGKILL)
+        self.sender.child.wait()
+        self.sender._checked = 0
+        for i in range(3, 6):
+            self.sender.emit_with_time('a', i, {'i': i})
+        events = self.receiver.wait_for(6)
+        self.assertEqual(sorted([record['i'] for _, _, record in events]),
+                         list(range(6)))
+        self.assertEqual(self.sender.restarts, 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
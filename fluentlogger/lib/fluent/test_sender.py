@@ -0,0 +1,101 @@
+# -*- coding: utf-8 -*-
+
+import socket
+import unittest
+
+from .sender import (FluentSender, PRIORITY_BULK, PRIORITY_CRITICAL,
+                     PRIORITY_NORMAL)
+from .stats import Stats
+
+
+def closed_port():
+    sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    sock.bind(('127.0.0.1', 0))
+    port = sock.getsockname()[1]
+    sock.close()
+    return port
+
+
+class TestLanes(unittest.TestCase):
+
+    def setUp(self):
+        # nothing listens: every packet stays buffered
+        self.sender = FluentSender('app', host='127.0.0.1',
+                                   port=closed_port(), timeout=0.1,
+                                   starvation_limit=2, stats=Stats())
+
+    def push(self, priority, payload, enqueued_at=0.0):
+        self.sender.lanes[priority].push(payload, enqueued_at)
+        self.sender.buffered += len(payload)
+
+    def take(self):
+        return [item[0] for _, item in self.sender._take_batch()]
+
+    def test_priority_order(self):
+        self.push(PRIORITY_BULK, b'b1')
+        self.push(PRIORITY_NORMAL, b'n1')
+        self.push(PRIORITY_CRITICAL, b'c1')
+        self.assertEqual(self.take(), [b'c1', b'n1', b'b1'])
+        self.assertEqual(self.take(), [])
+
+    def test_starvation(self):
+        for i in range(6):
+            self.push(PRIORITY_CRITICAL, b'c%d' % i, 10.0)
+        self.push(PRIORITY_BULK, b'b0', 1.0)
+        self.push(PRIORITY_NORMAL, b'n0', 2.0)
+        # after two critical packets the oldest waiting lane gets one
+        self.assertEqual(self.take(), [b'c0', b'c1', b'b0', b'c2', b'c3',
+                                       b'n0', b'c4', b'c5'])
+
+    def test_requeue(self):
+        self.push(PRIORITY_NORMAL, b'n1')
+        self.push(PRIORITY_NORMAL, b'n2')
+        batch = self.sender._take_batch()
+        self.sender._requeue(batch)
+        self.assertEqual(self.take(), [b'n1', b'n2'])
+
+    def test_shed_lowest_first(self):
+        self.sender.bufmax = 10
+        self.push(PRIORITY_CRITICAL, b'c' * 4)
+        self.push(PRIORITY_NORMAL, b'n' * 4)
+        self.push(PRIORITY_BULK, b'b' * 4)
+        self.push(PRIORITY_BULK, b'B' * 4)
+        generation = self.sender.generation
+        self.sender._shed()
+        self.assertEqual(self.sender.buffered, 8)
+        stats = self.sender.lane_stats()
+        self.assertEqual(stats['bulk']['dropped'], 2)
+        self.assertEqual(stats['normal']['depth'], 1)
+        self.assertEqual(stats['critical']['bytes'], 4)
+        # receivers of the compact log must start a new epoch
+        self.assertTrue(self.sender.generation > generation)
+
+    def test_lane_bufmax(self):
+        self.sender.lanes[PRIORITY_NORMAL].bufmax = 5
+        self.push(PRIORITY_NORMAL, b'n' * 4)
+        self.push(PRIORITY_NORMAL, b'N' * 4)
+        self.sender._shed()
+        self.assertEqual(self.take(), [b'N' * 4])
+
+    def test_emit_buffers_by_priority(self):
+        self.sender.emit('a', {'x': 1}, PRIORITY_BULK)
+        self.sender.emit('b', {'x': 2}, PRIORITY_CRITICAL)
+        stats = self.sender.lane_stats()
+        self.assertEqual(stats['bulk']['depth'], 1)
+        self.assertEqual(stats['critical']['depth'], 1)
+        self.assertEqual(stats['normal']['depth'], 0)
+        self.assertEqual(self.sender.buffered,
+                         stats['bulk']['bytes'] + stats['critical']['bytes'])
+
+    def test_mark_sent(self):
+        self.push(PRIORITY_NORMAL, b'n1')
+        self.sender._mark_sent(self.sender._take_batch())
+        stats = self.sender.lane_stats()['normal']
+        self.assertEqual(stats['sent'], 1)
+        self.assertEqual(stats['depth'], 0)
+        self.assertEqual(self.sender.buffered, 0)
+        self.assertTrue(stats['latency_max_ms'] > 0)
+
+
+if __name__ == '__main__':
+    unittest.main()
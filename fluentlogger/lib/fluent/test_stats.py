@@ -0,0 +1,44 @@
+# -*- coding: utf-8 -*-
+
+import threading
+import unittest
+
+from .stats import Stats
+
+
+class TestStats(unittest.TestCase):
+
+    def test_merge(self):
+        stats = Stats(bounds_ms=(10, 100))
+        stats.incr('events')
+        stats.observe('latency', 0.005)
+        thread = threading.Thread(target=lambda: (stats.incr('events', 2),
+                                                  stats.observe('latency',
+                                                                0.5)))
+        thread.start()
+        thread.join()
+        snapshot = stats.snapshot()
+        self.assertEqual(snapshot['counters'], {'events': 3})
+        self.assertEqual(snapshot['histograms']['latency']['count'], 2)
+        self.assertEqual(snapshot['histograms']['latency']['buckets'],
+                         [1, 0, 1])
+
+    def test_short_lived_threads(self):
+        stats = Stats()
+        for _ in range(20):
+            threads = [threading.Thread(target=stats.incr, args=('events',))
+                       for _ in range(50)]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+        # a new shard collects the ones of the threads that exited
+        self.assertTrue(len(stats._shards) <= 50, len(stats._shards))
+        self.assertEqual(stats.snapshot()['counters']['events'], 1000)
+        self.assertEqual(len(stats._shards), 0)
+        stats.incr('events')
+        self.assertEqual(stats.snapshot()['counters']['events'], 1001)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,180 @@
+# -*- coding: utf-8 -*-
+"""Writer process of `ProcessSender`.
+
+    python -m fluent.writer RING HOST PORT [--gzip] [--timeout SEC]
+
+Reads marshalled records from the shared ring, packs them with msgpack,
+groups consecutive records of a tag into PackedForward messages
+(optionally gzip compressed) and writes them to fluentd. Records are
+released from the ring only once written, so a restarted writer sends
+again whatever its predecessor had not finished.
+
+Once the service is gone the writer empties the ring and removes it. If
+fluentd stays unreachable for `orphan_timeout` seconds after that, the
+remaining records are given up and the ring removed all the same: no
+later service reads a ring it did not create.
+"""
+
+from __future__ import print_function
+
+import argparse
+import marshal
+import os
+import socket
+import sys
+import time
+import zlib
+
+import msgpack_pure as msgpack
+
+from fluent.ring import Ring
+
+KIND_EVENT = 0
+KIND_RAW = 1
+
+
+def pack_records(records, compress=False):
+    """Return the Forward protocol messages for marshalled records.
+
+    Records that cannot be unmarshalled or packed are skipped; returns
+    (messages, number of records skipped).
+    """
+    messages = []
+    tag = None
+    entries = []
+    skipped = 0
+
+    def flush():
+        if not entries:
+            return
+        packed = b''.join(entries)
+        if compress:
+            compressor = zlib.compressobj(6, zlib.DEFLATED,
+                                          16 + zlib.MAX_WBITS)
+            packed = compressor.compress(packed) + compressor.flush()
+            messages.append(b'\x93' + msgpack.packb(tag) +
+                            msgpack.packb(packed) +
+                            msgpack.packb({'compressed': 'gzip'}))
+        else:
+            messages.append(b'\x92' + msgpack.packb(tag) +
+                            msgpack.packb(packed))
+        del entries[:]
+
+    for payload in records:
+        try:
+            kind, recordTag, timestamp, data = marshal.loads(payload)
+            if kind == KIND_RAW:
+                entry = data
+            else:
+                entry = msgpack.packb((timestamp, data))
+        except Exception:
+            # a bad record must not stop the ones behind it
+            skipped += 1
+            continue
+        if recordTag != tag:
+            flush()
+            tag = recordTag
+        entries.append(entry)
+    flush()
+    return b''.join(messages), skipped
+
+
+class RingWriter(object):
+    def __init__(self, ring, host, port, timeout=3.0, compress=False,
+                 batch_bytes=256 * 1024, poll_interval=0.002,
+                 backoff_max=30.0, orphan_timeout=60.0):
+        self.ring = ring
+        self.host = host
+        self.port = port
+        self.timeout = timeout
+        self.compress = compress
+        self.batch_bytes = batch_bytes
+        self.poll_interval = poll_interval
+        self.backoff_max = backoff_max
+        self.orphan_timeout = orphan_timeout
+        self.socket = None
+        self.parent = os.getppid()
+        self.orphaned_at = None
+
+    def run(self):
+        backoff = 0.1
+        while True:
+            try:
+                written = self.step()
+                backoff = 0.1
+            except (socket.error, socket.timeout):
+                self._close()
+                if self._orphaned():
+                    if self.orphaned_at is None:
+                        self.orphaned_at = time.time()
+                    elif time.time() - self.orphaned_at >= \
+                            self.orphan_timeout:
+                        # nobody is left to send what is still queued
+                        self._remove_ring()
+                        return
+                time.sleep(backoff)
+                backoff = min(backoff * 2, self.backoff_max)
+                continue
+            if not written:
+                if self._orphaned():
+                    # the service is gone and everything was written
+                    self._remove_ring()
+                    return
+                time.sleep(self.poll_interval)
+
+    def _orphaned(self):
+        return os.getppid() != self.parent
+
+    def _remove_ring(self):
+        self.ring.close()
+        os.unlink(self.ring.path)
+
+    def step(self):
+        """Write one batch, return False when the ring was empty."""
+        records, tail = self.ring.read(self.batch_bytes)
+        if not records:
+            return False
+        data, skipped = pack_records(records, self.compress)
+        if data:
+            self._connect()
+            self.socket.sendall(data)
+        if skipped:
+            self.ring.add_dropped(skipped)
+        self.ring.commit(tail, len(records))
+        return True
+
+    def _connect(self):
+        if self.socket is not None:
+            return
+        if self.host.startswith('unix://'):
+            sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            sock.settimeout(self.timeout)
+            sock.connect(self.host[len('unix://'):])
+        else:
+            sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+            sock.settimeout(self.timeout)
+            sock.connect((self.host, self.port))
+        self.socket = sock
+        self.ring.bump_generation()
+
+    def _close(self):
+        if self.socket is not None:
+            self.socket.close()
+        self.socket = None
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='fluentd writer process')
+    parser.add_argument('ring')
+    parser.add_argument('host')
+    parser.add_argument('port', type=int)
+    parser.add_argument('--timeout', type=float, default=3.0)
+    parser.add_argument('--gzip', action='store_true')
+    parser.add_argument('--orphan-timeout', type=float, default=60.0)
+    args = parser.parse_args(argv)
+    RingWriter(Ring(args.ring), args.host, args.port, timeout=args.timeout,
+               compress=args.gzip, orphan_timeout=args.orphan_timeout).run()
+
+
+if __name__ == '__main__':
+    sys.exit(main())
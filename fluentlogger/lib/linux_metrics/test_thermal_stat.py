@@ -0,0 +1,93 @@
+#!/usr/bin/env python
+
+
+import os
+import shutil
+import tempfile
+import unittest
+
+from . import thermal_stat
+
+
+PSI_CPU = ('some avg10=1.50 avg60=0.75 avg300=0.20 total=123456\n'
+           'full avg10=0.00 avg60=0.00 avg300=0.00 total=0\n')
+
+
+class TestThermalStats(unittest.TestCase):
+
+    def setUp(self):
+        self.root = tempfile.mkdtemp()
+        self.sys_root = os.path.join(self.root, 'sys')
+        self.proc_root = os.path.join(self.root, 'proc')
+        for zone, zone_type, temp in ((0, 'cpu-thermal', '45000'),
+                                      (10, 'gpu-thermal', '71500')):
+            self._write('sys/class/thermal/thermal_zone%d/temp' % zone, temp)
+            self._write('sys/class/thermal/thermal_zone%d/type' % zone,
+                        zone_type)
+        for cpu, freq in ((0, '1600000'), (1, '800000')):
+            self._write('sys/devices/system/cpu/cpu%d/cpufreq/'
+                        'scaling_cur_freq' % cpu, freq)
+        # no cpufreq for this one
+        os.makedirs(os.path.join(self.sys_root, 'devices/system/cpu/cpu2'))
+        self.stat = None
+
+    def tearDown(self):
+        if self.stat is not None:
+            self.stat.close()
+        shutil.rmtree(self.root)
+
+    def _write(self, path, content):
+        path = os.path.join(self.root, path)
+        if not os.path.isdir(os.path.dirname(path)):
+            os.makedirs(os.path.dirname(path))
+        with open(path, 'w') as f:
+            f.write(content + '\n')
+
+    def _open(self):
+        self.stat = thermal_stat.ThermalStat(self.sys_root, self.proc_root)
+        return self.stat
+
+    def test_thermal_zones(self):
+        stat = self._open()
+        self.assertEqual(stat.thermal_zones(),
+                         [('zone0', 'cpu-thermal', 45.0),
+                          ('zone10', 'gpu-thermal', 71.5)])
+        # the open descriptor sees new values
+        self._write('sys/class/thermal/thermal_zone0/temp', '52000')
+        self.assertEqual(stat.thermal_zones()[0][2], 52.0)
+
+    def test_cpu_freqs(self):
+        stat = self._open()
+        self.assertEqual(stat.cpu_freqs(), [('cpu0', 1600000),
+                                            ('cpu1', 800000)])
+
+    def test_pressure(self):
+        self._write('proc/pressure/cpu', PSI_CPU.strip())
+        stats = self._open().thermal_stats()
+        self.assertEqual(stats['cpu_some_avg10'], 1.5)
+        self.assertEqual(stats['cpu_some_total'], 123456)
+        self.assertEqual(stats['cpu_full_avg300'], 0.0)
+        self.assertFalse('memory_some_avg10' in stats)
+
+    def test_without_psi(self):
+        stats = self._open().thermal_stats()
+        self.assertEqual(stats['temperature_max'], 71.5)
+        self.assertEqual(stats['freq_min_khz'], 800000)
+        self.assertEqual(stats['freq_max_khz'], 1600000)
+        self.assertEqual(len(stats['zones']), 2)
+        self.assertEqual(len(stats['cpus']), 2)
+        self.assertFalse([key for key in stats if key.startswith('cpu_')])
+
+    def test_empty(self):
+        stat = thermal_stat.ThermalStat(os.path.join(self.root, 'none'),
+                                        os.path.join(self.root, 'none'))
+        self.assertEqual(stat.thermal_stats(), {'zones': [], 'cpus': []})
+
+    def test_system(self):
+        stats = thermal_stat.ThermalStat().thermal_stats()
+        self.assertTrue(isinstance(stats['zones'], list))
+
+
+if __name__ == '__main__':
+    test_suite = unittest.TestLoader().loadTestsFromTestCase(TestThermalStats)
+    unittest.TextTestRunner(verbosity=2).run(test_suite)
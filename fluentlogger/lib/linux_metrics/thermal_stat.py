@@ -0,0 +1,186 @@
+#!/usr/bin/env python
+
+
+"""
+    thermal_stat - Python Module for CPU Thermal Stats on Linux
+
+    Thermal zone temperatures, current CPU frequencies and pressure stall
+    information (PSI), to tell thermal throttling and resource contention
+    apart from plain load.
+
+    requires:
+    - Python 2.6+
+    - Linux 2.6+, PSI needs Linux 4.20+
+
+"""
+
+
+import glob
+import os
+
+
+PRESSURE_RESOURCES = ('cpu', 'memory', 'io')
+PRESSURE_FIELDS = ('avg10', 'avg60', 'avg300', 'total')
+
+
+
+class ThermalStat(object):
+    """Reads thermal zones, CPU frequencies and pressure stall files.
+
+    The files are discovered when the object is created and stay open:
+    each read only seeks back to the start of the file. Files that are
+    missing or unreadable, such as ``/proc/pressure`` on kernels without
+    PSI, are left out of the results.
+
+    `sys_root` and `proc_root` are the mount points of sysfs and procfs.
+    """
+
+    def __init__(self, sys_root='/sys', proc_root='/proc'):
+        # (zone, type, fd)
+        self.zones = []
+        for path in sorted(glob.glob(os.path.join(
+                sys_root, 'class', 'thermal', 'thermal_zone*')),
+                key=_number):
+            fd = _open(os.path.join(path, 'temp'))
+            if fd is None:
+                continue
+            zone_type = _read_file(os.path.join(path, 'type'))
+            self.zones.append((os.path.basename(path)[len('thermal_'):],
+                               zone_type or '', fd))
+        # (cpu, fd)
+        self.freqs = []
+        for path in sorted(glob.glob(os.path.join(
+                sys_root, 'devices', 'system', 'cpu', 'cpu[0-9]*')),
+                key=_number):
+            fd = _open(os.path.join(path, 'cpufreq', 'scaling_cur_freq'))
+            if fd is not None:
+                self.freqs.append((os.path.basename(path), fd))
+        # (resource, fd)
+        self.pressures = []
+        for resource in PRESSURE_RESOURCES:
+            fd = _open(os.path.join(proc_root, 'pressure', resource))
+            if fd is not None:
+                self.pressures.append((resource, fd))
+
+    def thermal_zones(self):
+        """Return a list of (zone, type, degrees Celsius)."""
+        temperatures = []
+        for zone, zone_type, fd in self.zones:
+            value = _read_int(fd)
+            if value is not None:
+                temperatures.append((zone, zone_type, value / 1000.0))
+        return temperatures
+
+    def cpu_freqs(self):
+        """Return a list of (cpu, current frequency in kHz)."""
+        freqs = []
+        for cpu, fd in self.freqs:
+            value = _read_int(fd)
+            if value is not None:
+                freqs.append((cpu, value))
+        return freqs
+
+    def pressure(self):
+        """Return a dict of pressure stall values.
+
+        Keys are ``<resource>_<some|full>_<field>``: the avg10, avg60 and
+        avg300 percentages and the total stall time in microseconds.
+        Empty on kernels without PSI.
+        """
+        values = {}
+        for resource, fd in self.pressures:
+            data = _read(fd)
+            if data is None:
+                continue
+            for line in data.splitlines():
+                fields = line.split()
+                if not fields:
+                    continue
+                for field in fields[1:]:
+                    name, _, value = field.partition('=')
+                    if name not in PRESSURE_FIELDS:
+                        continue
+                    key = '%s_%s_%s' % (resource, fields[0], name)
+                    if name == 'total':
+                        values[key] = int(value)
+                    else:
+                        values[key] = float(value)
+        return values
+
+    def thermal_stats(self):
+        """Return all the values as one flat record.
+
+        `temperature_max` and `freq_min_khz` summarize the zones and the
+        CPUs; they are missing when no zone or no CPU could be read.
+        """
+        zones = self.thermal_zones()
+        freqs = self.cpu_freqs()
+        stats = self.pressure()
+        stats['zones'] = [{'zone': zone, 'type': zone_type,
+                           'temperature': temperature}
+                          for zone, zone_type, temperature in zones]
+        stats['cpus'] = [{'cpu': cpu, 'freq_khz': freq}
+                         for cpu, freq in freqs]
+        if zones:
+            stats['temperature_max'] = max([zone[2] for zone in zones])
+        if freqs:
+            stats['freq_min_khz'] = min([freq for _, freq in freqs])
+            stats['freq_max_khz'] = max([freq for _, freq in freqs])
+        return stats
+
+    def close(self):
+        for fd in [zone[2] for zone in self.zones] + \
+                [fd for _, fd in self.freqs + self.pressures]:
+            os.close(fd)
+        self.zones = []
+        self.freqs = []
+        self.pressures = []
+
+
+
+def _number(path):
+    """Sort key putting thermal_zone10 after thermal_zone9."""
+    digits = ''.join([c for c in os.path.basename(path) if c.isdigit()])
+    return int(digits or 0)
+
+
+
+def _open(path):
+    """Open `path` if it can be read, return its descriptor or None."""
+    try:
+        fd = os.open(path, os.O_RDONLY)
+    except OSError:
+        return None
+    if _read(fd) is None:
+        # e.g. PSI compiled in but disabled with psi=0
+        os.close(fd)
+        return None
+    return fd
+
+
+
+def _read(fd):
+    try:
+        os.lseek(fd, 0, os.SEEK_SET)
+        return os.read(fd, 4096).decode('ascii')
+    except (OSError, UnicodeDecodeError):
+        # some sensors fail transiently, e.g. with EAGAIN
+        return None
+
+
+
+def _read_int(fd):
+    data = _read(fd)
+    try:
+        return int(data)
+    except (TypeError, ValueError):
+        return None
+
+
+
+def _read_file(path):
+    try:
+        with open(path) as f:
+            return f.read().strip()
+    except IOError:
+        return None
@@ -32,6 +32,17 @@ _FIX_MAP = 0x80
 _MAP16   = 0xde
 _MAP32   = 0xdf
 
+# Types of the newer msgpack spec, only understood by the unpacker
+_STR8    = 0xd9
+_BIN8    = 0xc4
+_BIN16   = 0xc5
+_BIN32   = 0xc6
+_EXT8    = 0xc7
+_EXT16   = 0xc8
+_EXT32   = 0xc9
+_FIXEXT1 = 0xd4
+_FIXEXT16 = 0xd8
+
 
 # Constants
 _INT8_MAX   = 0x7F
@@ -267,6 +278,18 @@ class Unpacker():
             nbytes = struct.unpack(">I", mp.read(4))[0]
             obj = struct.unpack("%ds" % nbytes, mp.read(nbytes))[0]
 
+        elif b == _STR8 or b == _BIN8:
+            nbytes = struct.unpack("B", mp.read_byte())[0]
+            obj = mp.read(nbytes)
+
+        elif b == _BIN16:
+            nbytes = struct.unpack(">H", mp.read(2))[0]
+            obj = mp.read(nbytes)
+
+        elif b == _BIN32:
+            nbytes = struct.unpack(">I", mp.read(4))[0]
+            obj = mp.read(nbytes)
+
         elif (b & 0xF0) == _FIX_ARY:
             sz = b & 0x0F
             obj = self.read_list_body(mp, sz)
@@ -321,6 +344,90 @@ class Unpacker():
 
         return self.apply_hook(obj)
     
+class OutOfData(Exception):
+    """The object is not complete yet.
+
+    `pos` and `remaining` resume `skip` once more data arrived.
+    """
+    def __init__(self, pos=None, remaining=None):
+        Exception.__init__(self)
+        self.pos = pos
+        self.remaining = remaining
+
+
+_SKIP_FIXED = {_NIL: 1, _TRUE: 1, _FALSE: 1,
+               _UINT8: 2, _INT8: 2, _UINT16: 3, _INT16: 3,
+               _UINT32: 5, _INT32: 5, _FLOAT: 5,
+               _UINT64: 9, _INT64: 9, _DOUBLE: 9,
+               0xd4: 3, 0xd5: 4, 0xd6: 6, 0xd7: 10, 0xd8: 18}
+# header -> (length format, header size, extra bytes)
+_SKIP_SIZED = {_STR8: ("B", 2, 0), _BIN8: ("B", 2, 0),
+               _RAW16: (">H", 3, 0), _BIN16: (">H", 3, 0),
+               _RAW32: (">I", 5, 0), _BIN32: (">I", 5, 0),
+               _EXT8: ("B", 2, 1), _EXT16: (">H", 3, 1),
+               _EXT32: (">I", 5, 1)}
+# header -> (count format, header size, objects per entry)
+_SKIP_CONTAINER = {_ARY16: (">H", 3, 1), _ARY32: (">I", 5, 1),
+                   _MAP16: (">H", 3, 2), _MAP32: (">I", 5, 2)}
+
+
+def skip(packed, pos=0, remaining=1):
+    """Return the offset just past the object starting at `pos`.
+
+    Nothing is decoded, so this is a cheap way to find object boundaries
+    in a stream. Raise OutOfData if the object is not complete yet; once
+    more data is appended to `packed`, ``skip(packed, e.pos, e.remaining)``
+    goes on from where it stopped instead of scanning the object again.
+    """
+    end = len(packed)
+    while remaining:
+        if pos >= end:
+            raise OutOfData(pos, remaining)
+        b = ord(packed[pos])
+        remaining -= 1
+        if b <= 0x7f or b >= 0xe0:
+            pos += 1
+        elif (b & 0xe0) == _FIX_RAW:
+            pos += 1 + (b & 0x1f)
+        elif (b & 0xf0) == _FIX_ARY:
+            pos += 1
+            remaining += b & 0x0f
+        elif (b & 0xf0) == _FIX_MAP:
+            pos += 1
+            remaining += 2 * (b & 0x0f)
+        elif b in _SKIP_FIXED:
+            pos += _SKIP_FIXED[b]
+        elif b in _SKIP_SIZED:
+            fmt, size, extra = _SKIP_SIZED[b]
+            if pos + size > end:
+                raise OutOfData(pos, remaining + 1)
+            nbytes = struct.unpack(fmt, packed[pos + 1:pos + size])[0]
+            pos += size + extra + nbytes
+        elif b in _SKIP_CONTAINER:
+            fmt, size, per_entry = _SKIP_CONTAINER[b]
+            if pos + size > end:
+                raise OutOfData(pos, remaining + 1)
+            count = struct.unpack(fmt, packed[pos + 1:pos + size])[0]
+            pos += size
+            remaining += per_entry * count
+        else:
+            raise RuntimeError("Unknown object header: 0x%x" % b)
+    if pos > end:
+        raise OutOfData(pos, 0)
+    return pos
+
+
+def container_header(packed, pos=0):
+    """Return (length, offset of the first item) of an array or a map."""
+    b = ord(packed[pos])
+    if (b & 0xf0) in (_FIX_ARY, _FIX_MAP):
+        return b & 0x0f, pos + 1
+    if b in _SKIP_CONTAINER:
+        fmt, size, _ = _SKIP_CONTAINER[b]
+        return struct.unpack(fmt, packed[pos + 1:pos + size])[0], pos + size
+    raise ValueError("Not a container: 0x%x" % b)
+
+
 def unpacks(packed, **kwargs):
     return Unpacker(**kwargs).unpacks(packed)
 
@@ -0,0 +1,183 @@
+# -*- coding: utf-8 -*-
+"""Compact encoding of qi log messages.
+
+A qi ``LogMessage`` is normalized into a fixed schema with short keys and a
+numeric level. Category, source and location strings are interned: within
+an *epoch*, the first record using a string carries its definition in
+``n`` and later records only carry its integer id. A new epoch starts
+whenever the sender reconnects or the table grows too large, and the whole
+table of the current epoch is periodically shipped as a resync record so
+that receivers can recover after losing a record.
+
+The receiving side decodes the records with `CompactLogDecoder`; running
+this module as a script decodes newline-delimited JSON records read from
+the standard input.
+"""
+
+import json
+import sys
+import threading
+import time
+
+# record field -> compact key, for interned fields
+INTERNED = (('category', 'c'), ('source', 's'), ('location', 'o'))
+# record field -> compact key, for plain fields
+PLAIN = (('level', 'l'), ('message', 'm'))
+# qi time fields, in order of preference
+DATES = ('date', 'systemDate', 'timestamp')
+
+
+def _seconds(value):
+    """Return a qi timestamp as seconds since the epoch."""
+    if isinstance(value, dict):
+        return value.get('tv_sec', 0) + value.get('tv_usec', 0) / 1e6
+    if isinstance(value, (int, float)) and value > 1e12:
+        # qi dates are in nanoseconds
+        return value / 1e9
+    return value
+
+
+class CompactLogEncoder(object):
+    def __init__(self, resync_interval=300, max_strings=4096):
+        self.resync_interval = resync_interval
+        self.max_strings = max_strings
+        self.lock = threading.Lock()
+        self.epoch = int(time.time())
+        self.generation = None
+        self._new_epoch(None)
+
+    def _new_epoch(self, generation):
+        self.epoch += 1
+        self.generation = generation
+        self.strings = {}
+        self.string_bytes = 0
+        self.resynced = time.time()
+
+    def memory_usage(self):
+        """Bytes of the strings in the dictionary of the epoch."""
+        return self.string_bytes
+
+    def encode(self, msg, generation=None):
+        """Return the compact record for `msg`.
+
+        :param generation: identifies the current connection; a change
+          starts a new epoch.
+        """
+        with self.lock:
+            if generation != self.generation or \
+                    len(self.strings) >= self.max_strings:
+                self._new_epoch(generation)
+            record = {'e': self.epoch}
+            definitions = []
+            known = ('e', 'n', 'd')
+            for field, key in INTERNED:
+                value = msg.get(field)
+                if value is None:
+                    continue
+                index = self.strings.get(value)
+                if index is None:
+                    index = self.strings[value] = len(self.strings)
+                    self.string_bytes += len(value)
+                    definitions += [index, value]
+                record[key] = index
+                known += (field,)
+            for field, key in PLAIN:
+                if field in msg:
+                    record[key] = msg[field]
+                    known += (field,)
+            for field in DATES:
+                if field in msg:
+                    record['d'] = _seconds(msg[field])
+                    break
+            known += DATES
+            if definitions:
+                record['n'] = definitions
+            for field, value in msg.items():
+                if field not in known:
+                    record[field] = value
+            return record
+
+    def resync_record(self, now):
+        """Return the table of the current epoch if a resync is due."""
+        with self.lock:
+            if now - self.resynced < self.resync_interval:
+                return None
+            self.resynced = now
+            definitions = []
+            for value, index in sorted(self.strings.items(),
+                                       key=lambda item: item[1]):
+                definitions += [index, value]
+            return {'e': self.epoch, 'n': definitions}
+
+
+class CompactLogDecoder(object):
+    """Rebuilds full log records from compact records and resync records.
+
+    Tables are kept per (``robot`` field, epoch) for the last `max_epochs`
+    epochs.
+    """
+    def __init__(self, max_epochs=16):
+        self.max_epochs = max_epochs
+        self.tables = {}
+        self.order = []
+
+    def _table(self, record):
+        key = (record.get('robot'), record['e'])
+        table = self.tables.get(key)
+        if table is None:
+            table = self.tables[key] = {}
+            self.order.append(key)
+            if len(self.order) > self.max_epochs:
+                del self.tables[self.order.pop(0)]
+        return table
+
+    def feed(self, record):
+        """Decode a compact or resync record.
+
+        Return the full log record, or None for a resync record. Raise
+        KeyError when a string id has not been defined yet.
+        """
+        table = self._table(record)
+        definitions = record.get('n', ())
+        for i in range(0, len(definitions) - 1, 2):
+            table[int(definitions[i])] = definitions[i + 1]
+        if 'l' not in record and 'm' not in record:
+            return None
+
+        result = {}
+        for field, key in INTERNED:
+            if key in record:
+                result[field] = table[int(record[key])]
+        for field, key in PLAIN:
+            if key in record:
+                result[field] = record[key]
+        if 'd' in record:
+            result['date'] = record['d']
+        compact = set(['e', 'n', 'd'] + [k for _, k in INTERNED + PLAIN])
+        for key, value in record.items():
+            if key not in compact:
+                result[key] = value
+        return result
+
+
+def main():
+    decoder = CompactLogDecoder()
+    for line in sys.stdin:
+        line = line.strip()
+        if not line:
+            continue
+        record = json.loads(line)
+        if 'e' not in record:
+            sys.stdout.write(line + '\n')
+            continue
+        try:
+            decoded = decoder.feed(record)
+        except KeyError:
+            sys.stderr.write('undecodable record: %s\n' % line)
+            continue
+        if decoded is not None:
+            sys.stdout.write(json.dumps(decoded) + '\n')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,176 @@
+# -*- coding: utf-8 -*-
+
+from collections import OrderedDict, deque
+import threading
+import time
+
+from fluent.budget import SHED_DROP
+from pepperlog.ratelimit import TokenBucket
+
+
+class _Client(object):
+    def __init__(self, rate, burst, now):
+        self.bucket = TokenBucket(rate, burst, now)
+        self.queue = deque()
+        # entries admitted and not queued yet
+        self.pending = 0
+        self.accepted = 0
+        self.rejected = 0
+        self.dropped = 0
+        self.sent = 0
+
+    def stats(self):
+        return {'queued': len(self.queue), 'accepted': self.accepted,
+                'rejected': self.rejected, 'dropped': self.dropped,
+                'sent': self.sent}
+
+
+class IngestQueue(object):
+    """Queues events pushed by other applications for one shared sender.
+
+    Each client gets a token bucket of `rate` events per second (bursts of
+    `burst`) and its own queue of at most `queue_max` events, so that a
+    noisy client cannot starve the others. A worker thread drains the
+    queues in round-robin and sends up to `batch_size` entries at a time
+    through ``send_batch(entries)``.
+
+    At most `max_clients` clients are known at once. A new client takes
+    the place of the least recently pushing one whose queue is empty, and
+    is rejected when every queue holds entries.
+
+    :param sizeof: ``sizeof(entry)`` returning the bytes accounted for an
+      entry, its packed size for the service. Defaults to the length of
+      its repr. It is only called for the entries admitted by the token
+      bucket, outside of the lock.
+    """
+    def __init__(self, send_batch, rate=100, burst=1000, queue_max=1000,
+                 batch_size=200, max_clients=64, sizeof=None):
+        self.send_batch = send_batch
+        self.rate = rate
+        self.burst = burst
+        self.queue_max = queue_max
+        self.batch_size = batch_size
+        self.max_clients = max_clients
+        self.sizeof = sizeof or (lambda entry: len(repr(entry)))
+
+        # least recently pushing first
+        self.clients = OrderedDict()
+        self.evicted = 0
+        self.bytes = 0
+        self.condition = threading.Condition(threading.Lock())
+        self.running = False
+        self.thread = None
+
+    def start(self):
+        self.running = True
+        self.thread = threading.Thread(target=self._run, name='IngestQueue')
+        self.thread.daemon = True
+        self.thread.start()
+
+    def stop(self):
+        with self.condition:
+            self.running = False
+            self.condition.notify()
+
+    def push(self, client_name, entries):
+        """Queue (label, timestamp, data) entries; return how many fit."""
+        now = time.time()
+        with self.condition:
+            client = self.clients.pop(client_name, None)
+            if client is None:
+                if len(self.clients) >= self.max_clients and \
+                        not self._evict():
+                    return 0
+                client = _Client(self.rate, self.burst, now)
+            self.clients[client_name] = client
+            accepted = 0
+            while accepted < len(entries) and client.bucket.take(now):
+                accepted += 1
+            client.rejected += len(entries) - accepted
+            client.pending += accepted
+        if not accepted:
+            return 0
+        try:
+            sizes = [self.sizeof(entry) for entry in entries[:accepted]]
+        except Exception:
+            with self.condition:
+                client.pending -= accepted
+            raise
+        with self.condition:
+            client.pending -= accepted
+            for entry, size in zip(entries, sizes):
+                if len(client.queue) >= self.queue_max:
+                    self._drop(client)
+                client.queue.append((entry, size))
+                self.bytes += size
+            client.accepted += accepted
+            self.condition.notify()
+        return accepted
+
+    def stats(self):
+        with self.condition:
+            return dict([(name, client.stats())
+                         for name, client in self.clients.items()])
+
+    def memory_usage(self):
+        return self.bytes
+
+    def shed_memory(self, level, needed):
+        """Drop the oldest entries of the longest queues."""
+        if level != SHED_DROP:
+            return 0
+        freed = 0
+        with self.condition:
+            while freed < needed:
+                waiting = [client for client in self.clients.values()
+                           if client.queue]
+                if not waiting:
+                    break
+                freed += self._drop(max(waiting,
+                                        key=lambda client: len(client.queue)))
+        return freed
+
+    def _evict(self):
+        for name, client in self.clients.items():
+            if not (client.queue or client.pending):
+                del self.clients[name]
+                self.evicted += 1
+                return True
+        return False
+
+    def _drop(self, client):
+        _, size = client.queue.popleft()
+        self.bytes -= size
+        client.dropped += 1
+        return size
+
+    def _take(self):
+        batch = []
+        while len(batch) < self.batch_size:
+            waiting = [client for client in self.clients.values()
+                       if client.queue]
+            if not waiting:
+                break
+            share = max(1, (self.batch_size - len(batch)) // len(waiting))
+            for client in waiting:
+                count = min(share, len(client.queue))
+                for _ in range(count):
+                    entry, size = client.queue.popleft()
+                    batch.append(entry)
+                    self.bytes -= size
+                client.sent += count
+        return batch
+
+    def _run(self):
+        while True:
+            with self.condition:
+                batch = self._take()
+                while not batch and self.running:
+                    self.condition.wait()
+                    batch = self._take()
+                if not batch:
+                    return
+            try:
+                self.send_batch(batch)
+            except Exception:
+                pass
@@ -0,0 +1,69 @@
+# -*- coding: utf-8 -*-
+
+
+class CategoryFilter(object):
+    """Per-category qi log level rules.
+
+    Rules map a category pattern to the most verbose level to forward for
+    it, e.g. ``{'ALDialog.*': 3, 'myapp.*': 6}``. A pattern ending with
+    ``*`` matches by prefix, others match exactly; the longest matching
+    pattern wins and `default_level` applies when none matches. Decisions
+    are cached per category, so the steady-state cost of `allows` is one
+    dict lookup.
+    """
+    def __init__(self, rules, default_level, cache_size=4096):
+        self.rules = dict(rules)
+        self.default_level = default_level
+        self.cache_size = cache_size
+        self.exact = {}
+        self.prefixes = {}
+        for pattern, level in self.rules.items():
+            if pattern.endswith('*'):
+                self.prefixes[pattern[:-1]] = level
+            else:
+                self.exact[pattern] = level
+        self.prefix_lengths = sorted(set([len(p) for p in self.prefixes]),
+                                     reverse=True)
+        self.cache = {}
+
+    def max_level(self):
+        """Return the most verbose level any category may be forwarded at."""
+        return max([self.default_level] + list(self.rules.values()))
+
+    def level_for(self, category):
+        level = self.cache.get(category)
+        if level is None:
+            level = self._match(category)
+            if len(self.cache) >= self.cache_size:
+                self.cache.clear()
+            self.cache[category] = level
+        return level
+
+    def allows(self, category, level):
+        return level <= self.level_for(category)
+
+    def _match(self, category):
+        level = self.exact.get(category)
+        if level is not None:
+            return level
+        for length in self.prefix_lengths:
+            level = self.prefixes.get(category[:length])
+            if level is not None:
+                return level
+        return self.default_level
+
+
+def parse_rules(spec, levels):
+    """Parse ``pattern=Level`` items separated by commas.
+
+    :param levels: mapping from qi log level names to numbers.
+    """
+    rules = {}
+    for item in [item.strip() for item in spec.split(',') if item.strip()]:
+        pattern, _, level = item.partition('=')
+        pattern = pattern.strip()
+        level = level.strip()
+        if not pattern or level not in levels:
+            raise ValueError('invalid log rule: %r' % item)
+        rules[pattern] = levels[level]
+    return rules
@@ -0,0 +1,74 @@
+# -*- coding: utf-8 -*-
+
+import threading
+
+from pepperlog.ratelimit import message_template
+
+
+class SpaceSaving(object):
+    """Space-Saving heavy hitters sketch keeping at most `capacity` keys.
+
+    Counts of the reported keys are overestimated by at most their
+    ``error``.
+    """
+    def __init__(self, capacity):
+        self.capacity = capacity
+        self.counters = {}
+
+    def add(self, key):
+        counter = self.counters.get(key)
+        if counter is not None:
+            counter[0] += 1
+        elif len(self.counters) < self.capacity:
+            self.counters[key] = [1, 0]
+        else:
+            victim = min(self.counters, key=lambda k: self.counters[k][0])
+            count = self.counters.pop(victim)[0]
+            self.counters[key] = [count + 1, count]
+
+    def top(self, k):
+        items = sorted(self.counters.items(), key=lambda item: -item[1][0])
+        return [(key, count, error) for key, (count, error) in items[:k]]
+
+
+class LogStats(object):
+    """Counts qi log messages per (category, level) between snapshots.
+
+    The most frequent message templates are tracked with a bounded
+    `SpaceSaving` sketch.
+    """
+    def __init__(self, top_k=10, sketch_size=100):
+        self.top_k = top_k
+        self.sketch_size = sketch_size
+        self.lock = threading.Lock()
+        self._reset()
+
+    def _reset(self):
+        self.counts = {}
+        self.templates = SpaceSaving(self.sketch_size)
+        self.total = 0
+
+    def add(self, msg):
+        category = msg.get('category', '')
+        key = (category, msg.get('level'))
+        with self.lock:
+            self.counts[key] = self.counts.get(key, 0) + 1
+            self.total += 1
+            if self.top_k:
+                self.templates.add(
+                    (category, message_template(msg.get('message', ''))))
+
+    def snapshot(self):
+        """Return the statistics since the last snapshot and reset them."""
+        with self.lock:
+            counts, templates, total = self.counts, self.templates, self.total
+            self._reset()
+        return {
+            'total': total,
+            'counts': [{'category': category, 'level': level, 'count': count}
+                       for (category, level), count in sorted(counts.items())],
+            'top_messages': [{'category': category, 'template': template,
+                              'count': count, 'error': error}
+                             for (category, template), count, error
+                             in templates.top(self.top_k)],
+        }
@@ -0,0 +1,106 @@
+# -*- coding: utf-8 -*-
+
+import threading
+import time
+
+
+class MemoryEventCollector(object):
+    """Forwards ALMemory events through subscriptions instead of polling.
+
+    Every key is subscribed with ``ALMemory.subscriber(key)``. Values raised
+    less than `min_interval` seconds after the previous forwarded value are
+    coalesced: only the latest one is forwarded when the interval elapses,
+    together with the number of events it stands for.
+
+    :param memory: the ALMemory service proxy.
+    :param keys: ALMemory event keys to subscribe to.
+    :param callback: called as ``callback(key, value, timestamp, count)``.
+    :param min_interval: minimum seconds between two forwards of a key.
+    """
+    def __init__(self, memory, keys, callback, min_interval=1.0):
+        self.memory = memory
+        self.keys = list(keys)
+        self.callback = callback
+        self.min_interval = min_interval
+
+        self.lock = threading.Lock()
+        self.subscribers = {}
+        self.last_values = {}
+        self._states = {}
+
+    def start(self):
+        for key in self.keys:
+            if key in self.subscribers:
+                continue
+            try:
+                self.last_values[key] = self.memory.getData(key)
+            except Exception:
+                # the key is only declared once the event is raised
+                pass
+            subscriber = self.memory.subscriber(key)
+            link = subscriber.signal.connect(self._handler(key))
+            # the subscriber must be kept alive to keep receiving events
+            self.subscribers[key] = (subscriber, link)
+
+    def stop(self):
+        for subscriber, link in self.subscribers.values():
+            try:
+                subscriber.signal.disconnect(link)
+            except Exception:
+                pass
+        self.subscribers = {}
+        with self.lock:
+            for state in self._states.values():
+                if state.timer is not None:
+                    state.timer.cancel()
+            self._states = {}
+
+    def last_value(self, key, default=None):
+        return self.last_values.get(key, default)
+
+    def _handler(self, key):
+        def on_event(value):
+            self._on_event(key, value, time.time())
+        return on_event
+
+    def _on_event(self, key, value, timestamp):
+        with self.lock:
+            self.last_values[key] = value
+            state = self._states.get(key)
+            if state is None:
+                state = self._states[key] = _KeyState()
+            wait = state.last_sent + self.min_interval - timestamp
+            if wait > 0 or state.timer is not None:
+                state.pending = (value, timestamp)
+                state.coalesced += 1
+                if state.timer is None:
+                    state.timer = threading.Timer(max(wait, 0), self._flush,
+                                                  (key,))
+                    state.timer.daemon = True
+                    state.timer.start()
+                return
+            state.last_sent = timestamp
+        self.callback(key, value, timestamp, 1)
+
+    def _flush(self, key):
+        with self.lock:
+            state = self._states.get(key)
+            if state is None or state.pending is None:
+                return
+            value, timestamp = state.pending
+            count = state.coalesced
+            state.pending = None
+            state.coalesced = 0
+            state.timer = None
+            state.last_sent = time.time()
+        self.callback(key, value, timestamp, count)
+
+
+class _KeyState(object):
+    __slots__ = ('last_sent', 'pending', 'coalesced', 'timer')
+
+    def __init__(self):
+        self.last_sent = 0
+        self.pending = None
+        self.coalesced = 0
+        self.timer = None
@@ -0,0 +1,68 @@
+# -*- coding: utf-8 -*-
+
+NORMAL = 'normal'
+RELAXED = 'relaxed'
+
+
+class AdaptivePolicy(object):
+    """Relaxes metrics collection while the robot is busy or low on battery.
+
+    The policy is `RELAXED` while the load average or CPU usage is above its
+    high threshold, or while the robot is discharging below `battery_low`
+    percent. It only returns to `NORMAL` once every input is back below its
+    low threshold (or the robot is charging) for `hold` consecutive updates,
+    so that values hovering around a threshold do not make it flap.
+    """
+    def __init__(self, load_high=2.0, cpu_high=80.0, battery_low=30,
+                 hysteresis=0.6, battery_margin=10, hold=3):
+        self.load_high = load_high
+        self.load_low = load_high * hysteresis
+        self.cpu_high = cpu_high
+        self.cpu_low = cpu_high * hysteresis
+        self.battery_low = battery_low
+        self.battery_high = battery_low + battery_margin
+        self.hold = hold
+
+        self.state = NORMAL
+        self.calm = 0
+
+    def update(self, load, cpu, charge, charging):
+        """Feed the latest measurements.
+
+        Any of them may be None when unknown. Return a (state, reason) pair
+        when the state changes, None otherwise.
+        """
+        if self.state == NORMAL:
+            reason = self._pressure(load, cpu, charge, charging)
+            if reason is None:
+                return None
+            self.state = RELAXED
+            self.calm = 0
+            return (self.state, reason)
+
+        if not self._is_calm(load, cpu, charge, charging):
+            self.calm = 0
+            return None
+        self.calm += 1
+        if self.calm < self.hold:
+            return None
+        self.state = NORMAL
+        return (self.state, 'idle' if not charging else 'charging')
+
+    def _pressure(self, load, cpu, charge, charging):
+        if load is not None and load > self.load_high:
+            return 'load'
+        if cpu is not None and cpu > self.cpu_high:
+            return 'cpu'
+        if not charging and charge is not None and charge < self.battery_low:
+            return 'battery'
+        return None
+
+    def _is_calm(self, load, cpu, charge, charging):
+        if load is not None and load > self.load_low:
+            return False
+        if cpu is not None and cpu > self.cpu_low:
+            return False
+        if not charging and charge is not None and charge < self.battery_high:
+            return False
+        return True
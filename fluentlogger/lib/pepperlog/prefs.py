@@ -0,0 +1,53 @@
+# -*- coding: utf-8 -*-
+
+import threading
+
+_MISSING = object()
+
+
+class PreferenceStore(object):
+    """In-memory view of one ALPreferenceManager domain.
+
+    The whole domain is loaded with a single ``getValueList`` call and reads
+    are then served from memory. Writes go through `set`, which updates
+    both the manager and the cache. If the domain cannot be listed, values
+    are fetched one by one on first use and cached as well.
+    """
+    def __init__(self, manager, domain):
+        self.manager = manager
+        self.domain = domain
+        self.lock = threading.Lock()
+        self.values = {}
+        self.loaded = False
+
+    def load(self):
+        try:
+            pairs = self.manager.getValueList(self.domain)
+        except Exception:
+            pairs = None
+        with self.lock:
+            self.values = {}
+            if pairs is None:
+                self.loaded = False
+                return
+            for pair in pairs:
+                # each item is [name, value]
+                self.values[pair[-2]] = pair[-1]
+            self.loaded = True
+
+    def get(self, name, default_value=None):
+        value = self.values.get(name, _MISSING)
+        if value is _MISSING:
+            if self.loaded:
+                return default_value
+            value = self.manager.getValue(self.domain, name)
+            with self.lock:
+                self.values[name] = value
+        if value is None:
+            return default_value
+        return value
+
+    def set(self, name, value):
+        self.manager.setValue(self.domain, name, value)
+        with self.lock:
+            self.values[name] = value
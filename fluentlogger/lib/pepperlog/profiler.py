@@ -0,0 +1,216 @@
+# -*- coding: utf-8 -*-
+
+import cProfile
+import os
+import pstats
+import sys
+import threading
+import time
+
+# distinct stacks kept, the others are counted under OTHER
+MAX_STACKS = 2000
+MAX_DEPTH = 64
+OTHER = '[other]'
+
+
+def format_collapsed(stacks):
+    """Return the stacks in the folded format read by flamegraph.pl."""
+    return ''.join(['%s %d\n' % (stack, count)
+                    for stack, count in sorted(stacks.items())])
+
+
+def top_stacks(stacks, limit):
+    """Return the `limit` most sampled stacks as a list of records.
+
+    The samples of the other stacks are counted under OTHER.
+    """
+    ordered = sorted(stacks.items(), key=lambda item: item[1], reverse=True)
+    records = [{'stack': stack, 'count': count}
+               for stack, count in ordered[:limit]]
+    rest = sum([count for _, count in ordered[limit:]])
+    if rest:
+        records.append({'stack': OTHER, 'count': rest})
+    return records
+
+
+class SamplingProfiler(object):
+    """Samples the stacks of all threads at a fixed interval.
+
+    Every `interval` seconds the sampler thread reads
+    ``sys._current_frames()`` and counts each stack as a
+    ``thread;module:function;...`` string, outermost frame first. The
+    sampler stops after `duration` seconds, or on `stop`, and passes the
+    result to ``callback(profiler, result)``.
+    """
+    mode = 'sample'
+
+    def __init__(self, interval, duration, callback=None):
+        self.interval = interval
+        self.duration = duration
+        self.callback = callback
+        self.stacks = {}
+        self.samples = 0
+        self.overhead = 0.0
+        self.started = None
+        self.running = False
+        self.thread = None
+        self._labels = {}
+
+    def start(self):
+        self.running = True
+        self.started = time.time()
+        self.thread = threading.Thread(target=self._run, name='Profiler')
+        self.thread.daemon = True
+        self.thread.start()
+
+    def stop(self):
+        self.running = False
+
+    def is_alive(self):
+        return self.thread is not None and self.thread.is_alive()
+
+    def sample(self, ignore=None):
+        """Count the current stack of every thread but `ignore`."""
+        names = dict([(t.ident, t.name) for t in threading.enumerate()])
+        for ident, frame in sys._current_frames().items():
+            if ident == ignore:
+                continue
+            labels = []
+            while frame is not None and len(labels) < MAX_DEPTH:
+                labels.append(self._label(frame.f_code))
+                frame = frame.f_back
+            labels.append(names.get(ident, str(ident)).replace(';', ':'))
+            stack = ';'.join(reversed(labels))
+            if stack not in self.stacks and len(self.stacks) >= MAX_STACKS:
+                stack = OTHER
+            self.stacks[stack] = self.stacks.get(stack, 0) + 1
+        self.samples += 1
+
+    def result(self):
+        return {'mode': self.mode,
+                'interval_ms': self.interval * 1000,
+                'duration_sec': time.time() - self.started,
+                'samples': self.samples,
+                'overhead_ms': self.overhead * 1000,
+                'stacks': self.stacks}
+
+    def _label(self, code):
+        label = self._labels.get(code)
+        if label is None:
+            module = os.path.splitext(os.path.basename(code.co_filename))[0]
+            label = self._labels[code] = '%s:%s' % (module, code.co_name)
+        return label
+
+    def _run(self):
+        ident = threading.current_thread().ident
+        end = self.started + self.duration
+        next_time = self.started
+        while self.running and next_time < end:
+            delay = next_time - time.time()
+            if delay > 0:
+                time.sleep(delay)
+            started = time.time()
+            self.sample(ident)
+            self.overhead += time.time() - started
+            # a slow sample delays the next ones rather than bunching them
+            next_time = max(next_time + self.interval, time.time())
+        self.running = False
+        if self.callback is not None:
+            self.callback(self, self.result())
+
+
+class DeterministicProfiler(object):
+    """Profiles the calls made through `call` with cProfile.
+
+    cProfile only sees the thread that enables it, so the calls to
+    profile are wrapped with `call`; every thread gets its own
+    ``cProfile.Profile`` and the results are merged when profiling ends.
+    The result lists the `limit` functions with the highest cumulative
+    time.
+    """
+    mode = 'cprofile'
+
+    def __init__(self, duration, callback=None, limit=50):
+        self.duration = duration
+        self.callback = callback
+        self.limit = limit
+        self.profiles = []
+        self.lock = threading.Lock()
+        self.local = threading.local()
+        self.started = None
+        self.running = False
+        self.timer = None
+
+    def start(self):
+        self.running = True
+        self.started = time.time()
+        self.timer = threading.Timer(self.duration, self.stop)
+        self.timer.daemon = True
+        self.timer.start()
+
+    def stop(self):
+        with self.lock:
+            if not self.running:
+                return
+            self.running = False
+        self.timer.cancel()
+        if self.callback is not None:
+            self.callback(self, self.result())
+
+    def is_alive(self):
+        return self.running
+
+    def call(self, function, *args):
+        if not self.running:
+            return function(*args)
+        profile = getattr(self.local, 'profile', None)
+        if profile is None:
+            profile = self.local.profile = cProfile.Profile()
+            with self.lock:
+                self.profiles.append(profile)
+        profile.enable()
+        try:
+            return function(*args)
+        finally:
+            profile.disable()
+
+    def stats(self):
+        """Return the merged `pstats.Stats`, or None without calls."""
+        with self.lock:
+            profiles = list(self.profiles)
+        stats = None
+        for profile in profiles:
+            profile.create_stats()
+            if not profile.stats:
+                continue
+            if stats is None:
+                stats = pstats.Stats(profile)
+            else:
+                stats.add(profile)
+        return stats
+
+    def dump(self, path):
+        """Write the merged statistics in the `pstats` file format."""
+        stats = self.stats()
+        if stats is None:
+            return False
+        stats.dump_stats(path)
+        return True
+
+    def result(self):
+        functions = []
+        stats = self.stats()
+        if stats is not None:
+            rows = sorted(stats.stats.items(),
+                          key=lambda item: item[1][3], reverse=True)
+            for (filename, line, name), row in rows[:self.limit]:
+                calls, _, total, cumulative = row[:4]
+                module = os.path.splitext(os.path.basename(filename))[0]
+                functions.append({'function': '%s:%s' % (module, name),
+                                  'line': line,
+                                  'calls': calls,
+                                  'total_ms': total * 1000,
+                                  'cumulative_ms': cumulative * 1000})
+        return {'mode': self.mode,
+                'duration_sec': time.time() - self.started,
+                'functions': functions}
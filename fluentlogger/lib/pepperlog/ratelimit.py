@@ -0,0 +1,157 @@
+# -*- coding: utf-8 -*-
+
+from collections import OrderedDict
+import re
+import threading
+
+_NUMBERS = re.compile(r'\d+')
+
+
+def message_template(message):
+    """Return `message` with its numbers masked."""
+    return _NUMBERS.sub('#', message)
+
+
+class TokenBucket(object):
+    """Allows `rate` events per second with bursts of up to `burst`."""
+    __slots__ = ('rate', 'burst', 'tokens', 'updated')
+
+    def __init__(self, rate, burst, now):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self.updated = now
+
+    def take(self, now):
+        tokens = self.tokens + (now - self.updated) * self.rate
+        self.updated = now
+        if tokens > self.burst:
+            tokens = self.burst
+        if tokens < 1:
+            self.tokens = tokens
+            return False
+        self.tokens = tokens - 1
+        return True
+
+
+class BoundedLRU(OrderedDict):
+    """OrderedDict keeping only the `maxsize` most recently used keys."""
+    def __init__(self, maxsize):
+        OrderedDict.__init__(self)
+        self.maxsize = maxsize
+
+    def lookup(self, key):
+        value = self.pop(key, None)
+        if value is not None:
+            OrderedDict.__setitem__(self, key, value)
+        return value
+
+    def store(self, key, value):
+        self.pop(key, None)
+        if len(self) >= self.maxsize:
+            self.popitem(last=False)
+        OrderedDict.__setitem__(self, key, value)
+
+
+class _Repeat(object):
+    __slots__ = ('key', 'msg', 'first', 'last', 'count')
+
+    def __init__(self, key, msg, now):
+        self.key = key
+        self.msg = msg
+        self.first = now
+        self.last = now
+        self.count = 0
+
+
+class LogThrottle(object):
+    """Rate limits and de-duplicates qi log messages.
+
+    Each message must pass a token bucket for its category and one for its
+    (category, template) pair, where the template is the message with its
+    numbers masked. Identical consecutive messages of a category within
+    `repeat_window` seconds are collapsed into the first one, and reported
+    later as one record carrying ``repeat_count``. State is kept in bounded
+    LRUs keyed by hash, so memory stays constant under floods.
+    """
+    def __init__(self, category_rate=50, category_burst=200,
+                 message_rate=10, message_burst=50, repeat_window=5.0,
+                 max_keys=1024):
+        self.category_rate = category_rate
+        self.category_burst = category_burst
+        self.message_rate = message_rate
+        self.message_burst = message_burst
+        self.repeat_window = repeat_window
+
+        self.lock = threading.Lock()
+        self.category_buckets = BoundedLRU(max_keys)
+        self.message_buckets = BoundedLRU(max_keys)
+        self.repeats = BoundedLRU(max_keys)
+        self.dropped = BoundedLRU(max_keys)
+
+    def process(self, msg, now):
+        """Return the list of records to forward for `msg`."""
+        with self.lock:
+            return self._process(msg, now)
+
+    def _process(self, msg, now):
+        category = msg.get('category', '')
+        message = msg.get('message', '')
+        records = []
+
+        key = hash((category, message))
+        repeat = self.repeats.lookup(category)
+        if repeat is not None:
+            if repeat.key == key and now - repeat.first < self.repeat_window:
+                repeat.count += 1
+                repeat.last = now
+                return records
+            if repeat.count:
+                records.append(self._repeat_record(repeat))
+
+        bucket = self.category_buckets.lookup(category)
+        if bucket is None:
+            bucket = TokenBucket(self.category_rate, self.category_burst, now)
+            self.category_buckets.store(category, bucket)
+        template = hash((category, message_template(message)))
+        message_bucket = self.message_buckets.lookup(template)
+        if message_bucket is None:
+            message_bucket = TokenBucket(self.message_rate,
+                                         self.message_burst, now)
+            self.message_buckets.store(template, message_bucket)
+        if not (message_bucket.take(now) and bucket.take(now)):
+            count = self.dropped.lookup(category) or 0
+            self.dropped.store(category, count + 1)
+            return records
+
+        self.repeats.store(category, _Repeat(key, msg, now))
+        records.append(msg)
+        return records
+
+    def flush(self, now):
+        """Return the summaries of repeats and drops that are due."""
+        with self.lock:
+            return self._flush(now)
+
+    def _flush(self, now):
+        records = []
+        for category, repeat in list(self.repeats.items()):
+            if now - repeat.first >= self.repeat_window:
+                if repeat.count:
+                    records.append(self._repeat_record(repeat))
+                del self.repeats[category]
+        for category, count in list(self.dropped.items()):
+            records.append({'category': category,
+                            'message': 'suppressed %d messages' % count,
+                            'suppressed': count})
+        self.dropped.clear()
+        return records
+
+    @staticmethod
+    def _repeat_record(repeat):
+        record = dict(repeat.msg)
+        record['repeat_count'] = repeat.count
+        record['first_time'] = repeat.first
+        record['last_time'] = repeat.last
+        repeat.count = 0
+        return record
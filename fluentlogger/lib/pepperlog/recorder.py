@@ -0,0 +1,263 @@
+# -*- coding: utf-8 -*-
+
+from array import array
+import re
+import threading
+import time
+
+from pepperlog.streaming import columnar_batch
+
+
+class RingBuffer(object):
+    """Fixed-size columnar ring of float samples."""
+    def __init__(self, names, capacity):
+        self.names = list(names)
+        self.capacity = capacity
+        self.timestamps = array('d', [0.0]) * capacity
+        self.columns = [array('d', [0.0]) * capacity for _ in self.names]
+        self.head = 0
+        self.size = 0
+
+    def append(self, timestamp, values):
+        head = self.head
+        self.timestamps[head] = timestamp
+        for column, value in zip(self.columns, values):
+            column[head] = value
+        self.head = (head + 1) % self.capacity
+        if self.size < self.capacity:
+            self.size += 1
+
+    def memory_usage(self):
+        return (1 + len(self.columns)) * self.capacity * \
+            self.timestamps.itemsize
+
+    def last(self, back=0):
+        """Return the index of the sample `back` samples before the latest."""
+        if back >= self.size:
+            return None
+        return (self.head - 1 - back) % self.capacity
+
+    def snapshot(self):
+        """Return the samples in chronological order, as new arrays."""
+        start = (self.head - self.size) % self.capacity
+
+        def ordered(values):
+            if start + self.size <= self.capacity:
+                return values[start:start + self.size]
+            return values[start:] + values[:self.head]
+        return (ordered(self.timestamps),
+                [(name, ordered(column))
+                 for name, column in zip(self.names, self.columns)])
+
+
+class ThresholdTrigger(object):
+    """Fires when a column crosses `limit` in the given direction."""
+    def __init__(self, name, above, limit):
+        self.name = name
+        self.above = above
+        self.limit = limit
+        self.index = None
+
+    def check(self, ring, latest, previous):
+        value = ring.columns[self.index][latest]
+        if self.above:
+            hit = value > self.limit
+        else:
+            hit = value < self.limit
+        if not hit or previous is None:
+            return hit
+        # only fire on the crossing, not while the value stays beyond
+        prev = ring.columns[self.index][previous]
+        return not (prev > self.limit if self.above else prev < self.limit)
+
+    def __str__(self):
+        return '%s %s %s' % (self.name, '>' if self.above else '<',
+                             self.limit)
+
+
+class RateTrigger(object):
+    """Fires when a column changes faster than `limit` units per second."""
+    def __init__(self, name, limit):
+        self.name = name
+        self.limit = limit
+        self.index = None
+
+    def check(self, ring, latest, previous):
+        if previous is None:
+            return False
+        elapsed = ring.timestamps[latest] - ring.timestamps[previous]
+        if elapsed <= 0:
+            return False
+        column = ring.columns[self.index]
+        return abs(column[latest] - column[previous]) / elapsed > self.limit
+
+    def __str__(self):
+        return 'd(%s) > %s' % (self.name, self.limit)
+
+
+class LogTrigger(object):
+    """Fires on a qi log message of `category` at `level` or more severe.
+
+    A category ending with ``*`` matches by prefix.
+    """
+    def __init__(self, category, level):
+        self.category = category
+        self.prefix = category[:-1] if category.endswith('*') else None
+        self.level = level
+
+    def matches(self, category, level):
+        if level > self.level:
+            return False
+        if self.prefix is not None:
+            return category.startswith(self.prefix)
+        return category == self.category
+
+    def __str__(self):
+        return 'log:%s:%d' % (self.category, self.level)
+
+
+_METRIC_TRIGGER = re.compile(r'^(d\()?([\w.]+)\)?\s*([<>])\s*(-?[\d.]+)$')
+
+
+def parse_triggers(spec, levels):
+    """Parse a comma-separated trigger specification.
+
+    Supported forms are ``name > value``, ``name < value``,
+    ``d(name) > value`` (rate of change per second) and
+    ``log:category:Level``.
+
+    :param levels: mapping from qi log level names to numbers.
+    """
+    triggers = []
+    for item in [item.strip() for item in spec.split(',') if item.strip()]:
+        if item.startswith('log:'):
+            _, category, level = item.split(':', 2)
+            triggers.append(LogTrigger(category, levels[level]))
+            continue
+        match = _METRIC_TRIGGER.match(item)
+        if match is None:
+            raise ValueError('invalid trigger: %r' % item)
+        rate, name, op, limit = match.groups()
+        if rate:
+            if op != '>':
+                raise ValueError('invalid trigger: %r' % item)
+            triggers.append(RateTrigger(name, float(limit)))
+        else:
+            triggers.append(ThresholdTrigger(name, op == '>', float(limit)))
+    return triggers
+
+
+class FlightRecorder(object):
+    """Keeps a high-rate history in memory and ships it around anomalies.
+
+    `sample` is called `rate` times per second and must return one float
+    per column name. Nothing is shipped until a trigger fires; then the
+    last `pre_seconds` of history plus `post_seconds` after the trigger are
+    sent through ``callback(record, trigger_time)`` as one columnar record.
+    """
+    def __init__(self, sample, names, rate, pre_seconds, post_seconds,
+                 triggers, callback):
+        self.sample = sample
+        self.rate = rate
+        self.period = 1.0 / rate
+        self.pre_seconds = pre_seconds
+        self.post_seconds = post_seconds
+        self.callback = callback
+        self.ring = RingBuffer(names,
+                               int(rate * (pre_seconds + post_seconds)) + 1)
+
+        self.triggers = []
+        self.log_triggers = []
+        for trigger in triggers:
+            if isinstance(trigger, LogTrigger):
+                self.log_triggers.append(trigger)
+            else:
+                if trigger.name not in self.ring.names:
+                    raise ValueError('unknown metric: %r' % trigger.name)
+                trigger.index = self.ring.names.index(trigger.name)
+                self.triggers.append(trigger)
+
+        self.pending = None
+        self.fired = None
+        self.suppressed = 0
+        self.running = False
+        self.thread = None
+
+    def start(self):
+        self.running = True
+        self.thread = threading.Thread(target=self._run,
+                                       name='FlightRecorder')
+        self.thread.daemon = True
+        self.thread.start()
+
+    def stop(self):
+        self.running = False
+
+    def memory_usage(self):
+        return self.ring.memory_usage()
+
+    def notify_log(self, msg):
+        category = msg.get('category', '')
+        level = msg.get('level')
+        for trigger in self.log_triggers:
+            if trigger.matches(category, level):
+                self.pending = (str(trigger), time.time())
+                return
+
+    def _run(self):
+        next_time = time.time()
+        while self.running:
+            delay = next_time - time.time()
+            if delay > 0:
+                time.sleep(delay)
+            try:
+                values = self.sample()
+            except Exception:
+                values = None
+            now = time.time()
+            if values is not None:
+                self.ring.append(now, values)
+                self._evaluate(now)
+            next_time += self.period
+            if time.time() - next_time > self.period:
+                next_time = time.time()
+
+    def _evaluate(self, now):
+        ring = self.ring
+        fired = self.pending
+        self.pending = None
+        if fired is None:
+            latest = ring.last()
+            previous = ring.last(1)
+            for trigger in self.triggers:
+                if trigger.check(ring, latest, previous):
+                    fired = (str(trigger), now)
+                    break
+        if self.fired is not None:
+            if fired is not None:
+                self.suppressed += 1
+            if now - self.fired[1] >= self.post_seconds:
+                self._ship()
+        elif fired is not None:
+            self.fired = fired
+            if self.post_seconds <= 0:
+                self._ship()
+
+    def _ship(self):
+        description, trigger_time = self.fired
+        timestamps, columns = self.ring.snapshot()
+        start = trigger_time - self.pre_seconds
+        first = 0
+        while first < len(timestamps) and timestamps[first] < start:
+            first += 1
+        timestamps = timestamps[first:]
+        columns = [(name, values[first:]) for name, values in columns]
+        record = columnar_batch(timestamps[0] if timestamps else start,
+                                timestamps, columns, len(timestamps))
+        record['trigger'] = description
+        record['trigger_time'] = trigger_time
+        record['rate'] = self.rate
+        record['suppressed_triggers'] = self.suppressed
+        self.fired = None
+        self.suppressed = 0
+        self.callback(record, trigger_time)
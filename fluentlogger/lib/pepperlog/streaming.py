@@ -0,0 +1,115 @@
+# -*- coding: utf-8 -*-
+
+from array import array
+import threading
+import time
+
+
+def columnar_batch(start, timestamps, columns, count):
+    """Return a columnar record for the first `count` samples.
+
+    :param start: time of the batch, in seconds since the epoch.
+    :param timestamps: array of sample times, in seconds since the epoch.
+    :param columns: list of (name, array of values) pairs.
+    """
+    return {
+        'start': start,
+        'samples': count,
+        'offsets_ms': [int(round((t - start) * 1000))
+                       for t in timestamps[:count]],
+        'values': dict([(name, values[:count].tolist())
+                        for name, values in columns]),
+    }
+
+
+class JointStreamer(object):
+    """Samples ALMemory keys at a high rate for a limited time.
+
+    Samples are stored in preallocated typed arrays and shipped once per
+    second as a single columnar record through
+    ``callback(record, start)``, with the sampling jitter and the number of
+    samples dropped because the sampler fell behind.
+    """
+    def __init__(self, memory, keys, names, rate, duration, callback):
+        assert len(keys) == len(names), 'keys and names must match'
+        self.memory = memory
+        self.keys = list(keys)
+        self.names = list(names)
+        self.rate = rate
+        self.duration = duration
+        self.callback = callback
+
+        self.period = 1.0 / rate
+        self.capacity = int(rate) + 1
+        self.timestamps = array('d', [0.0]) * self.capacity
+        self.columns = [(name, array('d', [0.0]) * self.capacity)
+                        for name in self.names]
+
+        self.running = False
+        self.thread = None
+
+    def start(self):
+        self.running = True
+        self.thread = threading.Thread(target=self._run,
+                                       name='JointStreamer')
+        self.thread.daemon = True
+        self.thread.start()
+
+    def stop(self):
+        self.running = False
+
+    def is_alive(self):
+        return self.thread is not None and self.thread.is_alive()
+
+    def _run(self):
+        now = time.time()
+        end = now + self.duration
+        next_time = now
+        batch_start = now
+        count = dropped = 0
+        jitter_sum = jitter_max = 0.0
+        while self.running and next_time < end:
+            if next_time - batch_start >= 1.0 or count == self.capacity:
+                self._ship(batch_start, count, dropped, jitter_sum, jitter_max)
+                batch_start = next_time
+                count = dropped = 0
+                jitter_sum = jitter_max = 0.0
+            delay = next_time - time.time()
+            if delay > 0:
+                time.sleep(delay)
+            sampled_at = time.time()
+            jitter = sampled_at - next_time
+            try:
+                values = self.memory.getListData(self.keys)
+            except Exception:
+                values = None
+            if values is None:
+                dropped += 1
+            else:
+                self.timestamps[count] = sampled_at
+                for (name, column), value in zip(self.columns, values):
+                    column[count] = float(value) if value is not None \
+                        else float('nan')
+                count += 1
+                jitter_sum += jitter
+                jitter_max = max(jitter_max, jitter)
+            next_time += self.period
+            late = time.time() - next_time
+            if late > self.period:
+                # skip the slots we can no longer honour
+                skipped = int(late / self.period)
+                dropped += skipped
+                next_time += skipped * self.period
+        self._ship(batch_start, count, dropped, jitter_sum, jitter_max)
+        self.running = False
+
+    def _ship(self, batch_start, count, dropped, jitter_sum, jitter_max):
+        if count == 0 and dropped == 0:
+            return
+        record = columnar_batch(batch_start, self.timestamps, self.columns,
+                                count)
+        record['rate'] = self.rate
+        record['dropped'] = dropped
+        record['jitter_mean_ms'] = jitter_sum * 1000 / count if count else 0.0
+        record['jitter_max_ms'] = jitter_max * 1000
+        self.callback(record, batch_start)
@@ -0,0 +1,63 @@
+# -*- coding: utf-8 -*-
+
+import json
+import unittest
+
+from .compactlog import CompactLogEncoder, CompactLogDecoder
+
+
+def _msg(message, category='ALMotion'):
+    return {'category': category, 'level': 4, 'message': message,
+            'source': 'motion.cpp:walk:120', 'location': 'robot:1234',
+            'date': 1445000000123456789, 'id': 7, 'robot': 'pepper1'}
+
+
+class TestCompactLog(unittest.TestCase):
+
+    def test_interning(self):
+        encoder = CompactLogEncoder()
+        first = encoder.encode(_msg('a'), 1)
+        second = encoder.encode(_msg('b'), 1)
+        self.assertEqual(first['n'], [0, 'ALMotion', 1, 'motion.cpp:walk:120',
+                                      2, 'robot:1234'])
+        self.assertFalse('n' in second)
+        self.assertEqual(second['c'], 0)
+        self.assertEqual(second['l'], 4)
+        self.assertEqual(second['id'], 7)
+        self.assertTrue(len(json.dumps(second)) < len(json.dumps(_msg('b'))))
+
+    def test_new_epoch_on_reconnect(self):
+        encoder = CompactLogEncoder()
+        first = encoder.encode(_msg('a'), 1)
+        second = encoder.encode(_msg('b'), 2)
+        self.assertNotEqual(first['e'], second['e'])
+        self.assertTrue('n' in second)
+
+    def test_roundtrip(self):
+        encoder = CompactLogEncoder()
+        decoder = CompactLogDecoder()
+        for message in ['a', 'b']:
+            record = json.loads(json.dumps(encoder.encode(_msg(message), 1)))
+            decoded = decoder.feed(record)
+            expected = _msg(message)
+            expected['date'] = 1445000000.1234567
+            self.assertAlmostEqual(decoded.pop('date'), expected.pop('date'))
+            self.assertEqual(decoded, expected)
+
+    def test_resync(self):
+        encoder = CompactLogEncoder(resync_interval=10)
+        encoder.encode(_msg('a'), 1)
+        record = encoder.encode(_msg('b'), 1)
+        self.assertEqual(encoder.resync_record(encoder.resynced + 1), None)
+        resync = encoder.resync_record(encoder.resynced + 10)
+        resync['robot'] = 'pepper1'
+        decoder = CompactLogDecoder()
+        self.assertRaises(KeyError, decoder.feed, dict(record))
+        self.assertEqual(decoder.feed(resync), None)
+        self.assertEqual(decoder.feed(record)['category'], 'ALMotion')
+
+
+
+if __name__ == '__main__':
+    test_suite = unittest.TestLoader().loadTestsFromTestCase(TestCompactLog)
+    unittest.TextTestRunner(verbosity=2).run(test_suite)
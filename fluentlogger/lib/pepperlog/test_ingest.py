@@ -0,0 +1,110 @@
+# -*- coding: utf-8 -*-
+
+import threading
+import time
+import unittest
+
+from fluent.budget import SHED_BULK, SHED_DROP
+
+from .ingest import IngestQueue
+
+
+class TestIngestQueue(unittest.TestCase):
+
+    def setUp(self):
+        self.batches = []
+        self.sent = threading.Event()
+
+        def send_batch(entries):
+            self.batches.append(entries)
+            self.sent.set()
+        self.queue = IngestQueue(send_batch, rate=10, burst=5, queue_max=3,
+                                 batch_size=4)
+
+    def tearDown(self):
+        self.queue.stop()
+
+    def _entries(self, label, count):
+        return [(label, 0, {'i': i}) for i in range(count)]
+
+    def test_quota(self):
+        self.assertEqual(self.queue.push('app', self._entries('app.a', 8)), 5)
+        stats = self.queue.stats()['app']
+        self.assertEqual(stats['accepted'], 5)
+        self.assertEqual(stats['rejected'], 3)
+        self.assertEqual(stats['dropped'], 2)
+        self.assertEqual(stats['queued'], 3)
+
+    def test_round_robin(self):
+        self.queue.push('noisy', self._entries('noisy', 3))
+        self.queue.push('quiet', self._entries('quiet', 1))
+        batch = self.queue._take()
+        self.assertEqual(len(batch), 4)
+        self.assertTrue(('quiet', 0, {'i': 0}) in batch)
+
+    def test_worker_sends(self):
+        self.queue.start()
+        self.queue.push('app', self._entries('app', 2))
+        self.assertTrue(self.sent.wait(2) or self.sent.is_set())
+        time.sleep(0.05)
+        self.assertEqual(sum([len(batch) for batch in self.batches]), 2)
+        self.assertEqual(self.queue.stats()['app']['sent'], 2)
+
+    def test_max_clients(self):
+        queue = IngestQueue(lambda entries: None, max_clients=1)
+        self.assertEqual(queue.push('a', self._entries('a', 1)), 1)
+        self.assertEqual(queue.push('b', self._entries('b', 1)), 0)
+
+    def test_evict_idle_clients(self):
+        queue = IngestQueue(lambda entries: None, max_clients=2)
+        queue.push('a', self._entries('a', 1))
+        queue.push('b', self._entries('b', 1))
+        queue._take()
+        # a pushed again: b is now the least recent
+        queue.push('a', [])
+        self.assertEqual(queue.push('c', self._entries('c', 1)), 1)
+        self.assertEqual(sorted(queue.stats()), ['a', 'c'])
+        self.assertEqual(queue.evicted, 1)
+        # both queues hold entries: nobody can be evicted
+        queue.push('a', self._entries('a', 1))
+        self.assertEqual(queue.push('d', self._entries('d', 1)), 0)
+        self.assertEqual(sorted(queue.stats()), ['a', 'c'])
+
+    def test_many_clients(self):
+        for i in range(200):
+            name = 'app%d' % i
+            self.assertEqual(self.queue.push(name, self._entries(name, 1)),
+                             1)
+            self.queue._take()
+        self.assertEqual(len(self.queue.stats()), self.queue.max_clients)
+
+    def test_sizeof_admitted_only(self):
+        sized = []
+
+        def sizeof(entry):
+            sized.append(entry)
+            return 10
+        queue = IngestQueue(lambda entries: None, rate=10, burst=2,
+                            sizeof=sizeof)
+        self.assertEqual(queue.push('app', self._entries('app', 5)), 2)
+        self.assertEqual(sized, self._entries('app', 2))
+        self.assertEqual(queue.memory_usage(), 20)
+        self.assertEqual(queue.push('app', self._entries('app', 5)), 0)
+        self.assertEqual(len(sized), 2)
+
+    def test_memory(self):
+        queue = IngestQueue(lambda entries: None, queue_max=3,
+                            sizeof=lambda entry: 10)
+        queue.push('noisy', self._entries('noisy', 3))
+        queue.push('quiet', self._entries('quiet', 1))
+        self.assertEqual(queue.memory_usage(), 40)
+        self.assertEqual(queue.shed_memory(SHED_BULK, 100), 0)
+        self.assertEqual(queue.shed_memory(SHED_DROP, 15), 20)
+        self.assertEqual(queue.stats()['noisy']['queued'], 1)
+        queue._take()
+        self.assertEqual(queue.memory_usage(), 0)
+
+
+if __name__ == '__main__':
+    test_suite = unittest.TestLoader().loadTestsFromTestCase(TestIngestQueue)
+    unittest.TextTestRunner(verbosity=2).run(test_suite)
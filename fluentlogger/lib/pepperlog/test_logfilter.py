@@ -0,0 +1,58 @@
+# -*- coding: utf-8 -*-
+
+import unittest
+
+from . import logfilter
+
+
+LEVELS = {'Fatal': 1, 'Error': 2, 'Warning': 3, 'Info': 4,
+          'Verbose': 5, 'Debug': 6}
+
+
+class TestCategoryFilter(unittest.TestCase):
+
+    def setUp(self):
+        rules = logfilter.parse_rules(
+            'ALDialog.*=Warning, myapp.*=Debug, myapp.noisy.*=Error,'
+            'ALMotion=Fatal', LEVELS)
+        self.filter = logfilter.CategoryFilter(rules, LEVELS['Info'])
+
+    def test_parse(self):
+        self.assertEqual(logfilter.parse_rules('a.*=Info', LEVELS),
+                         {'a.*': 4})
+        self.assertRaises(ValueError, logfilter.parse_rules, 'a.*', LEVELS)
+        self.assertRaises(ValueError, logfilter.parse_rules, 'a=Loud', LEVELS)
+
+    def test_default(self):
+        self.assertTrue(self.filter.allows('qimessaging.session', 4))
+        self.assertFalse(self.filter.allows('qimessaging.session', 5))
+
+    def test_prefix(self):
+        self.assertTrue(self.filter.allows('ALDialog.engine', 3))
+        self.assertFalse(self.filter.allows('ALDialog.engine', 4))
+        self.assertTrue(self.filter.allows('myapp.ui', 6))
+
+    def test_longest_prefix_wins(self):
+        self.assertFalse(self.filter.allows('myapp.noisy.loop', 3))
+        self.assertTrue(self.filter.allows('myapp.noisy.loop', 2))
+
+    def test_exact(self):
+        self.assertTrue(self.filter.allows('ALMotion', 1))
+        self.assertFalse(self.filter.allows('ALMotion', 2))
+        self.assertTrue(self.filter.allows('ALMotionRecorder', 4))
+
+    def test_cache_bounded(self):
+        small = logfilter.CategoryFilter({}, 4, cache_size=2)
+        for category in ['a', 'b', 'c']:
+            small.allows(category, 4)
+        self.assertTrue(len(small.cache) <= 2)
+
+    def test_max_level(self):
+        self.assertEqual(self.filter.max_level(), 6)
+
+
+
+if __name__ == '__main__':
+    test_suite = unittest.TestLoader().loadTestsFromTestCase(
+        TestCategoryFilter)
+    unittest.TextTestRunner(verbosity=2).run(test_suite)
@@ -0,0 +1,48 @@
+# -*- coding: utf-8 -*-
+
+import unittest
+
+from . import logstats
+
+
+class TestSpaceSaving(unittest.TestCase):
+
+    def test_exact_when_small(self):
+        sketch = logstats.SpaceSaving(4)
+        for key in 'aabbbc':
+            sketch.add(key)
+        self.assertEqual(sketch.top(2), [('b', 3, 0), ('a', 2, 0)])
+
+    def test_bounded(self):
+        sketch = logstats.SpaceSaving(3)
+        for i in range(100):
+            sketch.add('heavy')
+            sketch.add('light%d' % i)
+        self.assertEqual(len(sketch.counters), 3)
+        key, count, error = sketch.top(1)[0]
+        self.assertEqual(key, 'heavy')
+        self.assertTrue(count - error <= 100 <= count)
+
+
+class TestLogStats(unittest.TestCase):
+
+    def test_snapshot(self):
+        stats = logstats.LogStats(top_k=1)
+        for i in range(3):
+            stats.add({'category': 'ALMotion', 'level': 3,
+                       'message': 'fall %d' % i})
+        stats.add({'category': 'ALDialog', 'level': 2, 'message': 'oops'})
+        record = stats.snapshot()
+        self.assertEqual(record['total'], 4)
+        self.assertEqual(record['counts'], [
+            {'category': 'ALDialog', 'level': 2, 'count': 1},
+            {'category': 'ALMotion', 'level': 3, 'count': 3}])
+        self.assertEqual(record['top_messages'], [
+            {'category': 'ALMotion', 'template': 'fall #', 'count': 3,
+             'error': 0}])
+        self.assertEqual(stats.snapshot()['total'], 0)
+
+
+
+if __name__ == '__main__':
+    unittest.main()
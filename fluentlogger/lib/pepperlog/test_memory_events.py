@@ -0,0 +1,91 @@
+# -*- coding: utf-8 -*-
+
+import time
+import unittest
+
+from .memory_events import MemoryEventCollector
+
+
+class _Signal(object):
+    def __init__(self):
+        self.callbacks = {}
+
+    def connect(self, callback):
+        link = len(self.callbacks) + 1
+        self.callbacks[link] = callback
+        return link
+
+    def disconnect(self, link):
+        del self.callbacks[link]
+
+    def emit(self, value):
+        for callback in list(self.callbacks.values()):
+            callback(value)
+
+
+class _Subscriber(object):
+    def __init__(self):
+        self.signal = _Signal()
+
+
+class _Memory(object):
+    def __init__(self):
+        self.subscribers = {}
+
+    def getData(self, key):
+        if key == 'BatteryChargeChanged':
+            return 80
+        raise RuntimeError('no such key')
+
+    def subscriber(self, key):
+        return self.subscribers.setdefault(key, _Subscriber())
+
+
+class TestMemoryEventCollector(unittest.TestCase):
+
+    def setUp(self):
+        self.memory = _Memory()
+        self.events = []
+        self.collector = MemoryEventCollector(
+            self.memory, ['BatteryChargeChanged', 'BatteryPowerPluggedChanged'],
+            lambda *args: self.events.append(args), min_interval=0.05)
+        self.collector.start()
+
+    def tearDown(self):
+        self.collector.stop()
+
+    def test_initial_values(self):
+        self.assertEqual(self.collector.last_value('BatteryChargeChanged'), 80)
+        self.assertEqual(
+            self.collector.last_value('BatteryPowerPluggedChanged'), None)
+
+    def test_first_event_is_forwarded(self):
+        self.memory.subscribers['BatteryChargeChanged'].signal.emit(79)
+        self.assertEqual(len(self.events), 1)
+        self.assertEqual(self.events[0][0], 'BatteryChargeChanged')
+        self.assertEqual(self.events[0][1], 79)
+        self.assertEqual(self.events[0][3], 1)
+
+    def test_burst_is_coalesced(self):
+        signal = self.memory.subscribers['BatteryPowerPluggedChanged'].signal
+        for value in [True, False, True]:
+            signal.emit(value)
+        self.assertEqual(len(self.events), 1)
+        time.sleep(0.2)
+        self.assertEqual(len(self.events), 2)
+        key, value, timestamp, count = self.events[1]
+        self.assertEqual(value, True)
+        self.assertEqual(count, 2)
+        self.assertEqual(self.collector.last_value(key), True)
+
+    def test_stop_disconnects(self):
+        self.collector.stop()
+        self.memory.subscribers['BatteryChargeChanged'].signal.emit(50)
+        self.assertEqual(self.events, [])
+
+
+
+if __name__ == '__main__':
+    test_suite = unittest.TestLoader().loadTestsFromTestCase(
+        TestMemoryEventCollector)
+    unittest.TextTestRunner(verbosity=2).run(test_suite)
@@ -0,0 +1,54 @@
+# -*- coding: utf-8 -*-
+
+import unittest
+
+from . import policy
+
+
+class TestAdaptivePolicy(unittest.TestCase):
+
+    def setUp(self):
+        self.policy = policy.AdaptivePolicy(load_high=2.0, cpu_high=80.0,
+                                            battery_low=30, hold=2)
+
+    def test_normal(self):
+        self.assertEqual(self.policy.update(0.5, 20.0, 90, False), None)
+        self.assertEqual(self.policy.state, policy.NORMAL)
+
+    def test_load_relaxes(self):
+        self.assertEqual(self.policy.update(3.0, 20.0, 90, False),
+                         (policy.RELAXED, 'load'))
+
+    def test_cpu_relaxes(self):
+        self.assertEqual(self.policy.update(0.5, 95.0, 90, False),
+                         (policy.RELAXED, 'cpu'))
+
+    def test_battery_relaxes_only_when_discharging(self):
+        self.assertEqual(self.policy.update(0.5, 20.0, 20, True), None)
+        self.assertEqual(self.policy.update(0.5, 20.0, 20, False),
+                         (policy.RELAXED, 'battery'))
+
+    def test_hysteresis(self):
+        self.policy.update(3.0, 20.0, 90, False)
+        # below the high threshold but above the low one: stay relaxed
+        self.assertEqual(self.policy.update(1.5, 20.0, 90, False), None)
+        self.assertEqual(self.policy.update(1.5, 20.0, 90, False), None)
+        self.assertEqual(self.policy.update(0.5, 20.0, 90, False), None)
+        self.assertEqual(self.policy.update(0.5, 20.0, 90, False),
+                         (policy.NORMAL, 'idle'))
+
+    def test_charging_tightens(self):
+        self.policy.update(0.5, 20.0, 20, False)
+        self.policy.update(0.5, 20.0, 21, True)
+        self.assertEqual(self.policy.update(0.5, 20.0, 22, True),
+                         (policy.NORMAL, 'charging'))
+
+    def test_unknown_values(self):
+        self.assertEqual(self.policy.update(None, None, None, None), None)
+
+
+
+if __name__ == '__main__':
+    test_suite = unittest.TestLoader().loadTestsFromTestCase(
+        TestAdaptivePolicy)
+    unittest.TextTestRunner(verbosity=2).run(test_suite)
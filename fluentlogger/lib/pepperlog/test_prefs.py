@@ -0,0 +1,62 @@
+# -*- coding: utf-8 -*-
+
+import unittest
+
+from .prefs import PreferenceStore
+
+
+class _Manager(object):
+    def __init__(self, values, listable=True):
+        self.values = values
+        self.listable = listable
+        self.calls = 0
+
+    def getValueList(self, domain):
+        self.calls += 1
+        if not self.listable:
+            raise RuntimeError('not supported')
+        return [[name, value] for name, value in self.values.items()]
+
+    def getValue(self, domain, name):
+        self.calls += 1
+        return self.values.get(name)
+
+    def setValue(self, domain, name, value):
+        self.values[name] = value
+
+
+class TestPreferenceStore(unittest.TestCase):
+
+    def test_load_once(self):
+        manager = _Manager({'host': 'fluentd', 'port': '24224'})
+        store = PreferenceStore(manager, 'domain')
+        store.load()
+        self.assertEqual(store.get('host'), 'fluentd')
+        self.assertEqual(store.get('port', '1'), '24224')
+        self.assertEqual(store.get('tag', 'pepper'), 'pepper')
+        self.assertEqual(manager.calls, 1)
+
+    def test_set(self):
+        manager = _Manager({})
+        store = PreferenceStore(manager, 'domain')
+        store.load()
+        store.set('qi_log', '1')
+        self.assertEqual(store.get('qi_log'), '1')
+        self.assertEqual(manager.values['qi_log'], '1')
+
+    def test_fallback(self):
+        manager = _Manager({'host': 'fluentd'}, listable=False)
+        store = PreferenceStore(manager, 'domain')
+        store.load()
+        self.assertEqual(store.get('host'), 'fluentd')
+        self.assertEqual(store.get('host'), 'fluentd')
+        self.assertEqual(store.get('tag', 'pepper'), 'pepper')
+        self.assertEqual(store.get('tag', 'pepper'), 'pepper')
+        self.assertEqual(manager.calls, 3)
+
+
+
+if __name__ == '__main__':
+    test_suite = unittest.TestLoader().loadTestsFromTestCase(
+        TestPreferenceStore)
+    unittest.TextTestRunner(verbosity=2).run(test_suite)
@@ -0,0 +1,105 @@
+# -*- coding: utf-8 -*-
+
+import threading
+import time
+import unittest
+
+from . import profiler
+
+
+def spin(stop):
+    while not stop.is_set():
+        sum(range(100))
+
+
+def work(n):
+    return sum([i * i for i in range(n)])
+
+
+class Results(list):
+    """Profiler callback keeping the results."""
+    def __call__(self, profile, result):
+        self.append(result)
+
+
+class TestSamplingProfiler(unittest.TestCase):
+
+    def test_sample(self):
+        stop = threading.Event()
+        thread = threading.Thread(target=spin, args=(stop,), name='Spinner')
+        thread.start()
+        try:
+            sampler = profiler.SamplingProfiler(0.01, 10)
+            for _ in range(20):
+                time.sleep(0.002)
+                sampler.sample()
+        finally:
+            stop.set()
+            thread.join()
+        self.assertEqual(sampler.samples, 20)
+        spinning = [stack for stack in sampler.stacks
+                    if stack.startswith('Spinner;')]
+        self.assertTrue(spinning)
+        self.assertTrue(any(['test_profiler:spin' in stack
+                             for stack in spinning]))
+        # the sampling thread itself shows up unless ignored
+        self.assertTrue(any(['test_profiler:test_sample' in stack
+                             for stack in sampler.stacks]))
+
+    def test_run_and_callback(self):
+        results = Results()
+        sampler = profiler.SamplingProfiler(0.005, 0.1, results)
+        sampler.start()
+        sampler.thread.join(5)
+        self.assertFalse(sampler.is_alive())
+        self.assertEqual(len(results), 1)
+        self.assertTrue(results[0]['samples'] >= 5)
+        self.assertFalse(any(['profiler:_run' in stack
+                              for stack in results[0]['stacks']]))
+
+    def test_bounded_stacks(self):
+        sampler = profiler.SamplingProfiler(0.01, 10)
+        sampler.stacks = dict([('s%d' % i, 1)
+                               for i in range(profiler.MAX_STACKS)])
+        sampler.sample()
+        self.assertEqual(len(sampler.stacks), profiler.MAX_STACKS + 1)
+        self.assertTrue(sampler.stacks[profiler.OTHER] >= 1)
+
+    def test_formats(self):
+        stacks = {'main;a:f': 3, 'main;a:g': 1, 'main;b:h': 5}
+        self.assertEqual(profiler.format_collapsed(stacks),
+                         'main;a:f 3\nmain;a:g 1\nmain;b:h 5\n')
+        self.assertEqual(profiler.top_stacks(stacks, 2),
+                         [{'stack': 'main;b:h', 'count': 5},
+                          {'stack': 'main;a:f', 'count': 3},
+                          {'stack': profiler.OTHER, 'count': 1}])
+
+
+class TestDeterministicProfiler(unittest.TestCase):
+
+    def test_calls(self):
+        results = Results()
+        cprofile = profiler.DeterministicProfiler(10, results)
+        self.assertEqual(cprofile.call(work, 10), 285)
+        cprofile.start()
+        thread = threading.Thread(target=cprofile.call, args=(work, 1000))
+        thread.start()
+        thread.join()
+        cprofile.call(work, 1000)
+        cprofile.stop()
+        cprofile.stop()
+        self.assertEqual(len(results), 1)
+        functions = dict([(f['function'], f) for f in results[0]['functions']])
+        self.assertEqual(functions['test_profiler:work']['calls'], 2)
+
+    def test_expires(self):
+        results = Results()
+        cprofile = profiler.DeterministicProfiler(0.05, results)
+        cprofile.start()
+        time.sleep(0.3)
+        self.assertFalse(cprofile.is_alive())
+        self.assertEqual(results[0]['functions'], [])
+
+
+if __name__ == '__main__':
+    unittest.main()
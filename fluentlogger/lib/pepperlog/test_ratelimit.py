@@ -0,0 +1,88 @@
+# -*- coding: utf-8 -*-
+
+import unittest
+
+from . import ratelimit
+
+
+def _msg(message, category='ALMotion', level=4):
+    return {'category': category, 'message': message, 'level': level}
+
+
+class TestTokenBucket(unittest.TestCase):
+
+    def test_burst_then_rate(self):
+        bucket = ratelimit.TokenBucket(2, 3, 0.0)
+        self.assertEqual([bucket.take(0.0) for _ in range(4)],
+                         [True, True, True, False])
+        self.assertTrue(bucket.take(0.5))
+        self.assertFalse(bucket.take(0.5))
+
+
+class TestBoundedLRU(unittest.TestCase):
+
+    def test_evicts_least_recently_used(self):
+        lru = ratelimit.BoundedLRU(2)
+        lru.store('a', 1)
+        lru.store('b', 2)
+        lru.lookup('a')
+        lru.store('c', 3)
+        self.assertEqual(sorted(lru.keys()), ['a', 'c'])
+
+
+class TestLogThrottle(unittest.TestCase):
+
+    def test_repeats_collapsed(self):
+        throttle = ratelimit.LogThrottle(repeat_window=1.0)
+        self.assertEqual(len(throttle.process(_msg('same'), 0.0)), 1)
+        for i in range(5):
+            self.assertEqual(throttle.process(_msg('same'), 0.1 * i), [])
+        records = throttle.process(_msg('other'), 0.6)
+        self.assertEqual(len(records), 2)
+        self.assertEqual(records[0]['repeat_count'], 5)
+        self.assertEqual(records[0]['first_time'], 0.0)
+        self.assertEqual(records[0]['message'], 'same')
+        self.assertEqual(records[1]['message'], 'other')
+
+    def test_repeats_flushed(self):
+        throttle = ratelimit.LogThrottle(repeat_window=1.0)
+        throttle.process(_msg('same'), 0.0)
+        throttle.process(_msg('same'), 0.5)
+        self.assertEqual(throttle.flush(0.8), [])
+        records = throttle.flush(1.5)
+        self.assertEqual(len(records), 1)
+        self.assertEqual(records[0]['repeat_count'], 1)
+        self.assertEqual(records[0]['last_time'], 0.5)
+
+    def test_template_rate_limited(self):
+        throttle = ratelimit.LogThrottle(message_rate=1, message_burst=3,
+                                         repeat_window=0)
+        forwarded = 0
+        for i in range(10):
+            forwarded += len(throttle.process(_msg('value %d' % i), 0.0))
+        self.assertEqual(forwarded, 3)
+        self.assertEqual(len(throttle.process(_msg('another'), 0.0)), 1)
+        summary = throttle.flush(0.0)
+        self.assertEqual(summary, [{'category': 'ALMotion',
+                                    'message': 'suppressed 7 messages',
+                                    'suppressed': 7}])
+
+    def test_category_rate_limited(self):
+        throttle = ratelimit.LogThrottle(category_rate=1, category_burst=2,
+                                         repeat_window=0)
+        forwarded = sum([len(throttle.process(_msg('m%s' % chr(97 + i)), 0.0))
+                         for i in range(5)])
+        self.assertEqual(forwarded, 2)
+
+    def test_memory_bounded(self):
+        throttle = ratelimit.LogThrottle(max_keys=8)
+        for i in range(100):
+            throttle.process(_msg('message', category='c%d' % i), 0.0)
+        self.assertTrue(len(throttle.repeats) <= 8)
+        self.assertTrue(len(throttle.category_buckets) <= 8)
+        self.assertTrue(len(throttle.message_buckets) <= 8)
+
+
+
+if __name__ == '__main__':
+    unittest.main()
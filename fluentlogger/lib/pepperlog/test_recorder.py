@@ -0,0 +1,104 @@
+# -*- coding: utf-8 -*-
+
+import time
+import unittest
+
+from . import recorder
+
+
+LEVELS = {'Fatal': 1, 'Error': 2, 'Warning': 3, 'Info': 4,
+          'Verbose': 5, 'Debug': 6}
+
+
+class TestRingBuffer(unittest.TestCase):
+
+    def test_wrap(self):
+        ring = recorder.RingBuffer(['a'], 3)
+        for i in range(5):
+            ring.append(float(i), [i * 10.0])
+        timestamps, columns = ring.snapshot()
+        self.assertEqual(list(timestamps), [2.0, 3.0, 4.0])
+        self.assertEqual(list(columns[0][1]), [20.0, 30.0, 40.0])
+        self.assertEqual(ring.columns[0][ring.last()], 40.0)
+        self.assertEqual(ring.columns[0][ring.last(1)], 30.0)
+
+    def test_partial(self):
+        ring = recorder.RingBuffer(['a'], 4)
+        ring.append(1.0, [1.0])
+        timestamps, columns = ring.snapshot()
+        self.assertEqual(list(timestamps), [1.0])
+        self.assertEqual(ring.last(1), None)
+
+
+class TestTriggers(unittest.TestCase):
+
+    def test_parse(self):
+        triggers = recorder.parse_triggers(
+            'cpu > 90, temp<10 ,d(load) > 2,log:ALMotion*:Error', LEVELS)
+        self.assertEqual([str(t) for t in triggers],
+                         ['cpu > 90.0', 'temp < 10.0', 'd(load) > 2.0',
+                          'log:ALMotion*:2'])
+
+    def test_parse_invalid(self):
+        self.assertRaises(ValueError, recorder.parse_triggers, 'cpu = 1',
+                          LEVELS)
+        self.assertRaises(KeyError, recorder.parse_triggers, 'log:a:Bad',
+                          LEVELS)
+
+    def test_threshold_fires_on_crossing(self):
+        ring = recorder.RingBuffer(['a'], 8)
+        trigger = recorder.ThresholdTrigger('a', True, 5.0)
+        trigger.index = 0
+        results = []
+        for t, value in enumerate([1.0, 6.0, 7.0, 2.0, 8.0]):
+            ring.append(float(t), [value])
+            results.append(trigger.check(ring, ring.last(), ring.last(1)))
+        self.assertEqual(results, [False, True, False, False, True])
+
+    def test_rate(self):
+        ring = recorder.RingBuffer(['a'], 8)
+        trigger = recorder.RateTrigger('a', 2.0)
+        trigger.index = 0
+        ring.append(0.0, [0.0])
+        ring.append(1.0, [1.0])
+        self.assertFalse(trigger.check(ring, ring.last(), ring.last(1)))
+        ring.append(1.5, [3.0])
+        self.assertTrue(trigger.check(ring, ring.last(), ring.last(1)))
+
+    def test_log(self):
+        trigger = recorder.LogTrigger('ALMotion*', 2)
+        self.assertTrue(trigger.matches('ALMotion.Walk', 1))
+        self.assertFalse(trigger.matches('ALMotion.Walk', 3))
+        self.assertFalse(trigger.matches('ALDialog', 1))
+
+
+class TestFlightRecorder(unittest.TestCase):
+
+    def test_burst(self):
+        values = [0.0]
+        bursts = []
+        flight = recorder.FlightRecorder(
+            lambda: list(values), ['a'], 50, 0.2, 0.1,
+            recorder.parse_triggers('a > 5,log:*:Fatal', LEVELS),
+            lambda record, t: bursts.append(record))
+        flight.start()
+        try:
+            time.sleep(0.4)
+            values[0] = 10.0
+            time.sleep(0.3)
+            flight.notify_log({'category': 'x', 'level': 1})
+            time.sleep(0.3)
+        finally:
+            flight.stop()
+        self.assertEqual(len(bursts), 2)
+        burst = bursts[0]
+        self.assertEqual(burst['trigger'], 'a > 5.0')
+        self.assertTrue(0.25 <= burst['offsets_ms'][-1] / 1000.0 <= 0.4)
+        self.assertEqual(burst['values']['a'][0], 0.0)
+        self.assertEqual(burst['values']['a'][-1], 10.0)
+        self.assertEqual(bursts[1]['trigger'], 'log:*:1')
+
+
+
+if __name__ == '__main__':
+    unittest.main()
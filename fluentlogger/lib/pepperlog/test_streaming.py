@@ -0,0 +1,53 @@
+# -*- coding: utf-8 -*-
+
+from array import array
+import time
+import unittest
+
+from .streaming import JointStreamer, columnar_batch
+
+
+class _Memory(object):
+    def getListData(self, keys):
+        return [1.5] * len(keys)
+
+
+class TestStreaming(unittest.TestCase):
+
+    def test_columnar_batch(self):
+        timestamps = array('d', [10.0, 10.1, 10.2, 0.0])
+        values = array('d', [1.0, 2.0, 3.0, 0.0])
+        record = columnar_batch(10.0, timestamps, [('a', values)], 3)
+        self.assertEqual(record['samples'], 3)
+        self.assertEqual(record['offsets_ms'], [0, 100, 200])
+        self.assertEqual(record['values'], {'a': [1.0, 2.0, 3.0]})
+
+    def test_stream_batches(self):
+        batches = []
+        streamer = JointStreamer(_Memory(), ['k1', 'k2'], ['a', 'b'], 20, 1.5,
+                                 lambda record, start: batches.append(record))
+        streamer.start()
+        streamer.thread.join(5)
+        self.assertFalse(streamer.is_alive())
+        self.assertEqual(len(batches), 2)
+        total = sum([batch['samples'] + batch['dropped'] for batch in batches])
+        self.assertTrue(25 <= total <= 31, total)
+        for batch in batches:
+            self.assertEqual(len(batch['values']['a']), batch['samples'])
+            self.assertEqual(len(batch['offsets_ms']), batch['samples'])
+            self.assertTrue(batch['jitter_max_ms'] >= 0)
+
+    def test_stop(self):
+        streamer = JointStreamer(_Memory(), ['k1'], ['a'], 10, 60,
+                                 lambda record, start: None)
+        streamer.start()
+        time.sleep(0.05)
+        streamer.stop()
+        streamer.thread.join(1)
+        self.assertFalse(streamer.is_alive())
+
+
+
+if __name__ == '__main__':
+    test_suite = unittest.TestLoader().loadTestsFromTestCase(TestStreaming)
+    unittest.TextTestRunner(verbosity=2).run(test_suite)
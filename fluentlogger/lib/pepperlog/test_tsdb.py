@@ -0,0 +1,136 @@
+# -*- coding: utf-8 -*-
+
+import os
+import shutil
+import tempfile
+import time
+import unittest
+
+from . import tsdb
+
+
+class TestCompression(unittest.TestCase):
+
+    def test_timestamps(self):
+        timestamps = [1500000000, 1500000060, 1500000120, 1500000185,
+                      1500000185, 1500000100]
+        out = bytearray()
+        tsdb.encode_timestamps(timestamps, out)
+        decoded, pos = tsdb.decode_timestamps(out, 0, len(timestamps))
+        self.assertEqual(decoded, timestamps)
+        self.assertEqual(pos, len(out))
+        # regular intervals cost one byte per point
+        regular = bytearray()
+        tsdb.encode_timestamps(range(1500000000, 1500006000, 60), regular)
+        self.assertEqual(len(regular), 5 + 5 + 98)
+
+    def test_values(self):
+        values = [42.0, 42.0, 42.5, -1e300, 0.0, 3.141592653589793, 42.0]
+        out = bytearray()
+        tsdb.encode_values(values, out)
+        decoded, pos = tsdb.decode_values(out, 0, len(values))
+        self.assertEqual(decoded, values)
+        self.assertEqual(pos, len(out))
+        repeated = bytearray()
+        tsdb.encode_values([38.0] * 10, repeated)
+        self.assertEqual(len(repeated), 3 + 9)
+
+    def test_corrupted_block(self):
+        block = tsdb._Block(1)
+        block.append(100, (1.0,))
+        data = block.encode()
+        self.assertEqual(tsdb.decode_block(data), [[100, 1.0]])
+        damaged = data[:-1] + (b'\0' if data[-1:] != b'\0' else b'\1')
+        self.assertRaises(ValueError, tsdb.decode_block, damaged)
+
+
+class TestMetricStore(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        # within the raw retention, on a segment boundary
+        self.base = (int(time.time()) // 3600 - 1) * 3600
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def fill(self, store, count, step=10):
+        for i in range(count):
+            store.record('cpu.busy', self.base + i * step, float(i % 7))
+
+    def query(self, store, start, end, resolution=0):
+        return [[row[0] - self.base] + row[1:] for row in store.query(
+            'cpu.busy', self.base + start, self.base + end, resolution)]
+
+    def test_query_raw_and_pending(self):
+        store = tsdb.MetricStore(self.directory, block_points=10)
+        self.fill(store, 25)
+        rows = self.query(store, 0, 1000)
+        self.assertEqual(len(rows), 25)
+        self.assertEqual(rows[3], [30, 3.0])
+        self.assertEqual(self.query(store, 95, 125),
+                         [[100, 3.0], [110, 4.0], [120, 5.0]])
+        self.assertEqual(store.query('missing', 0, self.base + 1000), [])
+
+    def test_rollups(self):
+        store = tsdb.MetricStore(self.directory)
+        for i in range(130):
+            store.record('cpu.busy', self.base + i * 10, float(i))
+        minutes = self.query(store, 0, 3600, resolution=60)
+        self.assertEqual(minutes[0], [0, 2.5, 0.0, 5.0])
+        # the current minute is not complete yet
+        self.assertEqual(len(minutes), 21)
+        self.assertEqual(self.query(store, 0, 3600, resolution=3600),
+                         [[0, 29.5, 0.0, 59.0], [600, 89.5, 60.0, 119.0]])
+
+    def test_reopen(self):
+        store = tsdb.MetricStore(self.directory, block_points=10)
+        self.fill(store, 25)
+        store.close()
+        store = tsdb.MetricStore(self.directory, block_points=10)
+        self.assertEqual(len(self.query(store, 0, 1000)), 25)
+        self.assertEqual(store.names(), ['cpu.busy'])
+        # older than what is stored
+        self.assertFalse(store.record('cpu.busy', self.base + 100, 1.0))
+        self.assertTrue(store.record('cpu.busy', self.base + 250, 1.0))
+
+    def test_truncated_segment(self):
+        store = tsdb.MetricStore(self.directory, block_points=10)
+        self.fill(store, 20)
+        path = os.path.join(self.directory, 'raw', 'cpu.busy',
+                            '%d.seg' % self.base)
+        with open(path, 'ab') as f:
+            f.write(b'\x01\x02\x03')
+        store = tsdb.MetricStore(self.directory, block_points=10)
+        self.assertEqual(len(self.query(store, 0, 1000)), 20)
+        self.assertEqual(store.stats()['disk_bytes'],
+                         os.path.getsize(path))
+
+    def test_retention(self):
+        tiers = (tsdb.Tier('raw', 0, 100, 50), tsdb.Tier('1m', 60, 400, 200))
+        store = tsdb.MetricStore(self.directory, tiers=tiers,
+                                 block_points=5)
+        self.fill(store, 60)
+        store.flush(now=self.base + 700)
+        self.assertEqual(self.query(store, 0, 1000)[0][0], 550)
+        self.assertEqual(self.query(store, 0, 1000, 60)[0][0], 240)
+
+    def test_disk_budget(self):
+        store = tsdb.MetricStore(self.directory, block_points=10,
+                                 disk_budget=20000)
+        # 30 hours of samples, the last hour within the raw retention
+        start = self.base - 29 * 3600
+        for i in range(1800):
+            store.record('cpu.busy', start + i * 60, float(i))
+        stats = store.stats()
+        self.assertTrue(stats['disk_bytes'] <= 20000)
+        self.assertTrue(stats['evicted'] > 0)
+        # raw segments go first, the rollups still cover older data
+        raw = store.query('cpu.busy', start, self.base + 3600)
+        ten_minutes = store.query('cpu.busy', start, self.base + 3600, 600)
+        self.assertTrue(raw)
+        self.assertTrue(ten_minutes[0][0] < raw[0][0])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,447 @@
+# -*- coding: utf-8 -*-
+
+from bisect import bisect_left
+import numbers
+import os
+import re
+import struct
+import threading
+import time
+import zlib
+
+# start, end, number of points, number of value columns, payload length,
+# payload CRC32
+_HEADER = struct.Struct('<IIHBII')
+_DOUBLE = struct.Struct('>d')
+_BITS = struct.Struct('>Q')
+_NAME = re.compile(r'^[A-Za-z0-9_.-]+$')
+
+
+class Tier(object):
+    """A resolution of the store.
+
+    :param step: seconds per point, 0 for the raw samples.
+    :param retention: seconds the points are kept.
+    :param segment: seconds covered by one segment file.
+    """
+    def __init__(self, name, step, retention, segment):
+        self.name = name
+        self.step = step
+        self.retention = retention
+        self.segment = segment
+        # raw points have one value, rollups have avg, min and max
+        self.columns = 3 if step else 1
+
+
+DEFAULT_TIERS = (Tier('raw', 0, 6 * 3600, 3600),
+                 Tier('1m', 60, 3 * 86400, 86400),
+                 Tier('10m', 600, 30 * 86400, 7 * 86400))
+
+
+# compression
+
+def _put_varint(out, value):
+    while value >= 0x80:
+        out.append((value & 0x7f) | 0x80)
+        value >>= 7
+    out.append(value)
+
+
+def _get_varint(data, pos):
+    result = 0
+    shift = 0
+    while True:
+        byte = data[pos]
+        pos += 1
+        result |= (byte & 0x7f) << shift
+        if byte < 0x80:
+            return result, pos
+        shift += 7
+
+
+def _zigzag(value):
+    return value << 1 if value >= 0 else (-value << 1) - 1
+
+
+def _unzigzag(value):
+    return -((value + 1) >> 1) if value & 1 else value >> 1
+
+
+def encode_timestamps(timestamps, out):
+    """Append integer timestamps as varint delta-of-deltas."""
+    previous = 0
+    delta = 0
+    for timestamp in timestamps:
+        new_delta = timestamp - previous
+        _put_varint(out, _zigzag(new_delta - delta))
+        previous = timestamp
+        delta = new_delta
+
+
+def decode_timestamps(data, pos, count):
+    timestamps = []
+    previous = 0
+    delta = 0
+    for _ in range(count):
+        value, pos = _get_varint(data, pos)
+        delta += _unzigzag(value)
+        previous += delta
+        timestamps.append(previous)
+    return timestamps, pos
+
+
+def encode_values(values, out):
+    """Append floats XORed with their predecessor.
+
+    A value equal to the previous one takes one byte; otherwise a header
+    byte gives the number of leading and trailing zero bytes of the XOR,
+    followed by the bytes in between.
+    """
+    previous = 0
+    for value in values:
+        bits = _BITS.unpack(_DOUBLE.pack(value))[0]
+        xor = bits ^ previous
+        previous = bits
+        if not xor:
+            out.append(0)
+            continue
+        raw = _BITS.pack(xor)
+        lead = 8 - len(raw.lstrip(b'\0'))
+        trail = 8 - len(raw.rstrip(b'\0'))
+        out.append(0x80 | lead << 3 | trail)
+        out.extend(bytearray(raw[lead:8 - trail]))
+
+
+def decode_values(data, pos, count):
+    values = []
+    previous = 0
+    for _ in range(count):
+        header = data[pos]
+        pos += 1
+        if header:
+            lead = (header >> 3) & 7
+            size = 8 - lead - (header & 7)
+            xor = _BITS.unpack(b'\0' * lead + bytes(data[pos:pos + size]) +
+                               b'\0' * (header & 7))[0]
+            pos += size
+            previous ^= xor
+        values.append(_DOUBLE.unpack(_BITS.pack(previous))[0])
+    return values, pos
+
+
+class _Block(object):
+    """Points of a metric not written yet."""
+    def __init__(self, columns):
+        self.timestamps = []
+        self.columns = [[] for _ in range(columns)]
+        self.created = time.time()
+
+    def append(self, timestamp, values):
+        self.timestamps.append(timestamp)
+        for column, value in zip(self.columns, values):
+            column.append(value)
+
+    def rows(self):
+        return [[t] + list(values) for t, values
+                in zip(self.timestamps, zip(*self.columns))]
+
+    def encode(self):
+        payload = bytearray()
+        encode_timestamps(self.timestamps, payload)
+        for column in self.columns:
+            encode_values(column, payload)
+        payload = bytes(payload)
+        return _HEADER.pack(self.timestamps[0], self.timestamps[-1],
+                            len(self.timestamps), len(self.columns),
+                            len(payload),
+                            zlib.crc32(payload) & 0xffffffff) + payload
+
+
+def decode_block(data):
+    """Return the rows of a block as encoded by `_Block.encode`."""
+    _, _, count, columns, length, crc = _HEADER.unpack_from(data)
+    payload = data[_HEADER.size:_HEADER.size + length]
+    if len(payload) != length or zlib.crc32(payload) & 0xffffffff != crc:
+        raise ValueError('corrupted block')
+    payload = bytearray(payload)
+    timestamps, pos = decode_timestamps(payload, 0, count)
+    decoded = []
+    for _ in range(columns):
+        values, pos = decode_values(payload, pos, count)
+        decoded.append(values)
+    return [[t] + list(values) for t, values
+            in zip(timestamps, zip(*decoded))]
+
+
+class _Series(object):
+    """One metric in one tier: its index and its open block."""
+    def __init__(self, tier):
+        self.tier = tier
+        # (start, end, path, offset, size) of the written blocks
+        self.index = []
+        self.ends = []
+        self.block = None
+        self.last = None
+
+    def add(self, entry):
+        self.index.append(entry)
+        self.ends.append(entry[1])
+
+
+class _Bucket(object):
+    """Aggregates the raw samples of a metric for one rollup point."""
+    def __init__(self, start, value):
+        self.start = start
+        self.sum = value
+        self.count = 1
+        self.min = value
+        self.max = value
+
+    def add(self, value):
+        self.sum += value
+        self.count += 1
+        self.min = min(self.min, value)
+        self.max = max(self.max, value)
+
+    def values(self):
+        return (self.sum / self.count, self.min, self.max)
+
+
+class MetricStore(object):
+    """Embedded time-series store for the robot metrics.
+
+    Every metric has an append-only segment file per tier and period in
+    ``directory/<tier>/<metric>/``. Samples go to an in-memory block that
+    is written once it holds `block_points` points or is `flush_age`
+    seconds old, times the step in minutes for the rollup tiers; blocks
+    store delta-of-delta timestamps and XOR compressed values. The raw
+    samples are also rolled up in the 1 min and 10 min tiers as average,
+    minimum and maximum.
+
+    The index of the blocks is kept in memory, read from the block
+    headers when the store opens, so a query only reads the blocks that
+    overlap its time range. Segments older than their tier's retention
+    are deleted, and so are the oldest segments, finest tier first, when
+    the store exceeds `disk_budget` bytes.
+
+    Timestamps are integer seconds; samples older than the last one of
+    their metric are dropped.
+    """
+    def __init__(self, directory, disk_budget=16 * 1024 * 1024,
+                 tiers=DEFAULT_TIERS, block_points=120, flush_age=300):
+        self.directory = directory
+        self.disk_budget = disk_budget
+        self.tiers = tiers
+        self.block_points = block_points
+        self.flush_age = flush_age
+        self.lock = threading.Lock()
+        # (tier name, metric) -> _Series
+        self.series = {}
+        # (tier name, metric) -> _Bucket
+        self.buckets = {}
+        # segment path -> [tier rank, start, size, series key]
+        self.segments = {}
+        self.dropped = 0
+        self.evicted = 0
+        self._load()
+
+    def record(self, name, timestamp, value):
+        """Add a sample, return False when it was dropped."""
+        if not _NAME.match(name):
+            raise ValueError('invalid metric name %r' % name)
+        timestamp = int(timestamp)
+        value = float(value)
+        with self.lock:
+            raw = self._series(self.tiers[0], name)
+            if raw.last is not None and timestamp < raw.last:
+                self.dropped += 1
+                return False
+            self._append(raw, name, timestamp, (value,))
+            for tier in self.tiers[1:]:
+                self._rollup(tier, name, timestamp, value)
+            return True
+
+    def record_many(self, prefix, values, timestamp):
+        """Record the numeric values of a dict as ``prefix.key``."""
+        for key, value in values.items():
+            if isinstance(value, numbers.Real) and \
+                    not isinstance(value, bool):
+                self.record('%s.%s' % (prefix, key), timestamp, value)
+
+    def query(self, name, start, end, resolution=0):
+        """Return the points of `name` between `start` and `end`.
+
+        The tier is the coarsest one whose step does not exceed
+        `resolution` seconds. Raw points are ``[time, value]``, rollup
+        points ``[time, avg, min, max]``.
+        """
+        tier = self.tiers[0]
+        for candidate in self.tiers:
+            if candidate.step <= resolution:
+                tier = candidate
+        with self.lock:
+            series = self.series.get((tier.name, name))
+            if series is None:
+                return []
+            entries = series.index[bisect_left(series.ends, start):]
+            entries = [entry for entry in entries if entry[0] <= end]
+            pending = series.block.rows() if series.block else []
+        rows = []
+        for _, _, path, offset, size in entries:
+            try:
+                with open(path, 'rb') as f:
+                    f.seek(offset)
+                    rows.extend(decode_block(f.read(size)))
+            except (IOError, ValueError):
+                # evicted or damaged since the index was read
+                continue
+        rows.extend(pending)
+        return [row for row in rows if start <= row[0] <= end]
+
+    def names(self):
+        with self.lock:
+            return sorted(set([name for _, name in self.series]))
+
+    def flush(self, now=None):
+        """Write the blocks older than `flush_age`, enforce retention."""
+        if now is None:
+            now = time.time()
+        with self.lock:
+            for (_, name), series in self.series.items():
+                age = self.flush_age * max(1, series.tier.step // 60)
+                if series.block is not None and \
+                        now - series.block.created >= age:
+                    self._write(series, name)
+            self._evict(now)
+
+    def close(self):
+        with self.lock:
+            for (_, name), series in self.series.items():
+                if series.block is not None:
+                    self._write(series, name)
+
+    def stats(self):
+        with self.lock:
+            return {'metrics': len(set([n for _, n in self.series])),
+                    'segments': len(self.segments),
+                    'disk_bytes': self._disk_usage(),
+                    'dropped': self.dropped,
+                    'evicted': self.evicted}
+
+    def _series(self, tier, name):
+        key = (tier.name, name)
+        series = self.series.get(key)
+        if series is None:
+            series = self.series[key] = _Series(tier)
+        return series
+
+    def _append(self, series, name, timestamp, values):
+        if series.block is None:
+            series.block = _Block(series.tier.columns)
+        elif timestamp // series.tier.segment != \
+                series.block.timestamps[0] // series.tier.segment:
+            # a block never spans two segments
+            self._write(series, name)
+            series.block = _Block(series.tier.columns)
+        series.block.append(timestamp, values)
+        series.last = timestamp
+        if len(series.block.timestamps) >= self.block_points:
+            self._write(series, name)
+
+    def _rollup(self, tier, name, timestamp, value):
+        key = (tier.name, name)
+        start = timestamp - timestamp % tier.step
+        bucket = self.buckets.get(key)
+        if bucket is not None and bucket.start == start:
+            bucket.add(value)
+            return
+        if bucket is not None:
+            self._append(self._series(tier, name), name, bucket.start,
+                         bucket.values())
+        self.buckets[key] = _Bucket(start, value)
+
+    def _write(self, series, name):
+        block = series.block
+        series.block = None
+        data = block.encode()
+        tier = series.tier
+        first = block.timestamps[0]
+        directory = os.path.join(self.directory, tier.name, name)
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+        path = os.path.join(directory,
+                            '%d.seg' % (first - first % tier.segment))
+        with open(path, 'ab') as f:
+            offset = f.tell()
+            f.write(data)
+        series.add((first, block.timestamps[-1], path, offset, len(data)))
+        self._segment(series, name, path, offset + len(data))
+        if self._disk_usage() > self.disk_budget:
+            self._evict(time.time())
+
+    def _segment(self, series, name, path, size):
+        segment = self.segments.get(path)
+        if segment is None:
+            start = int(os.path.basename(path)[:-len('.seg')])
+            segment = self.segments[path] = [
+                self.tiers.index(series.tier), start, size,
+                (series.tier.name, name)]
+        segment[2] = size
+
+    def _disk_usage(self):
+        return sum([segment[2] for segment in self.segments.values()])
+
+    def _evict(self, now):
+        for path, (rank, start, _, _) in list(self.segments.items()):
+            tier = self.tiers[rank]
+            if start + tier.segment < now - tier.retention:
+                self._remove(path)
+        while self.segments and self._disk_usage() > self.disk_budget:
+            # finest tier first, its points are also in the rollups
+            self._remove(min(self.segments,
+                             key=lambda p: self.segments[p][:2]))
+
+    def _remove(self, path):
+        _, _, _, key = self.segments.pop(path)
+        self.evicted += 1
+        try:
+            os.unlink(path)
+        except OSError:
+            pass
+        series = self.series[key]
+        series.index = [entry for entry in series.index if entry[2] != path]
+        series.ends = [entry[1] for entry in series.index]
+
+    def _load(self):
+        for tier in self.tiers:
+            root = os.path.join(self.directory, tier.name)
+            if not os.path.isdir(root):
+                continue
+            for name in sorted(os.listdir(root)):
+                directory = os.path.join(root, name)
+                segments = sorted([int(f[:-len('.seg')])
+                                   for f in os.listdir(directory)
+                                   if f.endswith('.seg')])
+                for start in segments:
+                    self._index(self._series(tier, name), name,
+                                os.path.join(directory, '%d.seg' % start))
+        self._evict(time.time())
+
+    def _index(self, series, name, path):
+        """Add the blocks of a segment to the index from their headers."""
+        size = os.path.getsize(path)
+        offset = 0
+        with open(path, 'rb+') as f:
+            while offset + _HEADER.size <= size:
+                f.seek(offset)
+                start, end, _, _, length, _ = _HEADER.unpack(
+                    f.read(_HEADER.size))
+                if offset + _HEADER.size + length > size:
+                    break
+                series.add((start, end, path, offset, _HEADER.size + length))
+                series.last = end
+                offset += _HEADER.size + length
+            if offset < size:
+                # a block cut short by a crash
+                f.truncate(offset)
+        self._segment(series, name, path, offset)